@@ -0,0 +1,228 @@
+"""
+准入控制
+
+放大类请求的内存和耗时由输出像素数决定：一张 8000x8000 的图片以5倍放大会分配
+16亿像素的输出图，足以让工作进程被OOM终止。请求进入执行池之前，先只读取图片
+文件头得到尺寸，按方法和放大倍数估算输出像素与内存：
+
+- 输入像素超过上限（解压炸弹，或单纯过大）直接拒绝，返回413；
+- 输出像素超过单请求上限时自动降低放大倍数，降到最小倍数仍超出则返回413；
+- 通过检查的请求在进程内的像素预算中预留输出像素，预算不足时按先后顺序排队，
+  等待超时或排队过多时返回429，并按最近的处理速度估算 Retry-After。
+"""
+
+import asyncio
+import logging
+import math
+import time
+import warnings
+from collections import deque
+from contextlib import asynccontextmanager
+
+from PIL import Image
+
+from executor import ExecutorError
+from image_io import probe
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# PIL 的RGB图片按每像素4字节存储
+BYTES_PER_PIXEL = 4
+
+
+class AdmissionError(ExecutorError):
+    """像素预算不足，稍后重试"""
+    status_code = 429
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ImageTooLargeError(AdmissionError):
+    """图片或输出尺寸超出上限，重试也无法处理"""
+    status_code = 413
+
+
+def install_bomb_guard(max_pixels):
+    """让所有解码路径都拒绝像素数超过 max_pixels 的图片
+
+    PIL 默认只在超过上限两倍时报错，这里把超过上限时的警告也提升为错误。
+    """
+    Image.MAX_IMAGE_PIXELS = max_pixels or None
+    warnings.simplefilter("error", Image.DecompressionBombWarning)
+
+
+class Cost:
+    """一次请求的估算成本"""
+
+    def __init__(self, width, height, scale_factors, requested_scale=None, base_cache_pixels=0):
+        self.width = width
+        self.height = height
+        # 每种方法实际使用的放大倍数
+        self.scale_factors = list(scale_factors)
+        self.requested_scale = requested_scale
+        self.base_cache_pixels = base_cache_pixels
+        self.input_pixels = width * height
+        self.output_pixels = sum(self.input_pixels * scale * scale for scale in self.scale_factors)
+        # 不超过 base_cache_pixels 的放大基础图（每种放大倍数一张）放入图片缓存，与输出图同时存在
+        self.base_pixels = sum(self.input_pixels * scale * scale for scale in set(self.scale_factors)
+                               if self.input_pixels * scale * scale <= base_cache_pixels)
+        # 解码后的原图 + 放大基础图 + 各方法的输出图；分块处理的工作内存由引擎的预算单独限制
+        self.memory_bytes = (self.input_pixels + self.base_pixels + self.output_pixels) * BYTES_PER_PIXEL
+
+    @property
+    def working_pixels(self):
+        """处理期间同时存在的像素数，按它占用像素预算"""
+        return max(self.output_pixels + self.base_pixels, self.input_pixels)
+
+    @property
+    def max_scale(self):
+        return max(self.scale_factors)
+
+    @property
+    def downgraded(self):
+        return self.requested_scale is not None and self.max_scale < self.requested_scale
+
+    def describe(self):
+        return {
+            "width": self.width,
+            "height": self.height,
+            "scale_factor": self.max_scale,
+            "output_pixels": self.output_pixels,
+            "memory_mb": round(self.memory_bytes / 1024 / 1024, 1),
+        }
+
+
+class AdmissionController:
+    """按估算的输出像素做准入控制
+
+    max_input_pixels: 输入图片像素上限；max_output_pixels: 单个请求的输出像素上限；
+    pixel_budget: 本进程同时处理中的输出像素总量上限；
+    auto_downgrade: 输出超出上限时是否自动降低放大倍数，最低降到 min_scale；
+    max_wait: 预算不足时默认的最长排队时间（秒）；max_waiting: 允许排队的请求数；
+    base_cache_pixels: 管线缓存放大基础图的像素上限，估算的成本包含缓存的基础图。
+    """
+
+    def __init__(self, max_input_pixels, max_output_pixels, pixel_budget, auto_downgrade=True,
+                 min_scale=2, max_wait=10, max_waiting=16, base_cache_pixels=0):
+        self.base_cache_pixels = base_cache_pixels
+        self.max_input_pixels = max_input_pixels
+        self.max_output_pixels = max_output_pixels
+        self.pixel_budget = pixel_budget
+        self.auto_downgrade = auto_downgrade
+        self.min_scale = min_scale
+        self.max_wait = max_wait
+        self.max_waiting = max_waiting
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.downgraded = 0
+        self._waiters = deque()
+        # 最近的处理速度（输出像素/秒），用于估算 Retry-After
+        self._rate = None
+
+    def plan(self, img_bytes, scale_factors=(1,)):
+        """只读取文件头，估算按 scale_factors 处理的成本，必要时降低放大倍数
+
+        尺寸超出上限时抛出 ImageTooLargeError。
+        """
+        try:
+            width, height = probe(img_bytes).size
+        except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+            self.rejected += 1
+            raise ImageTooLargeError("图片像素数超出上限")
+        if self.max_input_pixels and width * height > self.max_input_pixels:
+            self.rejected += 1
+            raise ImageTooLargeError(f"图片尺寸 {width}x{height} 超出上限")
+
+        requested = max(scale_factors)
+        cost = Cost(width, height, scale_factors, requested, self.base_cache_pixels)
+        if not self.max_output_pixels or cost.output_pixels <= self.max_output_pixels:
+            return cost
+        if self.auto_downgrade:
+            for cap in range(requested - 1, self.min_scale - 1, -1):
+                cost = Cost(width, height, [min(scale, cap) for scale in scale_factors], requested,
+                            self.base_cache_pixels)
+                if cost.output_pixels <= self.max_output_pixels:
+                    self.downgraded += 1
+                    logger.warning(f"输出尺寸超出上限，放大倍数从 {requested} 降为 {cap}: {width}x{height}")
+                    return cost
+        self.rejected += 1
+        raise ImageTooLargeError(f"图片尺寸 {width}x{height} 按 {requested} 倍放大后超出上限")
+
+    def _fits(self, pixels):
+        # 超过整个预算的请求在没有其他请求处理时单独放行，避免永远等待
+        return self.in_flight == 0 or self.in_flight + pixels <= self.pixel_budget
+
+    def retry_after(self, pixels):
+        """按最近的处理速度估算腾出 pixels 预算需要的秒数"""
+        backlog = self.in_flight + sum(waiting for waiting, _ in self._waiters) + pixels - self.pixel_budget
+        if not self._rate or backlog <= 0:
+            return 1
+        return max(1, min(120, math.ceil(backlog / self._rate)))
+
+    async def acquire(self, pixels, max_wait=...):
+        """预留 pixels 预算，不足时排队；max_wait 为None时一直等待"""
+        if max_wait is ...:
+            max_wait = self.max_wait
+        if not self.pixel_budget or (not self._waiters and self._fits(pixels)):
+            self.in_flight += pixels
+            self.admitted += 1
+            return
+        if max_wait is not None and (max_wait <= 0 or len(self._waiters) >= self.max_waiting):
+            self.rejected += 1
+            raise AdmissionError("服务器繁忙，请稍后重试", self.retry_after(pixels))
+
+        waiter = (pixels, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[1]), max_wait)
+        except asyncio.TimeoutError:
+            if waiter[1].done():
+                # 超时的同时已被放行
+                return
+            self._waiters.remove(waiter)
+            self.rejected += 1
+            raise AdmissionError("服务器繁忙，请稍后重试", self.retry_after(pixels))
+        except asyncio.CancelledError:
+            if waiter[1].done():
+                self.release(pixels)
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, pixels, seconds=None):
+        """释放预算并按先后顺序放行排队中的请求"""
+        self.in_flight -= pixels
+        if seconds:
+            rate = pixels / seconds
+            self._rate = rate if self._rate is None else 0.8 * self._rate + 0.2 * rate
+        while self._waiters and self._fits(self._waiters[0][0]):
+            waiting, future = self._waiters.popleft()
+            self.in_flight += waiting
+            self.admitted += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def reserve(self, cost, max_wait=...):
+        """在 with 块内占用 cost 的输出像素预算"""
+        pixels = cost.working_pixels
+        await self.acquire(pixels, max_wait)
+        started = time.perf_counter()
+        try:
+            yield cost
+        finally:
+            self.release(pixels, time.perf_counter() - started)
+
+    def stats(self):
+        """准入状态，供健康检查使用"""
+        return {
+            "pixel_budget": self.pixel_budget,
+            "in_flight_pixels": self.in_flight,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "downgraded": self.downgraded,
+        }
@@ -1,72 +1,129 @@
+import time
+# 记录进程启动时间，用于报告启动耗时
+BOOT_STARTED = time.perf_counter()
 import os
+import asyncio
+from contextlib import asynccontextmanager
 import base64
 import aiofiles
 from sanic import Sanic, Request
-from sanic.response import json
+from sanic.response import json, text
 from sanic_cors import CORS
 from PIL import Image, ImageEnhance, ImageFilter, ImageOps
 import io
-import traceback
 import json as json_lib
 from datetime import datetime
 import numpy as np
 import logging
+from executor import EnhancementExecutor, ExecutorError
+from admission import AdmissionController, Cost, ImageTooLargeError, install_bomb_guard
+from jobs import JobManager, create_job_store, fail_unfinished_jobs, DONE, FAILED
+from tiling import TiledEngine, KernelStage, ContrastStage, ColorStage, BrightnessStage, GrayscaleStage
+from fused import apply_point_stages, apply_repeated_filter
+from image_io import fix_image_orientation, describe_source, open_image
+from pipeline import get_pipeline, list_methods, run_pipeline, run_pipelines
+from resize import configure_threads, load_policy
+from encoding import EncodeOptions, DEFAULT_QUALITY, encode, cached_stats, parse_bool, stats_headers
+from responses import negotiate, send_image, send_multipart, send_stream, BINARY, JSON, NDJSON, EVENTS, FORMAT_MIME
+from cache import ResultCache, content_digest, make_key, process_image_cache
+import model_registry
+import metrics
+from preview import PreviewStore, make_proxy
+from pyramid import create_pyramid, reduce_image
+from poster import PosterLayout, PosterCompositor, render_cell, render_poster
+from log_pipeline import setup_logging, set_request_id, current_request_id, run_with_request_id
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('image_enhancer.log', encoding='utf-8')
-    ]
-)
+# 配置日志：记录放入内存队列，由后台线程写入控制台和文件
+log_pipeline = setup_logging('image_enhancer.log', level=logging.INFO)
 logger = logging.getLogger(__name__)
+# 滤镜和调整的逐阶段日志，级别由 LOG_STAGE_LEVEL 控制（见 log_pipeline.STAGE_LOGGERS）
+stage_logger = logging.getLogger("app.edits")
 
 app = Sanic("image_enhancer")
 CORS(app)
 
 # 配置
 app.config.UPLOAD_FOLDER = "uploads"
-app.config.MAX_CONTENT_LENGTH = 0  # 无限制
+app.config.REQUEST_MAX_SIZE = 100 * 1024 * 1024  # 请求体大小上限（字节），超出时返回413
+app.config.TILE_MEMORY_BUDGET = 256 * 1024 * 1024  # 分块处理每块的工作内存预算（字节）
+app.config.POINT_OPS_BACKEND = "fused"  # 对比度/饱和度/亮度链：fused 融合为一次遍历，opencv 融合后在数组上执行（多次锐化合并为一次卷积），pil 逐阶段执行
+app.config.POINT_OPS_VERIFY = False     # 校验模式：同时运行PIL链并比较，超出容差时使用PIL结果
+# 后面还有锐化/边缘增强的颜色阶段组只在逐位精确（纯亮度/对比度查找表）时融合，其余按PIL链执行，
+# 因此增强方法的最终结果与 pil 后端的差异不超过2级；opencv 后端的合并锐化另有差异，见 fused.apply_repeated_filter
+app.config.POINT_OPS_TOLERANCE = 4      # 校验模式允许的最大逐像素差异
+app.config.RESIZE_BACKEND = "auto"      # 放大后端：pil、opencv，auto 按 RESIZE_POLICY_FILE 的实测策略选择（没有策略文件时使用 pil）
+app.config.RESIZE_POLICY_FILE = ""      # benchmark.py --resize-policy 生成的策略文件
+app.config.RESIZE_KERNELS = {}          # 按方法覆盖放大插值核（lanczos/cubic/area/bilinear），如 {"traditional": "cubic"}
+app.config.RESIZE_THREADS = 0           # 每个工作进程 cv2.resize 的线程数（cv2.setNumThreads），0 表示OpenCV默认
+app.config.SPILL_THRESHOLD = 0          # 超过该字节数的上传先写入磁盘再处理，0 表示始终在内存中处理
+app.config.STREAM_CHUNK_SIZE = 256 * 1024  # 二进制/multipart响应每次发送的字节数
+app.config.BATCH_CONCURRENCY = 4        # 批量增强同时处理的图片数，各条目分散到执行池的工作者
 
-# 确保上传目录存在
-os.makedirs(app.config.UPLOAD_FOLDER, exist_ok=True)
+# 海报配置
+app.config.POSTER_CELL_SIZE = 280         # 默认单元格边长（像素），客户端可通过 cell_size 指定
+app.config.POSTER_MAX_CELL_SIZE = 1024    # 单元格边长上限
+app.config.POSTER_CELL_PADDING = 10       # 单元格四周的留白（像素）
+app.config.POSTER_CELL_CONCURRENCY = 0    # 大于0时单元格分散到执行池，同时处理的单元格数；0 表示整张海报在一个任务中逐行合成
 
-def fix_image_orientation(image):
-    """修复图片方向问题，处理EXIF信息"""
-    try:
-        logger.info("开始修复图片方向...")
-        # 检查是否有EXIF信息
-        if hasattr(image, '_getexif') and image._getexif() is not None:
-            exif = image._getexif()
-            if exif is not None:
-                # 获取方向信息
-                orientation = exif.get(274)  # 274 是方向标签的ID
-                if orientation is not None:
-                    logger.info(f"检测到图片方向信息: {orientation}")
-                    # 根据方向信息旋转图片
-                    if orientation == 3:
-                        image = image.rotate(180, expand=True)
-                        logger.info("图片旋转180度")
-                    elif orientation == 6:
-                        image = image.rotate(270, expand=True)
-                        logger.info("图片旋转270度")
-                    elif orientation == 8:
-                        image = image.rotate(90, expand=True)
-                        logger.info("图片旋转90度")
-                else:
-                    logger.info("未检测到方向信息，保持原方向")
-            else:
-                logger.info("无EXIF信息，保持原方向")
-        else:
-            logger.info("图片无EXIF属性，保持原方向")
-    except Exception as e:
-        logger.error(f"修复图片方向时出错: {e}")
-    
-    return image
+# 缓存配置
+app.config.RESULT_CACHE_SIZE = 256 * 1024 * 1024        # 结果缓存内存层上限（字节），0 表示关闭
+app.config.RESULT_CACHE_DIR = ""                        # 结果缓存磁盘层目录，空表示不使用磁盘层
+app.config.RESULT_CACHE_DISK_SIZE = 2 * 1024 * 1024 * 1024  # 磁盘层总大小上限（字节）
+app.config.IMAGE_CACHE_SIZE = 512 * 1024 * 1024         # 每个工作进程缓存已解码/已放大图片的上限（字节），0 表示关闭
+app.config.UPSCALED_CACHE_PIXELS = 8_000_000            # 放大基础图不超过该像素数时才放入图片缓存（计入准入估算），
+                                                        # 更大的输出分块处理、不保留整张基础图；0 表示不缓存基础图
+
+# 预览配置：滤镜/调整作用于按视口缩小的代理图，导出时才渲染全分辨率
+app.config.PREVIEW_MAX_EDGE = 1600        # 代理图长边上限（像素），客户端可按视口请求更小的尺寸
+app.config.PREVIEW_DEFAULT_EDGE = 1024    # 客户端未指定视口尺寸时的代理图长边
+app.config.PREVIEW_QUALITY = 80           # 预览结果的JPEG/WebP编码质量
+app.config.PREVIEW_MAX_SESSIONS = 32      # 每个服务进程保留的预览会话数
+app.config.PREVIEW_SESSION_TTL = 1800     # 预览会话空闲过期时间（秒）
 
+# 结果金字塔：增强结果保存在服务端，调整/滤镜请求以句柄和级别引用，不再回传图片
+app.config.PYRAMID_MAX_SESSIONS = 16      # 每个服务进程保留的金字塔数
+app.config.PYRAMID_MAX_BYTES = 1024 * 1024 * 1024  # 每个服务进程中金字塔（原字节 + 已缓存级别）的总大小上限，0 表示不限制
+app.config.PYRAMID_THREAD_PIXELS = 4_000_000  # 不超过该像素数的级别缓存在金字塔中并直接在线程中处理，更大的级别走执行池和准入控制
+app.config.PYRAMID_TTL = 1800             # 金字塔空闲过期时间（秒）
+app.config.PYRAMID_MAX_LEVELS = 6         # 最多级数（第0级为全分辨率，每级长宽减半）
 
+# 准入控制：按文件头估算的输出像素限制单个请求和同时处理的总量
+app.config.MAX_INPUT_PIXELS = 80_000_000       # 输入图片像素上限，超出（含解压炸弹）返回413
+app.config.MAX_OUTPUT_PIXELS = 128_000_000     # 单个请求的输出像素上限（多方法请求为各方法之和）
+app.config.AUTO_DOWNGRADE_SCALE = True         # 输出超出上限时自动降低放大倍数，否则返回413
+app.config.MIN_SCALE_FACTOR = 2                # 自动降级时的最小放大倍数
+app.config.PIXEL_BUDGET = 256_000_000          # 每个服务进程同时处理中的输出像素总量，0 表示不限制
+app.config.ADMISSION_MAX_WAIT = 10             # 预算不足时同步请求的最长排队时间（秒），超时返回429
+app.config.ADMISSION_MAX_WAITING = 16          # 允许排队等待预算的请求数，超出直接返回429
+
+# 日志配置
+app.config.LOG_SAMPLE_RATE = 1.0        # 记录详细日志（INFO及以下）的请求比例，警告和错误始终记录
+app.config.LOG_STAGE_LEVEL = "INFO"     # 图像处理模块逐阶段日志的级别，设为 WARNING 可关闭
+
+# AI模型配置：模型在首次AI请求时加载，每个进程共享一份
+app.config.AI_MODEL_BACKEND = "eager"   # 推理后端：eager、torchscript 或 onnx
+app.config.AI_MODEL_WEIGHTS = ""        # 权重文件路径，各进程以mmap方式共享权重页；文件不存在时写入当前初始化的权重。
+                                        # 空表示不使用文件，各进程以固定种子初始化，各自持有一份权重
+app.config.AI_MODEL_WARMUP = False      # 启动时预加载模型并预热，之后创建的执行池进程（fork）以写时复制方式共享
+
+# 执行池配置（可通过 SANIC_POOL_WORKERS 等环境变量覆盖）
+app.config.POOL_KIND = "process"       # process 或 thread；Sanic 的工作进程（包括只有一个时）是守护进程，不能创建子进程，
+                                       # 进程池只在单进程模式下生效（run_server 会自动启用），否则改用线程池（见 /api/health）
+app.config.POOL_WORKERS = 0            # 0 表示使用CPU核心数
+app.config.POOL_MAX_QUEUE = 32         # 工作者全忙时允许排队的任务数
+app.config.POOL_TASK_TIMEOUT = 300     # 单个任务超时（秒），0 表示不限制
+
+# 异步任务队列配置
+app.config.JOB_STORE = "memory"        # memory 或 sqlite
+app.config.JOB_DB_PATH = "jobs.sqlite3"
+app.config.JOB_TTL = 3600              # 已结束任务的保留时间（秒）
+app.config.JOB_LANES = {"fast": 2, "slow": 1}  # 各优先级通道的并发任务数
+app.config.JOB_METHOD_LANES = {"super_clear": "slow", "super_quality": "slow"}
+app.config.JOB_DEFAULT_LANE = "fast"
+app.config.JOB_ITEM_CONCURRENCY = 4    # 批量任务内同时处理的图片数
+
+# 确保上传目录存在
+os.makedirs(app.config.UPLOAD_FOLDER, exist_ok=True)
 
 def allowed_file(filename):
     """检查文件格式是否允许"""
@@ -74,426 +131,820 @@ def allowed_file(filename):
         'png', 'jpg', 'jpeg', 'gif', 'bmp'
     }
 
-def enhance_basic(image_path, scale_factor=2):
-    """基础图像增强方法 - 优化版本，避免过度处理"""
+def create_engine():
+    """按配置创建分块引擎
+
+    除输出图外的峰值内存受 TILE_MEMORY_BUDGET 限制，结果与整幅处理一致。
+    """
+    configure_threads(app.config.RESIZE_THREADS)
+    return TiledEngine(app.config.TILE_MEMORY_BUDGET,
+                       point_backend=app.config.POINT_OPS_BACKEND,
+                       verify_tolerance=point_ops_tolerance())
+
+def resize_policy():
+    """按配置选择各方法放大后端和插值核的策略"""
+    return load_policy(app.config.RESIZE_BACKEND, app.config.RESIZE_POLICY_FILE,
+                       tuple(sorted(app.config.RESIZE_KERNELS.items())))
+
+def point_ops_tolerance():
+    """校验模式下的容差，未开启校验时返回None"""
+    return app.config.POINT_OPS_TOLERANCE if app.config.POINT_OPS_VERIFY else None
+
+def apply_color_stages(image, stages, before_kernel=False):
+    """执行逐像素颜色阶段，按配置融合为一次遍历或逐阶段执行
+
+    before_kernel 表示之后还要锐化，这时只融合逐位精确的阶段链。
+    """
+    return apply_point_stages(image, stages, backend=app.config.POINT_OPS_BACKEND,
+                              verify_tolerance=point_ops_tolerance(), before_kernel=before_kernel)
+
+def format_timings(timings):
+    """阶段耗时（秒）转换为毫秒，便于日志和响应展示"""
+    return {label: round(seconds * 1000, 1) for label, seconds in timings.items()}
+
+def worker_image_cache():
+    """当前进程的已解码/已放大图片缓存"""
+    return process_image_cache(app.config.IMAGE_CACHE_SIZE)
+
+def decode_oriented(img_bytes):
+    """解码图片字节并修复方向，分别记录解码和方向修复的耗时"""
+    with metrics.span("decode"):
+        img = open_image(img_bytes)
+        img.load()
+    with metrics.span("orient"):
+        return fix_image_orientation(img)
+
+def load_oriented(img_bytes):
+    """解码图片字节并修复方向，同一张图片的重复请求复用缓存中的解码结果"""
+    cache = worker_image_cache()
+    if not cache.max_bytes:
+        return decode_oriented(img_bytes)
+    key = ("oriented", content_digest(img_bytes))
+    img = cache.get(key)
+    if img is None:
+        img = decode_oriented(img_bytes)
+        cache.put(key, img)
+    else:
+        logger.info("命中已解码图片缓存")
+    return img
+
+def enhance_with_pipeline(source, method, scale_factor=None, extra_stages=()):
+    """按注册表中的增强方法处理图片，失败返回None
+
+    source 可以是文件路径、图片字节或文件对象；extra_stages 追加在方法的阶段之后执行。
+    """
+    pipeline = get_pipeline(method)
     try:
-        logger.info(f"开始基础增强: {image_path}")
-        # 读取图像
-        img = Image.open(image_path)
-        
-        # 修复图片方向
-        img = fix_image_orientation(img)
-        
-        # 转换为RGB模式（处理RGBA等格式）
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-            logger.info("图片已转换为RGB模式")
-        
-        # 1. 放大图像
-        width, height = img.size
-        new_width = width * scale_factor
-        new_height = height * scale_factor
-        enhanced = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        logger.info(f"图片已放大到 {new_width}x{new_height}")
-        
-        # 2. 轻微锐化
-        enhanced = enhanced.filter(ImageFilter.SHARPEN)
-        logger.info("图片已轻微锐化")
-        
-        # 3. 适中的对比度增强
-        enhancer = ImageEnhance.Contrast(enhanced)
-        enhanced = enhancer.enhance(1.05)  # 降低对比度增强强度
-        logger.info("图片对比度已增强")
-        
-        # 4. 轻微的亮度增强
-        enhancer = ImageEnhance.Brightness(enhanced)
-        enhanced = enhancer.enhance(1.01)  # 轻微提升亮度
-        logger.info("图片亮度已增强")
-        
-        logger.info(f"基础增强完成: {image_path}")
+        logger.info(f"开始{pipeline.name}: {describe_source(source)}")
+        enhanced, timings = run_pipeline(source, pipeline.id, create_engine(), scale_factor, worker_image_cache(),
+                                         extra_stages=extra_stages, resize_policy=resize_policy(),
+                                         base_cache_pixels=app.config.UPSCALED_CACHE_PIXELS)
+        metrics.observe_timings(timings, f"enhance/{pipeline.id}")
+        logger.info(f"图片已放大到 {enhanced.width}x{enhanced.height} 并完成增强")
+        logger.info(f"{pipeline.name}完成: {describe_source(source)}, 阶段耗时(ms): {format_timings(timings)}")
         return enhanced
-        
     except Exception as e:
-        logger.error(f"基础增强失败: {e}")
-        print(f"错误详情: {traceback.format_exc()}")
+        logger.exception(f"{pipeline.name}失败: {e}")
         return None
 
-def enhance_quality_basic(image_path, scale_factor=2):
+def enhance_basic(source, scale_factor=2):
+    """基础图像增强方法 - 优化版本，避免过度处理"""
+    return enhance_with_pipeline(source, "traditional", scale_factor)
+
+def enhance_quality_basic(source, scale_factor=2):
     """质量优先的基础增强方法 - 优化版本，避免过度处理"""
-    try:
-        logger.info(f"开始质量增强: {image_path}")
-        img = Image.open(image_path)
-        
-        # 修复图片方向
-        img = fix_image_orientation(img)
-        
-        # 转换为RGB模式
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-            logger.info("图片已转换为RGB模式")
-        
-        # 1. 高质量放大
-        width, height = img.size
-        new_width = width * scale_factor
-        new_height = height * scale_factor
-        enhanced = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        logger.info(f"图片已高质量放大到 {new_width}x{new_height}")
-        
-        # 2. 温和的锐化
-        enhanced = enhanced.filter(ImageFilter.SHARPEN)
-        logger.info("图片已温和锐化")
-        
-        # 3. 适中的对比度增强
-        enhancer = ImageEnhance.Contrast(enhanced)
-        enhanced = enhancer.enhance(1.08)  # 降低对比度增强强度
-        logger.info("图片对比度已增强")
-        
-        # 4. 轻微的饱和度增强
-        enhancer = ImageEnhance.Color(enhanced)
-        enhanced = enhancer.enhance(1.03)  # 降低饱和度增强强度
-        logger.info("图片饱和度已增强")
-        
-        # 5. 轻微的亮度调整
-        enhancer = ImageEnhance.Brightness(enhanced)
-        enhanced = enhancer.enhance(1.01)  # 轻微提升亮度
-        logger.info("图片亮度已调整")
-        
-        logger.info(f"质量增强完成: {image_path}")
-        return enhanced
-        
-    except Exception as e:
-        logger.error(f"质量增强失败: {e}")
-        print(f"错误详情: {traceback.format_exc()}")
-        return None
+    return enhance_with_pipeline(source, "quality_basic", scale_factor)
 
-def enhance_advanced(image_path, scale_factor=2):
+def enhance_advanced(source, scale_factor=2):
     """高级图像增强方法 - 优化版本，避免过度处理"""
-    try:
-        logger.info(f"开始高级增强: {image_path}")
-        img = Image.open(image_path)
-        
-        # 修复图片方向
-        img = fix_image_orientation(img)
-        
-        # 转换为RGB模式
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-            logger.info("图片已转换为RGB模式")
-        
-        # 1. 高质量放大
-        width, height = img.size
-        new_width = width * scale_factor
-        new_height = height * scale_factor
-        
-        # 使用LANCZOS进行高质量放大
-        enhanced = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        logger.info(f"图片已高质量放大到 {new_width}x{new_height}")
-        
-        # 2. 温和的锐化处理
-        enhanced = enhanced.filter(ImageFilter.SHARPEN)
-        logger.info("图片已温和锐化处理")
-        
-        # 3. 适中的对比度增强
-        enhancer = ImageEnhance.Contrast(enhanced)
-        enhanced = enhancer.enhance(1.1)  # 降低对比度增强强度
-        logger.info("图片对比度已增强")
-        
-        # 4. 轻微的饱和度增强
-        enhancer = ImageEnhance.Color(enhanced)
-        enhanced = enhancer.enhance(1.05)  # 降低饱和度增强强度
-        logger.info("图片饱和度已增强")
-        
-        # 5. 轻微的亮度调整
-        enhancer = ImageEnhance.Brightness(enhanced)
-        enhanced = enhancer.enhance(1.02)  # 轻微提升亮度
-        logger.info("图片亮度已调整")
-        
-        # 6. 边缘增强（只做一次）
-        enhanced = enhanced.filter(ImageFilter.EDGE_ENHANCE)
-        logger.info("图片已边缘增强")
-        
-        logger.info(f"高级增强完成: {image_path}")
-        return enhanced
-        
-    except Exception as e:
-        logger.error(f"高级增强失败: {e}")
-        print(f"错误详情: {traceback.format_exc()}")
-        return None
+    return enhance_with_pipeline(source, "advanced", scale_factor)
 
-def enhance_super_clear(image_path, scale_factor=5):
+def enhance_super_clear(source, scale_factor=5):
     """极致超级清晰算法 - 重新优化版本，追求极致清晰度"""
-    try:
-        logger.info(f"开始极致超级清晰增强: {image_path}")
-        img = Image.open(image_path)
-        
-        # 修复图片方向
-        img = fix_image_orientation(img)
-        
-        # 转换为RGB模式
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-            logger.info("图片已转换为RGB模式")
-        
-        # 第一阶段：高质量放大
-        width, height = img.size
-        target_width = width * scale_factor
-        target_height = height * scale_factor
-        
-        # 使用LANCZOS进行高质量放大
-        enhanced = img.resize((target_width, target_height), Image.Resampling.LANCZOS)
-        logger.info(f"图片已高质量放大到 {target_width}x{target_height}")
-        
-        # 第二阶段：多级锐化处理 - 增强清晰度
-        enhanced = enhanced.filter(ImageFilter.SHARPEN)
-        logger.info("图片已多级锐化处理")
-        enhanced = enhanced.filter(ImageFilter.EDGE_ENHANCE)
-        logger.info("图片已多级锐化处理")
-        enhanced = enhanced.filter(ImageFilter.EDGE_ENHANCE_MORE)
-        logger.info("图片已多级锐化处理")
-        
-        # 第三阶段：强对比度增强 - 突出细节
-        enhancer = ImageEnhance.Contrast(enhanced)
-        enhanced = enhancer.enhance(1.25)  # 增强对比度强度
-        logger.info("图片对比度已增强")
-        
-        # 第四阶段：饱和度增强 - 让色彩更鲜艳
-        enhancer = ImageEnhance.Color(enhanced)
-        enhanced = enhancer.enhance(1.2)  # 增强饱和度强度
-        logger.info("图片饱和度已增强")
-        
-        # 第五阶段：亮度调整 - 确保细节可见
-        enhancer = ImageEnhance.Brightness(enhanced)
-        enhanced = enhancer.enhance(1.05)  # 适度提升亮度
-        logger.info("图片亮度已调整")
-        
-        # 第六阶段：再次锐化 - 强化边缘细节
-        enhanced = enhanced.filter(ImageFilter.SHARPEN)
-        logger.info("图片已再次锐化")
-        
-        # 第七阶段：最终边缘增强 - 确保极致清晰
-        enhanced = enhanced.filter(ImageFilter.EDGE_ENHANCE_MORE)
-        logger.info("图片已最终边缘增强")
-        
-        # 第八阶段：最终锐化 - 确保每个细节都清晰可见
-        enhanced = enhanced.filter(ImageFilter.SHARPEN)
-        logger.info("图片已最终锐化")
-        
-        logger.info(f"极致超级清晰增强完成: {image_path}")
-        return enhanced
-        
-    except Exception as e:
-        logger.error(f"极致超级清晰增强失败: {e}")
-        print(f"错误详情: {traceback.format_exc()}")
-        return None
+    return enhance_with_pipeline(source, "super_clear", scale_factor)
 
-def enhance_super_quality(image_path, scale_factor=2):
+def enhance_super_quality(source, scale_factor=2):
     """超级质量增强方法 - 优化版本，避免过度处理"""
-    try:
-        logger.info(f"开始超级质量增强: {image_path}")
-        img = Image.open(image_path)
-        
-        # 修复图片方向
-        img = fix_image_orientation(img)
-        
-        # 转换为RGB模式
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-            logger.info("图片已转换为RGB模式")
-        
-        # 1. 高质量放大 - 使用LANCZOS算法
-        width, height = img.size
-        target_width = width * scale_factor
-        target_height = height * scale_factor
-        
-        # 直接使用LANCZOS进行高质量放大，避免分步放大导致的失真
-        enhanced = img.resize((target_width, target_height), Image.Resampling.LANCZOS)
-        logger.info(f"图片已高质量放大到 {target_width}x{target_height}")
-        
-        # 2. 温和的锐化处理 - 避免过度锐化
-        enhanced = enhanced.filter(ImageFilter.SHARPEN)
-        logger.info("图片已温和锐化处理")
-        
-        # 3. 对比度增强 - 使用适中的参数
-        enhancer = ImageEnhance.Contrast(enhanced)
-        enhanced = enhancer.enhance(1.1)  # 降低对比度增强强度
-        logger.info("图片对比度已增强")
-        
-        # 4. 饱和度增强 - 保持自然色彩
-        enhancer = ImageEnhance.Color(enhanced)
-        enhanced = enhancer.enhance(1.05)  # 降低饱和度增强强度
-        logger.info("图片饱和度已增强")
-        
-        # 5. 亮度微调 - 轻微提升
-        enhancer = ImageEnhance.Brightness(enhanced)
-        enhanced = enhancer.enhance(1.02)  # 轻微提升亮度
-        logger.info("图片亮度已调整")
-        
-        # 6. 细节增强 - 使用边缘增强而非锐化
-        enhanced = enhanced.filter(ImageFilter.EDGE_ENHANCE)
-        logger.info("图片已细节增强")
-        
-        logger.info(f"超级质量增强完成: {image_path}")
-        return enhanced
-        
-    except Exception as e:
-        logger.error(f"超级质量增强失败: {e}")
-        print(f"错误详情: {traceback.format_exc()}")
-        return None
+    return enhance_with_pipeline(source, "super_quality", scale_factor)
 
 
+# 滤镜预设：每个滤镜是一串逐像素颜色阶段
+FILTER_PRESETS = {
+    # 经典黑白
+    "blackwhite": [GrayscaleStage()],
+    # 复古效果：降低饱和度，增加对比度
+    "vintage": [ColorStage(0.7), ContrastStage(1.3), BrightnessStage(0.9)],
+    # 胶片效果：轻微褪色
+    "film": [ColorStage(0.8), ContrastStage(1.2)],
+    # 清新效果：提高饱和度和亮度
+    "fresh": [ColorStage(1.3), BrightnessStage(1.1)],
+    # HDR效果：高对比度
+    "hdr": [ContrastStage(1.5), ColorStage(1.2)],
+    # 暖色调
+    "warm": [ColorStage(1.4)],
+    # 冷色调：降低饱和度
+    "cool": [ColorStage(0.6)],
+}
 
 def apply_filter(image, filter_type):
     """应用滤镜效果"""
     try:
-        logger.info(f"开始应用滤镜: {filter_type}")
-        if filter_type == "blackwhite":
-            image = image.convert('L').convert('RGB')
-            logger.info("应用黑白滤镜")
-        elif filter_type == "vintage":
-            # 复古效果：降低饱和度，增加对比度
-            enhancer = ImageEnhance.Color(image)
-            image = enhancer.enhance(0.7)
-            logger.info("应用复古滤镜")
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(1.3)
-            logger.info("应用复古滤镜")
-            enhancer = ImageEnhance.Brightness(image)
-            image = enhancer.enhance(0.9)
-            logger.info("应用复古滤镜")
-        elif filter_type == "film":
-            # 胶片效果：轻微褪色
-            enhancer = ImageEnhance.Color(image)
-            image = enhancer.enhance(0.8)
-            logger.info("应用胶片滤镜")
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(1.2)
-            logger.info("应用胶片滤镜")
+        stage_logger.info(f"开始应用滤镜: {filter_type}")
+        stages = FILTER_PRESETS.get(filter_type)
+        if stages is None:
+            stage_logger.info(f"未知的滤镜类型: {filter_type}, 保持原图")
             return image
-        elif filter_type == "fresh":
-            # 清新效果：提高饱和度和亮度
-            enhancer = ImageEnhance.Color(image)
-            image = enhancer.enhance(1.3)
-            logger.info("应用清新滤镜")
-            enhancer = ImageEnhance.Brightness(image)
-            image = enhancer.enhance(1.1)
-            logger.info("应用清新滤镜")
-        elif filter_type == "hdr":
-            # HDR效果：高对比度
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(1.5)
-            logger.info("应用HDR滤镜")
-            enhancer = ImageEnhance.Color(image)
-            image = enhancer.enhance(1.2)
-            logger.info("应用HDR滤镜")
-        elif filter_type == "warm":
-            # 暖色调
-            enhancer = ImageEnhance.Color(image)
-            image = enhancer.enhance(1.4)
-            logger.info("应用暖色调滤镜")
-        elif filter_type == "cool":
-            # 冷色调：降低饱和度
-            enhancer = ImageEnhance.Color(image)
-            image = enhancer.enhance(0.6)
-            logger.info("应用冷色调滤镜")
-        else:
-            logger.info(f"未知的滤镜类型: {filter_type}, 保持原图")
-            return image
-        logger.info(f"滤镜应用完成: {filter_type}")
+        with metrics.span(f"filter:{filter_type}"):
+            image = apply_color_stages(image, stages)
+        stage_logger.info(f"滤镜应用完成: {filter_type}")
         return image
     except Exception as e:
-        logger.error(f"滤镜应用失败: {e}")
+        stage_logger.error(f"滤镜应用失败: {e}")
         return image
 
+def adjustment_stages(adjustments):
+    """调整参数中的逐像素颜色阶段：依次为亮度、对比度、饱和度"""
+    stages = []
+    # 亮度调整
+    if 'brightness' in adjustments:
+        stages.append(BrightnessStage(adjustments['brightness']))
+        stage_logger.info(f"亮度调整: {adjustments['brightness']}")
+    
+    # 对比度调整
+    if 'contrast' in adjustments:
+        stages.append(ContrastStage(adjustments['contrast']))
+        stage_logger.info(f"对比度调整: {adjustments['contrast']}")
+    
+    # 饱和度调整
+    if 'saturation' in adjustments:
+        stages.append(ColorStage(adjustments['saturation']))
+        stage_logger.info(f"饱和度调整: {adjustments['saturation']}")
+    return stages
+
+def sharpen_passes(adjustments):
+    """锐化调整对应的 SHARPEN 次数"""
+    sharpness = adjustments.get('sharpness', 1.0)
+    return int(sharpness - 1) if sharpness > 1.0 else 0
+
 def apply_adjustments(image, adjustments):
     """应用图像调整参数"""
     try:
-        logger.info("开始应用图像调整...")
-        # 亮度调整
-        if 'brightness' in adjustments:
-            enhancer = ImageEnhance.Brightness(image)
-            image = enhancer.enhance(adjustments['brightness'])
-            logger.info(f"亮度调整: {adjustments['brightness']}")
-        
-        # 对比度调整
-        if 'contrast' in adjustments:
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(adjustments['contrast'])
-            logger.info(f"对比度调整: {adjustments['contrast']}")
-        
-        # 饱和度调整
-        if 'saturation' in adjustments:
-            enhancer = ImageEnhance.Color(image)
-            image = enhancer.enhance(adjustments['saturation'])
-            logger.info(f"饱和度调整: {adjustments['saturation']}")
-        
-        # 锐化调整
-        if 'sharpness' in adjustments and adjustments['sharpness'] > 1.0:
-            for _ in range(int(adjustments['sharpness'] - 1)):
-                image = image.filter(ImageFilter.SHARPEN)
-            logger.info(f"锐化调整: {adjustments['sharpness'] - 1}次")
-        
-        logger.info("图像调整完成")
+        stage_logger.info("开始应用图像调整...")
+        stages = adjustment_stages(adjustments)
+        passes = sharpen_passes(adjustments)
+        
+        # 亮度、对比度、饱和度合并为一次逐像素遍历
+        if stages:
+            with metrics.span("adjust:color"):
+                image = apply_color_stages(image, stages, before_kernel=passes > 0)
+        
+        # 锐化调整：opencv 后端把多次锐化合并为一次卷积
+        if passes:
+            with metrics.span("adjust:sharpen"):
+                image = apply_repeated_filter(image, ImageFilter.SHARPEN, passes,
+                                              backend=app.config.POINT_OPS_BACKEND)
+            stage_logger.info(f"锐化调整: {passes}次")
+        
+        stage_logger.info("图像调整完成")
         return image
     except Exception as e:
-        logger.error(f"图像调整失败: {e}")
+        stage_logger.error(f"图像调整失败: {e}")
         return image
 
+def edit_stages(filter_type=None, adjustments=None):
+    """滤镜和调整参数对应的阶段，顺序与 apply_edits 相同
+
+    用于接在增强方法的阶段之后一起执行：滤镜和调整的颜色阶段与方法末尾的颜色阶段
+    相邻时由引擎合并为一次遍历，锐化调整展开为相应次数的 SHARPEN 阶段。
+    """
+    stages = []
+    if filter_type and filter_type != "none":
+        if filter_type in FILTER_PRESETS:
+            stages.extend(FILTER_PRESETS[filter_type])
+        else:
+            stage_logger.info(f"未知的滤镜类型: {filter_type}, 保持原图")
+    if adjustments:
+        stages.extend(adjustment_stages(adjustments))
+        stages.extend(KernelStage(ImageFilter.SHARPEN) for _ in range(sharpen_passes(adjustments)))
+    return stages
+
 def create_poster(images, layout="grid"):
-    """生成海报"""
+    """生成海报
+
+    layout 为布局名（grid 每行3张 / horizontal）或 PosterLayout；图片逐行解码到单元格尺寸
+    后粘贴，base64 图片在处理到它时才解码。
+    """
     try:
         logger.info("开始生成海报...")
         if not images:
             logger.warning("没有图片数据，无法生成海报")
             return None
         
-        # 计算海报尺寸
-        if layout == "grid":
-            cols = min(3, len(images))
-            rows = (len(images) + cols - 1) // cols
-            poster_width = cols * 300
-            poster_height = rows * 300
-        else:  # horizontal
-            poster_width = len(images) * 300
-            poster_height = 300
-        
-        # 创建海报画布
-        poster = Image.new('RGB', (poster_width, poster_height), (255, 255, 255))
-        logger.info(f"海报尺寸: {poster_width}x{poster_height}")
-        
-        # 放置图片
-        for i, img_data in enumerate(images):
-            try:
-                # 解码base64图片
-                img_bytes = base64.b64decode(img_data.split(',')[1])
-                img = Image.open(io.BytesIO(img_bytes))
-                
-                # 修复图片方向
-                img = fix_image_orientation(img)
-                
-                # 调整图片大小
-                img = img.resize((280, 280), Image.Resampling.LANCZOS)
-                logger.info(f"处理海报图片 {i}: 调整大小到 280x280")
-                
-                # 计算位置
-                if layout == "grid":
-                    x = (i % cols) * 300 + 10
-                    y = (i // cols) * 300 + 10
-                else:
-                    x = i * 300 + 10
-                    y = 10
-                
-                poster.paste(img, (x, y))
-                logger.info(f"处理海报图片 {i}: 粘贴到位置 ({x}, {y})")
-            except Exception as e:
-                logger.error(f"处理海报图片 {i} 失败: {e}")
-                continue
-        
-        logger.info("海报生成完成")
+        if not isinstance(layout, PosterLayout):
+            layout = PosterLayout(len(images), layout, cell_size=app.config.POSTER_CELL_SIZE,
+                                  padding=app.config.POSTER_CELL_PADDING)
+        logger.info(f"海报尺寸: {layout.size[0]}x{layout.size[1]}")
+        poster, placed = render_poster(images, layout, load=poster_input)
+        logger.info(f"海报生成完成: {placed}/{len(images)} 张图片")
         return poster
     except Exception as e:
         logger.error(f"海报生成失败: {e}")
         return None
 
+def encode_image(image, encoding=None):
+    """按编码参数（EncodeOptions，默认JPEG质量95）编码图片，返回 (字节, 编码统计)
+
+    输出都来自已修复方向的图片，EXIF中不含方向，客户端回传时按无方向处理。
+    """
+    with metrics.span("encode"):
+        return encode(image, encoding)
+
+def transcode_image(img_bytes, encoding):
+    """把以默认参数保存的图片按 encoding 重新编码，返回 (字节, 编码统计)"""
+    return encode_image(Image.open(io.BytesIO(img_bytes)), encoding)
+
+def to_data_url(img_bytes, fmt="JPEG"):
+    """将图片字节转换为base64 data URL"""
+    with metrics.span("base64", "response"):
+        img_base64 = base64.b64encode(img_bytes).decode('utf-8')
+    return f"data:{FORMAT_MIME[fmt]};base64,{img_base64}"
+
+def image_input_bytes(image_data):
+    """请求中的图片转换为字节：base64 data URL 解码，二进制上传原样返回"""
+    if isinstance(image_data, (bytes, bytearray, memoryview)):
+        return image_data
+    return base64.b64decode(image_data.split(',')[1])
+
+def poster_input(image_data):
+    """海报的输入图片：已解码的图片（预览代理图）原样返回，其余按 image_input_bytes 转换"""
+    if isinstance(image_data, Image.Image):
+        return image_data
+    return image_input_bytes(image_data)
+
+# 以下函数在执行池中运行，参数和返回值都是可pickle的字节/字符串，
+# 编码结果为 (编码后的字节, 编码统计)
+
+def enhance_file(source, method, encoding=None, scale_factor=None):
+    """按增强方法处理图片（字节或溢出到磁盘的文件路径）并编码，失败返回None"""
+    with metrics.operation(f"enhance/{get_pipeline(method).id}"):
+        enhanced_img = enhance_with_pipeline(source, method, scale_factor)
+        if enhanced_img is None:
+            return None
+        return encode_image(enhanced_img, encoding)
+
+def process_file(source, method, filter_type=None, adjustments=None, encoding=None, scale_factor=None):
+    """增强图片并应用滤镜和调整，一次解码、一次编码，失败返回None
+
+    滤镜和调整的阶段接在增强方法的阶段之后由分块引擎一起执行，不产生中间编码结果。
+    """
+    with metrics.operation(f"process/{get_pipeline(method).id}"):
+        stages = edit_stages(filter_type, adjustments)
+        processed = enhance_with_pipeline(source, method, scale_factor, stages)
+        if processed is None:
+            return None
+        return encode_image(processed, encoding)
+
+def enhance_file_multi(source, methods, encoding=None, max_scale=None):
+    """对同一图片执行多种增强方法，共享解码和放大等公共阶段
+
+    max_scale 限制各方法的放大倍数。返回 {方法ID: 编码结果或None}
+    """
+    try:
+        logger.info(f"开始多方法增强: {describe_source(source)}, 方法={methods}")
+        results = run_pipelines(source, methods, create_engine(), image_cache=worker_image_cache(),
+                                max_scale=max_scale, resize_policy=resize_policy(),
+                                base_cache_pixels=app.config.UPSCALED_CACHE_PIXELS)
+    except Exception as e:
+        logger.exception(f"多方法增强失败: {e}")
+        return {method: None for method in methods}
+    encoded = {}
+    for method, (enhanced, timings) in results.items():
+        logger.info(f"方法 {method} 完成, 阶段耗时(ms): {format_timings(timings)}")
+        with metrics.operation(f"enhance/{get_pipeline(method).id}"):
+            metrics.observe_timings(timings)
+            encoded[method] = encode_image(enhanced, encoding)
+    return encoded
+
+def filter_image_data(img_bytes, filter_type, encoding=None):
+    """解码图片字节、应用滤镜并编码"""
+    with metrics.operation("filter"):
+        img = load_oriented(img_bytes)
+        return encode_image(apply_filter(img, filter_type), encoding)
+
+def adjust_image_data(img_bytes, adjustments, encoding=None):
+    """解码图片字节、应用调整参数并编码"""
+    with metrics.operation("adjust"):
+        img = load_oriented(img_bytes)
+        return encode_image(apply_adjustments(img, adjustments), encoding)
+
+def apply_edits(image, filter_type=None, adjustments=None):
+    """依次应用滤镜和调整参数，预览和导出使用同一顺序"""
+    if filter_type and filter_type != "none":
+        image = apply_filter(image, filter_type)
+    if adjustments:
+        image = apply_adjustments(image, adjustments)
+    return image
+
+def render_preview(proxy, filter_type, adjustments, encoding):
+    """在代理图上应用编辑并编码，encoding 默认使用预览质量"""
+    with metrics.operation("preview"):
+        return encode_image(apply_edits(proxy, filter_type, adjustments), encoding)
+
+def pyramid_level_data(source, size, filter_type, adjustments, encoding=None):
+    """从结果字节缩小解码出金字塔级别，应用编辑并编码"""
+    with metrics.operation("pyramid"):
+        return encode_image(apply_edits(reduce_image(source, size), filter_type, adjustments), encoding)
+
+def export_image_data(img_bytes, filter_type, adjustments, encoding=None):
+    """解码原图、按预览的参数渲染全分辨率结果并编码"""
+    with metrics.operation("export"):
+        img = load_oriented(img_bytes)
+        return encode_image(apply_edits(img, filter_type, adjustments), encoding)
+
+def poster_image_data(images, layout, encoding=None):
+    """生成海报并编码，images 为图片字节、base64 data URL 或预览代理图，失败返回None"""
+    with metrics.operation("poster"):
+        poster = create_poster(images, layout)
+        if poster is None:
+            return None
+        return encode_image(poster, encoding)
+
+def poster_cell(image_data, cell_size):
+    """解码一张海报图片并缩放为单元格"""
+    with metrics.operation("poster"):
+        return render_cell(poster_input(image_data), cell_size)
+
+@app.before_server_start
+async def setup_log_policy(app, _):
+    """按配置设置日志采样比例和逐阶段日志级别"""
+    log_pipeline.configure(app.config.LOG_SAMPLE_RATE, app.config.LOG_STAGE_LEVEL)
+
+@app.before_server_start
+async def setup_models(app, _):
+    """配置AI模型注册表，开启预热时在创建执行池之前加载模型"""
+    model_registry.configure(app.config.AI_MODEL_BACKEND, app.config.AI_MODEL_WEIGHTS or None)
+    if app.config.AI_MODEL_WARMUP:
+        try:
+            await asyncio.to_thread(model_registry.warm_up)
+        except Exception as e:
+            # 预热失败不影响启动，首次AI请求时再尝试加载
+            logger.error(f"AI模型预热失败: {e}")
+
+@app.after_server_start
+async def report_startup(app, _):
+    """记录工作进程的启动耗时和常驻内存"""
+    app.ctx.startup_seconds = time.perf_counter() - BOOT_STARTED
+    logger.info(f"工作进程 {os.getpid()} 启动完成: 耗时 {app.ctx.startup_seconds:.2f}s, "
+                f"常驻内存 {model_registry.process_rss() / 1024 / 1024:.1f}MB")
+
+def worker_stats():
+    """当前工作进程的启动耗时和常驻内存"""
+    startup = getattr(app.ctx, "startup_seconds", None)
+    return {
+        "pid": os.getpid(),
+        "rss_mb": round(model_registry.process_rss() / 1024 / 1024, 1),
+        "startup_seconds": round(startup, 3) if startup is not None else None,
+    }
+
+@app.before_server_start
+async def setup_admission(app, _):
+    """创建准入控制器，并在创建执行池之前安装解压炸弹防护"""
+    install_bomb_guard(app.config.MAX_INPUT_PIXELS)
+    app.ctx.admission = AdmissionController(
+        app.config.MAX_INPUT_PIXELS,
+        app.config.MAX_OUTPUT_PIXELS,
+        app.config.PIXEL_BUDGET,
+        auto_downgrade=app.config.AUTO_DOWNGRADE_SCALE,
+        min_scale=app.config.MIN_SCALE_FACTOR,
+        max_wait=app.config.ADMISSION_MAX_WAIT,
+        max_waiting=app.config.ADMISSION_MAX_WAITING,
+        base_cache_pixels=app.config.UPSCALED_CACHE_PIXELS if app.config.IMAGE_CACHE_SIZE else 0,
+    )
+
+@app.before_server_start
+async def setup_resize(app, _):
+    """加载放大后端策略，策略文件或插值核配置无效时启动失败"""
+    policy = resize_policy()
+    logger.info(f"放大后端策略: {policy.to_dict()}")
+
+@app.before_server_start
+async def setup_executor(app, _):
+    """启动增强任务执行池，进程池的工作进程日志交给本进程的日志线程写入"""
+    initializer, initargs = log_pipeline.worker_initializer() if app.config.POOL_KIND == "process" else (None, ())
+    app.ctx.executor = EnhancementExecutor(
+        kind=app.config.POOL_KIND,
+        max_workers=app.config.POOL_WORKERS,
+        max_queue=app.config.POOL_MAX_QUEUE,
+        task_timeout=app.config.POOL_TASK_TIMEOUT,
+        initializer=initializer,
+        initargs=initargs,
+    )
+    app.ctx.executor.start()
+
+@app.after_server_stop
+async def shutdown_executor(app, _):
+    """关闭增强任务执行池"""
+    app.ctx.executor.shutdown()
+
+@app.main_process_start
+async def cleanup_jobs(app, _):
+    """多工作进程模式下，工作进程启动前清理上次运行遗留的任务
+
+    单进程模式（run_server 的进程池模式）不触发此事件，由 JobManager.start 清理已退出进程的任务。
+    """
+    fail_unfinished_jobs(app.config.JOB_STORE, app.config.JOB_DB_PATH)
+
+@app.before_server_start
+async def setup_jobs(app, _):
+    """启动异步任务队列"""
+    store = create_job_store(app.config.JOB_STORE, app.config.JOB_DB_PATH)
+    app.ctx.jobs = JobManager(store, app.config.JOB_LANES, ttl=app.config.JOB_TTL)
+    await app.ctx.jobs.start()
+
+@app.after_server_stop
+async def shutdown_jobs(app, _):
+    """停止异步任务队列"""
+    await app.ctx.jobs.stop()
+
+@app.before_server_start
+async def setup_cache(app, _):
+    """创建结果缓存"""
+    app.ctx.result_cache = ResultCache(
+        app.config.RESULT_CACHE_SIZE,
+        disk_path=app.config.RESULT_CACHE_DIR or None,
+        disk_bytes=app.config.RESULT_CACHE_DISK_SIZE,
+    )
+
+@app.before_server_start
+async def setup_previews(app, _):
+    """创建预览会话和结果金字塔的存储"""
+    app.ctx.previews = PreviewStore(app.config.PREVIEW_MAX_SESSIONS, app.config.PREVIEW_SESSION_TTL)
+    app.ctx.pyramids = PreviewStore(app.config.PYRAMID_MAX_SESSIONS, app.config.PYRAMID_TTL, name="结果金字塔",
+                                    max_bytes=app.config.PYRAMID_MAX_BYTES)
+
+def plan_enhance(img_bytes, methods):
+    """按文件头估算增强 methods 的成本，输出过大时降低放大倍数，超出上限时抛出 ImageTooLargeError"""
+    return app.ctx.admission.plan(img_bytes, [get_pipeline(method).scale_factor for method in methods])
+
+async def run_admitted(cost, func, *args, max_wait=...):
+    """在像素预算中预留 cost 后在执行池中运行 func，预算不足时排队或抛出 AdmissionError"""
+    async with app.ctx.admission.reserve(cost, max_wait):
+        return await run_in_pool(func, *args)
+
+def executor_error_response(e):
+    """执行池或准入控制拒绝请求时的响应，可重试的拒绝带 Retry-After"""
+    retry_after = getattr(e, "retry_after", None)
+    headers = {"Retry-After": str(retry_after)} if retry_after else None
+    return json({"error": str(e)}, status=e.status_code, headers=headers)
+
+async def run_in_pool(func, *args):
+    """在执行池中运行CPU密集函数，避免阻塞事件循环
+
+    任务中记录的阶段耗时随结果返回，写入本进程的指标；任务日志沿用当前请求ID。
+    """
+    result, samples = await app.ctx.executor.run(metrics.collect, run_with_request_id,
+                                                 current_request_id(), func, *args)
+    metrics.record_samples(samples)
+    return result
+
+@app.on_request
+async def bind_request_id(request: Request):
+    """把请求ID（客户端的 X-Request-ID 或自动生成）绑定到本次请求的日志"""
+    set_request_id(str(request.id)[:64])
+
+@app.on_response
+async def echo_request_id(request: Request, response):
+    """在响应头中返回请求ID，便于客户端反馈问题时对应日志"""
+    response.headers["X-Request-ID"] = current_request_id()
+
+@app.on_request
+async def start_request_metrics(request: Request):
+    """记录请求开始时间、进行中的请求数和请求体字节数"""
+    request.ctx.metrics_started = time.perf_counter()
+    metrics.IN_FLIGHT.inc()
+    if request.body:
+        metrics.REQUEST_BYTES.inc(metrics.route_label(request), amount=len(request.body))
+
+@app.on_response
+async def finish_request_metrics(request: Request, response):
+    """记录请求耗时、状态码和响应体字节数，流式响应的字节数在发送时记录"""
+    started = getattr(request.ctx, "metrics_started", None)
+    if started is None:
+        return
+    request.ctx.metrics_started = None
+    route = metrics.route_label(request)
+    metrics.IN_FLIGHT.dec()
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method)
+    metrics.REQUESTS.inc(route, request.method, response.status)
+    if response.body:
+        metrics.RESPONSE_BYTES.inc(route, amount=len(response.body))
+
+async def result_key(img_bytes, *params):
+    """结果缓存键：输入字节的哈希 + 处理参数"""
+    # 大图片的哈希计算放到线程中，避免阻塞事件循环
+    digest = await asyncio.to_thread(content_digest, img_bytes)
+    return make_key(digest, *params)
+
+def pipeline_key(method, cost, scale):
+    """增强结果缓存键中影响输出像素的配置
+
+    包括方法ID、放大倍数、逐像素阶段后端，以及放大策略为该方法和输出尺寸实际选择的放大后端和插值核，
+    更改这些配置后重启服务不会命中磁盘层中的旧结果。
+    """
+    pipeline = get_pipeline(method)
+    policy = resize_policy()
+    pixels = cost.width * cost.height * scale * scale
+    return (pipeline.id, scale, app.config.POINT_OPS_BACKEND,
+            policy.choose(pipeline.id, pixels), policy.kernel(pipeline.id, pipeline.resample))
+
+async def cached_result(key, compute, encoding):
+    """查询结果缓存，未命中时等待 compute() 并缓存非空结果
+
+    compute() 返回编码结果 (字节, 编码统计) 或None，缓存只保存字节，
+    命中时的编码统计只有格式和字节数。
+    """
+    cache = app.ctx.result_cache
+    if not cache.enabled:
+        return await compute()
+    data = await asyncio.to_thread(cache.get, key)
+    if data is not None:
+        logger.info(f"命中结果缓存: {key[:16]}")
+        return data, cached_stats(data, encoding)
+    result = await compute()
+    if result is not None:
+        await asyncio.to_thread(cache.put, key, result[0])
+    return result
+
+@asynccontextmanager
+async def image_source(img_bytes, filename="upload.jpg"):
+    """把上传的图片字节转换为交给执行池的输入
+
+    默认直接传递字节，在内存中解码；超过 SPILL_THRESHOLD 的大文件先异步写入磁盘，
+    只把路径传给执行池，退出时删除临时文件。
+    """
+    threshold = app.config.SPILL_THRESHOLD
+    if not threshold or len(img_bytes) <= threshold:
+        yield img_bytes
+        return
+    
+    temp_path = os.path.join(app.config.UPLOAD_FOLDER, f"temp_{os.urandom(8).hex()}_{os.path.basename(filename)}")
+    async with aiofiles.open(temp_path, 'wb') as f:
+        await f.write(img_bytes)
+    logger.info(f"大文件已写入磁盘: {temp_path}, {len(img_bytes)} 字节")
+    try:
+        yield temp_path
+    finally:
+        if os.path.exists(temp_path):
+            try:
+                os.remove(temp_path)
+                logger.info(f"临时文件清理成功: {temp_path}")
+            except OSError:
+                logger.error(f"清理临时文件失败: {temp_path}")
+
+async def enhance_bytes(img_bytes, method, encoding=None, filename="upload.jpg", cost=None, max_wait=...):
+    """在执行池中增强图片字节，返回编码结果 (字节, 编码统计)，失败返回None
+
+    cost 为 plan_enhance 的估算结果，为空时在这里估算；未命中缓存时先在像素预算中预留，
+    max_wait 为None时一直排队（异步任务）。
+    相同图片、方法、放大倍数和编码参数的结果直接从缓存返回。
+    """
+    encoding = encoding or EncodeOptions()
+    cost = cost or plan_enhance(img_bytes, [method])
+    key = await result_key(img_bytes, "enhance", pipeline_key(method, cost, cost.max_scale), encoding.key())
+    
+    async def compute():
+        async with app.ctx.admission.reserve(cost, max_wait):
+            async with image_source(img_bytes, filename) as source:
+                return await run_in_pool(enhance_file, source, method, encoding, cost.max_scale)
+    return await cached_result(key, compute, encoding)
+
+async def enhance_bytes_multi(img_bytes, methods, encoding=None, filename="upload.jpg", cost=None):
+    """对同一图片执行多种增强方法，返回 {方法ID: 编码结果或None}
+
+    已缓存的方法直接返回，其余方法在一次执行池调用中共享解码和放大，
+    放大倍数受 cost（plan_enhance 的估算结果）限制。
+    """
+    cache = app.ctx.result_cache
+    encoding = encoding or EncodeOptions()
+    cost = cost or plan_enhance(img_bytes, methods)
+    scales = {method: min(get_pipeline(method).scale_factor, cost.max_scale) for method in methods}
+    digest = await asyncio.to_thread(content_digest, img_bytes)
+    keys = {}
+    for method in methods:
+        keys[method] = make_key(digest, "enhance", pipeline_key(method, cost, scales[method]), encoding.key())
+    
+    encoded = {}
+    if cache.enabled:
+        for method, key in keys.items():
+            data = await asyncio.to_thread(cache.get, key)
+            if data is not None:
+                logger.info(f"命中结果缓存: {method}")
+                encoded[method] = data, cached_stats(data, encoding)
+    
+    missing = [method for method in methods if method not in encoded]
+    if missing:
+        missing_cost = Cost(cost.width, cost.height, [scales[method] for method in missing],
+                            base_cache_pixels=cost.base_cache_pixels)
+        async with app.ctx.admission.reserve(missing_cost), image_source(img_bytes, filename) as source:
+            computed = await run_in_pool(enhance_file_multi, source, missing, encoding, cost.max_scale)
+        for method, result in computed.items():
+            if result is not None and cache.enabled:
+                await asyncio.to_thread(cache.put, keys[method], result[0])
+            encoded[method] = result
+    return {method: encoded[method] for method in methods}
+
+async def iter_completed(inputs, worker, concurrency):
+    """以最多 concurrency 个并发对 inputs 逐个执行协程函数 worker，按完成顺序产出 (序号, 结果)
+
+    只有处理中的条目占用内存；迭代提前结束（如客户端断开）时取消未完成的条目。
+    """
+    remaining = enumerate(inputs)
+    pending = {}
+
+    def launch():
+        for idx, value in remaining:
+            pending[asyncio.ensure_future(worker(value))] = idx
+            return True
+        return False
+
+    try:
+        for _ in range(max(1, concurrency)):
+            if not launch():
+                break
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                idx = pending.pop(task)
+                launch()
+                yield idx, task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def enhance_item(img_bytes, method, encoding=None, max_wait=...):
+    """增强批量中的一个条目，返回 {"data": 编码后的字节或None, "error": 错误信息或None,
+    "encoding": 编码统计, "headers": multipart分段的编码统计头}
+
+    img_bytes 也可以是 base64 data URL，在开始处理时才解码。
+    """
+    try:
+        result = await enhance_bytes(image_input_bytes(img_bytes), method, encoding, max_wait=max_wait)
+        data, stats = result or (None, None)
+        return {"data": data, "error": None if data else "处理失败",
+                "encoding": stats, "headers": stats_headers(stats)}
+    except Exception as e:
+        logger.error(f"批量条目处理失败: {e}")
+        return {"data": None, "error": str(e)}
+
+def make_enhance_runner(inputs, method):
+    """创建增强任务的执行协程，批量条目按配置的并发数同时处理"""
+    async def runner(report):
+        items = [None] * len(inputs)
+        completed = 0
+
+        async def process(img_bytes):
+            # 任务已在队列中排过队，预算不足时继续等待而不是拒绝
+            return await enhance_item(img_bytes, method, max_wait=None)
+
+        async for idx, item in iter_completed(inputs, process, app.config.JOB_ITEM_CONCURRENCY):
+            items[idx] = item
+            completed += 1
+            await report(completed)
+
+        return items
+    return runner
+
+def job_status(job):
+    """任务状态响应体"""
+    return {
+        "success": True,
+        "job_id": job["id"],
+        "method": job["method"],
+        "lane": job["lane"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "completed": job["completed"],
+        "total": job["total"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+def is_binary_upload(request):
+    """请求体是否直接为图片二进制"""
+    content_type = request.content_type or ""
+    return content_type.startswith("image/") or content_type == "application/octet-stream"
+
+def request_params(request):
+    """请求参数：multipart表单字段、JSON请求体，二进制上传时为查询参数"""
+    if request.files or request.form:
+        return {key: request.form.get(key) for key in request.form}
+    if is_binary_upload(request):
+        return {key: request.args.get(key) for key in request.args}
+    return request.json or {}
+
+def request_images(request, field):
+    """读取请求中的图片
+
+    支持 multipart 上传（file、image 或 images 字段）、请求体直接为图片二进制，
+    以及JSON请求体中 field 字段的 base64 data URL（单个或列表）。
+    返回图片字节或 data URL 的列表。
+    """
+    if request.files:
+        return [f.body for name in ("file", "image", "images") for f in request.files.getlist(name, [])]
+    if is_binary_upload(request):
+        return [request.body] if request.body else []
+    value = (request.json or {}).get(field)
+    if not value:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def parse_adjustments(params):
+    """解析调整参数，支持JSON对象、表单中的JSON字符串或单独的字段"""
+    adjustments = params.get("adjustments") or {}
+    if isinstance(adjustments, str):
+        adjustments = json_lib.loads(adjustments)
+    adjustments = dict(adjustments)
+    for key in ("brightness", "contrast", "saturation", "sharpness"):
+        if key in params and key not in adjustments:
+            adjustments[key] = params[key]
+        if key in adjustments:
+            adjustments[key] = float(adjustments[key])
+    return adjustments
+
+def encode_options(request, fmt, quality=None):
+    """客户端请求的编码参数：查询参数或请求参数中的 format、quality、target_size、
+    progressive、optimize、subsampling
+
+    fmt 为按 Accept 头协商的格式，format 参数优先；quality 为未指定时的默认质量。
+    参数无效时抛出 ValueError。
+    """
+    params = {key: request.args.get(key) for key in request.args}
+    params.update(request_params(request))
+    return EncodeOptions.from_params(params, fmt, quality or DEFAULT_QUALITY)
+
+def encoding_error_response(e):
+    """编码参数无效时的响应"""
+    logger.warning(f"编码参数无效: {e}")
+    return json({"error": f"编码参数无效: {e}"}, status=400)
+
+async def keep_pyramid(img_bytes):
+    """保存结果图片的金字塔，返回其描述（含句柄）"""
+    pyramid = await asyncio.to_thread(create_pyramid, img_bytes, app.config.PYRAMID_MAX_LEVELS)
+    app.ctx.pyramids.add(pyramid)
+    logger.info(f"保存结果金字塔: {pyramid.id}, {pyramid.full_size[0]}x{pyramid.full_size[1]}, {pyramid.levels} 级")
+    return pyramid.describe()
+
+def pyramid_source(params):
+    """请求中引用的结果金字塔和级别，返回 (金字塔, 级别)，没有 handle 时为 (None, 0)
+
+    级别由 level 指定，或按 max_edge 选择长边不小于它的最小级别，默认第0级（全分辨率）。
+    句柄不存在或已过期时抛出 KeyError，级别无效时抛出 ValueError。
+    """
+    handle = params.get("handle")
+    if not handle:
+        return None, 0
+    pyramid = app.ctx.pyramids.get(handle)
+    if pyramid is None:
+        raise KeyError(handle)
+    if params.get("level") not in (None, ""):
+        return pyramid, pyramid.check_level(int(params["level"]))
+    if params.get("max_edge"):
+        return pyramid, pyramid.level_for_edge(int(params["max_edge"]))
+    return pyramid, 0
+
+async def render_level(pyramid, level, filter_type, adjustments, encoding):
+    """在金字塔的缩小级别上应用编辑并编码
+
+    不超过 PYRAMID_THREAD_PIXELS 的级别缓存在金字塔中，直接在线程中处理；
+    更大的级别（如5倍放大结果的第1级）与其他请求一样占用像素预算，在执行池中生成和处理，不缓存。
+    """
+    width, height = pyramid.level_size(level)
+    if width * height > app.config.PYRAMID_THREAD_PIXELS:
+        return await run_admitted(Cost(width, height, [1]), pyramid_level_data, pyramid.source, (width, height),
+                                  filter_type, adjustments, encoding)
+    image = await asyncio.to_thread(pyramid.image, level)
+    app.ctx.pyramids.trim()
+    return await asyncio.to_thread(render_preview, image, filter_type, adjustments, encoding)
+
+async def send_result(request, mode, encoding, result, body, field, headers=None):
+    """按协商结果发送单个编码结果 (字节, 编码统计)
+
+    二进制模式流式发送图片，编码统计和 headers 放在响应头中；
+    JSON模式把 data URL 放入 body[field]，编码统计放入 body["encoding"]。
+    """
+    img_bytes, stats = result
+    if mode == BINARY:
+        await send_image(request, img_bytes, encoding.format, headers={**stats_headers(stats), **(headers or {})},
+                         chunk_size=app.config.STREAM_CHUNK_SIZE)
+        return None
+    return json({**body, field: to_data_url(img_bytes, encoding.format), "encoding": stats})
+
+async def send_results(request, encoding, items):
+    """以 multipart/mixed 发送多个结果"""
+    await send_multipart(request, items, encoding.format, chunk_size=app.config.STREAM_CHUNK_SIZE)
+
 @app.route("/")
 async def index(request: Request):
     """健康检查"""
@@ -521,54 +972,60 @@ async def upload_file(request: Request):
             logger.warning(f"不支持的文件格式: {file_obj.name}")
             return json({"error": "不支持的文件格式"}, status=400)
         
-        # 保存上传的文件
-        filename = f"{os.urandom(8).hex()}_{file_obj.name}"
-        filepath = os.path.join(app.config.UPLOAD_FOLDER, filename)
+        # 同时请求多种方法时共享解码和放大等公共阶段
+        methods = [m for m in request.form.get("methods", "").split(",") if m]
+        mode, fmt = negotiate(request, multiple=bool(methods))
+        try:
+            encoding = encode_options(request, fmt)
+        except (ValueError, TypeError) as e:
+            return encoding_error_response(e)
         
         try:
-            async with aiofiles.open(filepath, 'wb') as f:
-                await f.write(file_obj.body)
-            logger.info(f"文件保存成功: {filepath}")
+            cost = plan_enhance(file_obj.body, methods or [method])
+            if methods:
+                encoded = await enhance_bytes_multi(file_obj.body, methods, encoding, file_obj.name, cost)
+                if all(result is None for result in encoded.values()):
+                    logger.error(f"图片处理失败: {file_obj.name}")
+                    return json({"error": "图片处理失败"}, status=500)
+                logger.info(f"图片处理成功: {file_obj.name}")
+                if mode != JSON:
+                    return await send_results(request, encoding, [
+                        {"data": result[0] if result else None, "error": None if result else "处理失败",
+                         "headers": {"X-Method": m, **stats_headers(result[1] if result else None)}}
+                        for m, result in encoded.items()
+                    ])
+                return json({
+                    "success": True,
+                    "enhanced_images": {m: to_data_url(result[0], encoding.format) if result else None
+                                        for m, result in encoded.items()},
+                    "encoding": {m: result[1] if result else None for m, result in encoded.items()},
+                    "methods": methods,
+                    "scale_factor": cost.max_scale
+                })
             
-            # 处理图片
-            if method == "super_clear":
-                enhanced_img = enhance_super_clear(filepath)
-            elif method == "advanced":
-                enhanced_img = enhance_advanced(filepath)
-            elif method == "super_quality":
-                enhanced_img = enhance_super_quality(filepath)
-            else:
-                enhanced_img = enhance_basic(filepath)
+            # 在执行池中直接处理内存中的图片
+            result = await enhance_bytes(file_obj.body, method, encoding, file_obj.name, cost)
             
-            if enhanced_img is None:
-                logger.error(f"图片处理失败: {filepath}")
+            if result is None:
+                logger.error(f"图片处理失败: {file_obj.name}")
                 return json({"error": "图片处理失败"}, status=500)
             
-            # 转换为base64
-            buffer = io.BytesIO()
-            enhanced_img.save(buffer, format='JPEG', quality=95)
-            img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
-            logger.info(f"图片处理成功: {filepath}")
-            return json({
-                "success": True,
-                "enhanced_image": f"data:image/jpeg;base64,{img_base64}",
-                "method": method
-            })
+            logger.info(f"图片处理成功: {file_obj.name}")
+            body = {"success": True, "method": method, "scale_factor": cost.max_scale}
+            headers = {"X-Scale-Factor": str(cost.max_scale)}
+            if parse_bool(request.form.get("keep", False)):
+                # 保存结果金字塔，后续的调整/滤镜以句柄引用结果
+                body["pyramid"] = await keep_pyramid(result[0])
+                headers["X-Image-Handle"] = body["pyramid"]["handle"]
+            return await send_result(request, mode, encoding, result, body, "enhanced_image", headers=headers)
             
+        except ExecutorError as e:
+            logger.warning(f"执行池拒绝或超时: {e}")
+            return executor_error_response(e)
+        
         except Exception as e:
-            logger.error(f"处理过程中出错: {e}")
-            print(f"错误详情: {traceback.format_exc()}")
+            logger.exception(f"处理过程中出错: {e}")
             return json({"error": f"处理失败: {str(e)}"}, status=500)
-        
-        finally:
-            # 清理临时文件
-            if os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                    logger.info(f"临时文件清理成功: {filepath}")
-                except:
-                    logger.error(f"清理临时文件失败: {filepath}")
     
     except Exception as e:
         logger.error(f"服务器错误: {e}")
@@ -578,50 +1035,54 @@ async def upload_file(request: Request):
 async def get_methods(request: Request):
     """获取可用的增强方法"""
     logger.info("收到获取增强方法请求")
-    methods = [
-        {
-            "id": "traditional",
-            "name": "传统增强",
-            "description": "基于传统图像处理算法，温和提升分辨率与清晰度，保持自然效果。处理速度：极快（1-3秒）",
-            "speed": "fast"
-        },
-        {
-            "id": "super_clear",
-            "name": "超级清晰",
-            "description": "重新优化版8倍放大算法，多级锐化处理，强对比度和饱和度增强，追求极致清晰度。处理速度：较慢（8-15秒）",
-            "speed": "slow"
-        },
-        {
-            "id": "advanced",
-            "name": "高级增强",
-            "description": "结合传统和AI技术，温和的图像增强，保持自然色彩和清晰度。处理速度：中等（3-6秒）",
-            "speed": "medium"
-        },
-        {
-            "id": "super_quality",
-            "name": "超级质量",
-            "description": "高质量图像处理，温和的增强参数，确保图片清晰自然。处理速度：较慢（8-15秒）",
-            "speed": "slow"
-        }
-    ]
+    methods = list_methods()
     logger.info("返回增强方法列表")
     return json({"methods": methods})
 
+@app.route("/metrics")
+async def metrics_endpoint(request: Request):
+    """Prometheus 文本格式的运行指标"""
+    metrics.EXECUTOR_PENDING.set(app.ctx.executor.pending)
+    for lane, depth in app.ctx.jobs.queue_depths().items():
+        metrics.JOB_QUEUE_DEPTH.set(depth, lane)
+    return text(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route("/api/health")
 async def health_check(request: Request):
     """健康检查"""
     logger.info("收到健康检查请求")
     return json({
         "status": "healthy",
-        "version": "basic"
+        "version": "basic",
+        "executor": app.ctx.executor.stats(),
+        "job_queues": app.ctx.jobs.queue_depths(),
+        "cache": app.ctx.result_cache.stats(),
+        "previews": app.ctx.previews.stats(),
+        "pyramids": app.ctx.pyramids.stats(),
+        "admission": app.ctx.admission.stats(),
+        "resize": resize_policy().describe(),
+        "worker": worker_stats(),
+        "models": model_registry.stats()
     })
 
+def batch_item(idx, item, encoding):
+    """流式批量响应中的一条结果"""
+    if item["data"]:
+        return {"index": idx, "success": True, "enhanced_image": to_data_url(item["data"], encoding.format),
+                "encoding": item["encoding"]}
+    return {"index": idx, "success": False, "error": item["error"]}
+
 @app.route("/api/batch-enhance", methods=["POST"])
 async def batch_enhance(request: Request):
-    """批量高清化处理"""
+    """批量高清化处理
+
+    条目按 BATCH_CONCURRENCY 并发处理。声明 application/x-ndjson 或 text/event-stream 时
+    每个条目完成后立即发送一行结果（带原序号 index），multipart 响应按完成顺序发送分段
+    （X-Item-Index 为原序号）；JSON 响应在全部完成后按原顺序返回。
+    """
     try:
         logger.info("收到批量高清化请求")
-        data = request.json
+        data = request.json or {}
         files = data.get("files", [])
         method = data.get("method", "traditional")
         
@@ -629,58 +1090,37 @@ async def batch_enhance(request: Request):
             logger.warning("批量处理无文件")
             return json({"error": "没有文件"}, status=400)
         
+        mode, fmt = negotiate(request, multiple=True)
+        try:
+            encoding = encode_options(request, fmt)
+        except (ValueError, TypeError) as e:
+            return encoding_error_response(e)
+        # 按完成顺序产出结果，发送后即释放
+        completed = iter_completed(files, lambda file_data: enhance_item(file_data, method, encoding),
+                                   app.config.BATCH_CONCURRENCY)
+        if mode in (NDJSON, EVENTS):
+            return await send_stream(request, mode, completed, lambda idx, item: batch_item(idx, item, encoding))
+        if mode != JSON:
+            return await send_results(request, encoding, completed)
+        
+        items = [None] * len(files)
+        async for idx, item in completed:
+            items[idx] = item
+        logger.info("批量处理完成")
+        
         results = []
-        for file_data in files:
-            try:
-                # 解码base64图片
-                img_bytes = base64.b64decode(file_data.split(',')[1])
-                
-                # 保存临时文件
-                temp_filename = f"temp_{os.urandom(8).hex()}.jpg"
-                temp_path = os.path.join(app.config.UPLOAD_FOLDER, temp_filename)
-                
-                with open(temp_path, 'wb') as f:
-                    f.write(img_bytes)
-                
-                # 处理图片
-                if method == "super_clear":
-                    enhanced_img = enhance_super_clear(temp_path)
-                elif method == "advanced":
-                    enhanced_img = enhance_advanced(temp_path)
-                elif method == "super_quality":
-                    enhanced_img = enhance_super_quality(temp_path)
-                else:
-                    enhanced_img = enhance_basic(temp_path)
-                
-                if enhanced_img:
-                    # 转换为base64
-                    buffer = io.BytesIO()
-                    enhanced_img.save(buffer, format='JPEG', quality=95)
-                    img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                    
-                    results.append({
-                        "success": True,
-                        "enhanced_image": f"data:image/jpeg;base64,{img_base64}"
-                    })
-                else:
-                    results.append({
-                        "success": False,
-                        "error": "处理失败"
-                    })
-                
-                # 清理临时文件
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                    logger.info(f"临时文件清理成功: {temp_path}")
-                    
-            except Exception as e:
-                logger.error(f"批量处理图片失败: {e}")
+        for item in items:
+            if item["data"]:
+                results.append({
+                    "success": True,
+                    "enhanced_image": to_data_url(item["data"], encoding.format),
+                    "encoding": item["encoding"]
+                })
+            else:
                 results.append({
                     "success": False,
-                    "error": str(e)
+                    "error": item["error"]
                 })
-        
-        logger.info("批量处理完成")
         return json({
             "success": True,
             "results": results
@@ -690,41 +1130,179 @@ async def batch_enhance(request: Request):
         logger.error(f"批量处理失败: {e}")
         return json({"error": f"批量处理失败: {str(e)}"}, status=500)
 
+@app.route("/api/jobs", methods=["POST"])
+async def submit_job(request: Request):
+    """提交异步增强任务，立即返回任务ID
+
+    支持与 /api/upload 相同的表单上传（file + method），
+    以及与 /api/batch-enhance 相同的JSON请求（files + method）。
+    """
+    try:
+        logger.info("收到异步任务提交请求")
+        if "file" in request.files:
+            file_obj = request.files["file"][0]
+            method = request.form.get("method", "traditional")
+            if not file_obj.name or not allowed_file(file_obj.name):
+                logger.warning(f"不支持的文件格式: {file_obj.name}")
+                return json({"error": "不支持的文件格式"}, status=400)
+            inputs = [file_obj.body]
+        else:
+            data = request.json or {}
+            method = data.get("method", "traditional")
+            try:
+                inputs = [base64.b64decode(file_data.split(',')[1]) for file_data in data.get("files", [])]
+            except (ValueError, IndexError) as e:
+                logger.warning(f"图片数据无效: {e}")
+                return json({"error": "图片数据无效"}, status=400)
+        
+        if not inputs:
+            logger.warning("异步任务无文件")
+            return json({"error": "没有文件"}, status=400)
+        
+        # 提交时只读取文件头，超出尺寸上限的图片直接拒绝
+        for img_bytes in inputs:
+            try:
+                plan_enhance(img_bytes, [method])
+            except OSError:
+                # 无法识别的图片在处理时作为条目错误返回
+                pass
+        
+        lane = app.config.JOB_METHOD_LANES.get(method, app.config.JOB_DEFAULT_LANE)
+        job_id = await app.ctx.jobs.submit(method, lane, make_enhance_runner(inputs, method), total=len(inputs))
+        return json({
+            "success": True,
+            "job_id": job_id,
+            "status": "queued",
+            "lane": lane
+        }, status=202)
+        
+    except ExecutorError as e:
+        logger.warning(f"任务被拒绝: {e}")
+        return executor_error_response(e)
+        
+    except Exception as e:
+        logger.error(f"任务提交失败: {e}")
+        return json({"error": f"任务提交失败: {str(e)}"}, status=500)
+
+@app.route("/api/jobs/<job_id>")
+async def get_job(request: Request, job_id: str):
+    """查询任务状态"""
+    job = await app.ctx.jobs.get(job_id)
+    if job is None:
+        return json({"error": "任务不存在"}, status=404)
+    return json(job_status(job))
+
+async def transcoded_item(item, encoding):
+    """按 encoding 重新编码任务结果中的一个条目"""
+    if not item["data"]:
+        return item
+    data, stats = await run_in_pool(transcode_image, item["data"], encoding)
+    return {**item, "data": data, "encoding": stats, "headers": stats_headers(stats)}
+
+@app.route("/api/jobs/<job_id>/result")
+async def get_job_result(request: Request, job_id: str):
+    """获取任务结果"""
+    try:
+        job = await app.ctx.jobs.get(job_id)
+        if job is None:
+            return json({"error": "任务不存在"}, status=404)
+        if job["status"] not in (DONE, FAILED):
+            return json({"error": "任务尚未完成", **job_status(job)}, status=409)
+        
+        items = await app.ctx.jobs.get_results(job_id) or []
+        # 存储只保存编码统计，multipart分段头按统计重新生成
+        items = [{**item, "headers": stats_headers(item.get("encoding"))} for item in items]
+        mode, fmt = negotiate(request, multiple=len(items) != 1)
+        try:
+            encoding = encode_options(request, fmt)
+        except (ValueError, TypeError) as e:
+            return encoding_error_response(e)
+        if encoding.key() != EncodeOptions().key():
+            # 任务结果以默认参数保存，请求其他格式或编码参数时在执行池中重新编码
+            items = [await transcoded_item(item, encoding) for item in items]
+        if mode != JSON and items:
+            if mode == BINARY:
+                if not items[0]["data"]:
+                    return json({"success": False, "job_id": job_id, "error": items[0]["error"]}, status=500)
+                return await send_result(request, mode, encoding, (items[0]["data"], items[0].get("encoding")),
+                                         {}, "enhanced_image")
+            return await send_results(request, encoding, items)
+        
+        results = []
+        for item in items:
+            if item["data"]:
+                results.append({"success": True, "enhanced_image": to_data_url(item["data"], encoding.format),
+                                "encoding": item.get("encoding")})
+            else:
+                results.append({"success": False, "error": item["error"]})
+        
+        response = {
+            "success": job["status"] == DONE,
+            "job_id": job_id,
+            "method": job["method"],
+            "status": job["status"],
+            "results": results
+        }
+        if job["status"] == FAILED:
+            response["error"] = job["error"]
+        return json(response)
+        
+    except Exception as e:
+        logger.error(f"获取任务结果失败: {e}")
+        return json({"error": f"获取任务结果失败: {str(e)}"}, status=500)
+
 @app.route("/api/apply-filter", methods=["POST"])
 async def apply_filter_api(request: Request):
     """应用滤镜效果"""
     try:
         logger.info("收到滤镜应用请求")
-        data = request.json
-        image_data = data.get("image")
-        filter_type = data.get("filter")
+        params = request_params(request)
+        images = request_images(request, "image")
+        filter_type = params.get("filter")
         
-        if not image_data or not filter_type:
+        try:
+            pyramid, level = pyramid_source(params)
+        except KeyError:
+            return handle_not_found_response(params.get("handle"))
+        except (ValueError, TypeError) as e:
+            logger.warning(f"金字塔级别无效: {e}")
+            return json({"error": f"金字塔级别无效: {e}"}, status=400)
+        
+        if (not images and pyramid is None) or not filter_type:
             logger.warning("滤镜应用缺少参数")
             return json({"error": "缺少参数"}, status=400)
         
-        # 解码base64图片
-        img_bytes = base64.b64decode(image_data.split(',')[1])
-        img = Image.open(io.BytesIO(img_bytes))
-        
-        # 修复图片方向
-        img = fix_image_orientation(img)
-        
-        # 应用滤镜
-        filtered_img = apply_filter(img, filter_type)
+        try:
+            img_bytes = pyramid.source if pyramid else image_input_bytes(images[0])
+        except (ValueError, IndexError) as e:
+            logger.warning(f"图片数据无效: {e}")
+            return json({"error": "图片数据无效"}, status=400)
         
-        # 转换为base64
-        buffer = io.BytesIO()
-        filtered_img.save(buffer, format='JPEG', quality=95)
-        img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        mode, fmt = negotiate(request)
+        try:
+            encoding = encode_options(request, fmt)
+        except (ValueError, TypeError) as e:
+            return encoding_error_response(e)
+        if level:
+            # 只处理金字塔中缩小后的像素
+            result = await render_level(pyramid, level, filter_type, None, encoding)
+        else:
+            # 在执行池中解码、应用滤镜并编码
+            key = await result_key(img_bytes, "filter", filter_type, app.config.POINT_OPS_BACKEND, encoding.key())
+            cost = app.ctx.admission.plan(img_bytes)
+            result = await cached_result(
+                key, lambda: run_admitted(cost, filter_image_data, img_bytes, filter_type, encoding), encoding)
         
         logger.info(f"滤镜应用成功: {filter_type}")
-        return json({
-            "success": True,
-            "filtered_image": f"data:image/jpeg;base64,{img_base64}",
-            "filter": filter_type
-        })
-        
+        body = {"success": True, "filter": filter_type}
+        if pyramid:
+            body["level"] = level
+        return await send_result(request, mode, encoding, result, body, "filtered_image")
+        
+    except ExecutorError as e:
+        logger.warning(f"执行池拒绝或超时: {e}")
+        return executor_error_response(e)
+    
     except Exception as e:
         logger.error(f"滤镜应用失败: {e}")
         return json({"error": f"滤镜应用失败: {str(e)}"}, status=500)
@@ -734,74 +1312,420 @@ async def adjust_image_api(request: Request):
     """应用图像调整"""
     try:
         logger.info("收到图像调整请求")
-        data = request.json
-        image_data = data.get("image")
-        adjustments = data.get("adjustments", {})
+        params = request_params(request)
+        images = request_images(request, "image")
         
-        if not image_data:
+        try:
+            pyramid, level = pyramid_source(params)
+        except KeyError:
+            return handle_not_found_response(params.get("handle"))
+        except (ValueError, TypeError) as e:
+            logger.warning(f"金字塔级别无效: {e}")
+            return json({"error": f"金字塔级别无效: {e}"}, status=400)
+        
+        if not images and pyramid is None:
             logger.warning("图像调整缺少图片数据")
             return json({"error": "缺少图片数据"}, status=400)
         
-        # 解码base64图片
-        img_bytes = base64.b64decode(image_data.split(',')[1])
-        img = Image.open(io.BytesIO(img_bytes))
-        
-        # 修复图片方向
-        img = fix_image_orientation(img)
+        try:
+            img_bytes = pyramid.source if pyramid else image_input_bytes(images[0])
+        except (ValueError, IndexError) as e:
+            logger.warning(f"图片数据无效: {e}")
+            return json({"error": "图片数据无效"}, status=400)
         
-        # 应用调整
-        adjusted_img = apply_adjustments(img, adjustments)
+        try:
+            adjustments = parse_adjustments(params)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"调整参数无效: {e}")
+            return json({"error": "调整参数无效"}, status=400)
         
-        # 转换为base64
-        buffer = io.BytesIO()
-        adjusted_img.save(buffer, format='JPEG', quality=95)
-        img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        mode, fmt = negotiate(request)
+        try:
+            encoding = encode_options(request, fmt)
+        except (ValueError, TypeError) as e:
+            return encoding_error_response(e)
+        if level:
+            # 只处理金字塔中缩小后的像素
+            result = await render_level(pyramid, level, None, adjustments, encoding)
+        else:
+            # 在执行池中解码、应用调整并编码
+            key = await result_key(img_bytes, "adjust", adjustments, app.config.POINT_OPS_BACKEND, encoding.key())
+            cost = app.ctx.admission.plan(img_bytes)
+            result = await cached_result(
+                key, lambda: run_admitted(cost, adjust_image_data, img_bytes, adjustments, encoding), encoding)
         
         logger.info("图像调整完成")
-        return json({
-            "success": True,
-            "adjusted_image": f"data:image/jpeg;base64,{img_base64}"
-        })
-        
+        body = {"success": True}
+        if pyramid:
+            body["level"] = level
+        return await send_result(request, mode, encoding, result, body, "adjusted_image")
+        
+    except ExecutorError as e:
+        logger.warning(f"执行池拒绝或超时: {e}")
+        return executor_error_response(e)
+    
     except Exception as e:
         logger.error(f"图像调整失败: {e}")
         return json({"error": f"图像调整失败: {str(e)}"}, status=500)
 
+@app.route("/api/process", methods=["POST"])
+async def process_image_api(request: Request):
+    """一次请求完成增强、滤镜和调整
+
+    method、filter 和 adjustments 规划为同一条管线：只解码一次、编码一次，
+    滤镜和调整的颜色阶段与增强方法的颜色阶段合并执行。
+    """
+    try:
+        logger.info("收到组合处理请求")
+        params = request_params(request)
+        images = request_images(request, "image")
+        if not images:
+            logger.warning("组合处理缺少图片数据")
+            return json({"error": "缺少图片数据"}, status=400)
+        
+        try:
+            img_bytes = image_input_bytes(images[0])
+        except (ValueError, IndexError) as e:
+            logger.warning(f"图片数据无效: {e}")
+            return json({"error": "图片数据无效"}, status=400)
+        
+        method = params.get("method") or "traditional"
+        filter_type = params.get("filter") or None
+        try:
+            adjustments = parse_adjustments(params)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"调整参数无效: {e}")
+            return json({"error": "调整参数无效"}, status=400)
+        
+        mode, fmt = negotiate(request)
+        try:
+            encoding = encode_options(request, fmt)
+        except (ValueError, TypeError) as e:
+            return encoding_error_response(e)
+        
+        try:
+            cost = plan_enhance(img_bytes, [method])
+        except OSError as e:
+            logger.warning(f"无法识别的图片: {e}")
+            return json({"error": "图片数据无效"}, status=400)
+        key = await result_key(img_bytes, "process", pipeline_key(method, cost, cost.max_scale), filter_type,
+                               adjustments, encoding.key())
+        
+        async def compute():
+            async with app.ctx.admission.reserve(cost):
+                async with image_source(img_bytes) as source:
+                    return await run_in_pool(process_file, source, method, filter_type, adjustments,
+                                             encoding, cost.max_scale)
+        result = await cached_result(key, compute, encoding)
+        if result is None:
+            logger.error("组合处理失败")
+            return json({"error": "图片处理失败"}, status=500)
+        
+        logger.info(f"组合处理成功: 方法={method}, 滤镜={filter_type}, 调整={adjustments}")
+        body = {"success": True, "method": method, "filter": filter_type, "adjustments": adjustments,
+                "scale_factor": cost.max_scale}
+        headers = {"X-Scale-Factor": str(cost.max_scale)}
+        if parse_bool(params.get("keep") or False):
+            body["pyramid"] = await keep_pyramid(result[0])
+            headers["X-Image-Handle"] = body["pyramid"]["handle"]
+        return await send_result(request, mode, encoding, result, body, "processed_image", headers=headers)
+        
+    except ExecutorError as e:
+        logger.warning(f"执行池拒绝或超时: {e}")
+        return executor_error_response(e)
+    
+    except Exception as e:
+        logger.error(f"组合处理失败: {e}")
+        return json({"error": f"处理失败: {str(e)}"}, status=500)
+
+def preview_edge(params):
+    """代理图长边：客户端按视口请求的尺寸，不超过配置的上限"""
+    edge = int(params.get("max_edge") or app.config.PREVIEW_DEFAULT_EDGE)
+    return max(16, min(edge, app.config.PREVIEW_MAX_EDGE))
+
+def preview_edits(params):
+    """预览/导出请求中的滤镜和调整参数"""
+    return params.get("filter") or None, parse_adjustments(params)
+
+@app.route("/api/preview", methods=["POST"])
+async def create_preview(request: Request):
+    """创建预览会话：解码一次原图并保存缩小的代理图"""
+    try:
+        logger.info("收到创建预览会话请求")
+        images = request_images(request, "image")
+        if not images:
+            logger.warning("预览会话缺少图片数据")
+            return json({"error": "缺少图片数据"}, status=400)
+        
+        try:
+            img_bytes = bytes(image_input_bytes(images[0]))
+            max_edge = preview_edge(request_params(request))
+        except (ValueError, IndexError, TypeError) as e:
+            logger.warning(f"预览参数无效: {e}")
+            return json({"error": "图片数据或参数无效"}, status=400)
+        try:
+            encoding = encode_options(request, "JPEG", app.config.PREVIEW_QUALITY)
+        except (ValueError, TypeError) as e:
+            return encoding_error_response(e)
+        
+        # 只读取文件头检查尺寸，代理图按缩小后的尺寸解码
+        app.ctx.admission.plan(img_bytes)
+        started = time.perf_counter()
+        proxy, full_size = await asyncio.to_thread(make_proxy, img_bytes, max_edge)
+        session = app.ctx.previews.create(img_bytes, proxy, full_size)
+        preview_bytes, stats = await asyncio.to_thread(render_preview, proxy, None, None, encoding)
+        elapsed = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"预览会话创建完成: {session.id}, 耗时 {elapsed}ms")
+        return json({"success": True, **session.describe(), "render_ms": elapsed,
+                     "preview_image": to_data_url(preview_bytes, encoding.format), "encoding": stats})
+        
+    except ExecutorError as e:
+        logger.warning(f"预览会话被拒绝: {e}")
+        return executor_error_response(e)
+    
+    except Exception as e:
+        logger.error(f"创建预览会话失败: {e}")
+        return json({"error": f"创建预览会话失败: {str(e)}"}, status=500)
+
+@app.route("/api/preview/<session_id>/render", methods=["POST"])
+async def render_preview_api(request: Request, session_id: str):
+    """在代理图上应用滤镜和调整，返回预览结果"""
+    try:
+        session = app.ctx.previews.get(session_id)
+        if session is None:
+            logger.warning(f"预览会话不存在或已过期: {session_id}")
+            return json({"error": "预览会话不存在或已过期"}, status=404)
+        
+        try:
+            filter_type, adjustments = preview_edits(request_params(request))
+        except (ValueError, TypeError) as e:
+            logger.warning(f"调整参数无效: {e}")
+            return json({"error": "调整参数无效"}, status=400)
+        
+        # 代理图很小，直接在线程中处理，不经过执行池排队
+        mode, fmt = negotiate(request)
+        try:
+            encoding = encode_options(request, fmt, app.config.PREVIEW_QUALITY)
+        except (ValueError, TypeError) as e:
+            return encoding_error_response(e)
+        started = time.perf_counter()
+        result = await asyncio.to_thread(render_preview, session.proxy, filter_type, adjustments, encoding)
+        elapsed = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"预览渲染完成: {session_id}, 耗时 {elapsed}ms")
+        return await send_result(request, mode, encoding, result,
+                                 {"success": True, "session_id": session_id, "render_ms": elapsed},
+                                 "preview_image", headers={"X-Render-Ms": str(elapsed)})
+        
+    except Exception as e:
+        logger.error(f"预览渲染失败: {e}")
+        return json({"error": f"预览渲染失败: {str(e)}"}, status=500)
+
+@app.route("/api/preview/<session_id>/export", methods=["POST"])
+async def export_preview_api(request: Request, session_id: str):
+    """按预览的滤镜和调整参数渲染全分辨率结果"""
+    try:
+        session = app.ctx.previews.get(session_id)
+        if session is None:
+            logger.warning(f"预览会话不存在或已过期: {session_id}")
+            return json({"error": "预览会话不存在或已过期"}, status=404)
+        
+        try:
+            filter_type, adjustments = preview_edits(request_params(request))
+        except (ValueError, TypeError) as e:
+            logger.warning(f"调整参数无效: {e}")
+            return json({"error": "调整参数无效"}, status=400)
+        
+        # 全分辨率渲染在执行池中进行
+        mode, fmt = negotiate(request)
+        try:
+            encoding = encode_options(request, fmt)
+        except (ValueError, TypeError) as e:
+            return encoding_error_response(e)
+        key = await result_key(session.source, "export", filter_type, adjustments,
+                               app.config.POINT_OPS_BACKEND, encoding.key())
+        cost = app.ctx.admission.plan(session.source)
+        result = await cached_result(
+            key, lambda: run_admitted(cost, export_image_data, session.source, filter_type, adjustments, encoding),
+            encoding)
+        
+        logger.info(f"预览导出完成: {session_id}")
+        return await send_result(request, mode, encoding, result,
+                                 {"success": True, "session_id": session_id}, "image")
+        
+    except ExecutorError as e:
+        logger.warning(f"执行池拒绝或超时: {e}")
+        return executor_error_response(e)
+    
+    except Exception as e:
+        logger.error(f"预览导出失败: {e}")
+        return json({"error": f"预览导出失败: {str(e)}"}, status=500)
+
+@app.route("/api/preview/<session_id>", methods=["DELETE"])
+async def delete_preview(request: Request, session_id: str):
+    """关闭预览会话，释放代理图"""
+    if not app.ctx.previews.delete(session_id):
+        return json({"error": "预览会话不存在或已过期"}, status=404)
+    logger.info(f"预览会话已关闭: {session_id}")
+    return json({"success": True})
+
+def poster_layout(params, count):
+    """海报请求中的布局参数：layout（grid/horizontal）、columns（grid 每行的图片数）、cell_size"""
+    cell_size = int(params.get("cell_size") or app.config.POSTER_CELL_SIZE)
+    cell_size = max(16, min(cell_size, app.config.POSTER_MAX_CELL_SIZE))
+    return PosterLayout(count, params.get("layout") or "grid", int(params.get("columns") or 3),
+                        cell_size, app.config.POSTER_CELL_PADDING)
+
+def poster_image_ids(params):
+    """海报请求中引用的预览会话ID或结果金字塔句柄，JSON列表或逗号分隔的字符串"""
+    ids = params.get("image_ids") or []
+    if isinstance(ids, str):
+        ids = [image_id for image_id in ids.split(",") if image_id]
+    return list(ids)
+
+def preview_poster_source(session_id, cell_size):
+    """预览会话或结果金字塔作为海报图片
+
+    预览代理图不小于单元格时直接使用，否则从原图解码；结果金字塔从保存的字节解码。
+    """
+    session = app.ctx.previews.get(session_id)
+    if session is None:
+        pyramid = app.ctx.pyramids.get(session_id)
+        if pyramid is None:
+            raise KeyError(session_id)
+        return pyramid.source
+    if min(session.proxy.size) >= cell_size:
+        return session.proxy
+    return session.source
+
+async def compose_poster(sources, layout, encoding):
+    """把单元格分散到执行池，按完成顺序粘贴到预先分配的画布，返回编码结果"""
+    compositor = PosterCompositor(layout)
+
+    async def cell(index):
+        try:
+            return await run_in_pool(poster_cell, sources[index], layout.cell_size)
+        except ExecutorError:
+            raise
+        except Exception as e:
+            logger.error(f"处理海报图片 {index} 失败: {e}")
+            return None
+
+    async for index, image in iter_completed(range(len(sources)), cell, app.config.POSTER_CELL_CONCURRENCY):
+        if image is not None:
+            compositor.paste(index, image)
+    logger.info(f"海报生成完成: {compositor.placed}/{len(sources)} 张图片")
+    return await asyncio.to_thread(encode_image, compositor.canvas, encoding)
+
 @app.route("/api/generate-poster", methods=["POST"])
 async def generate_poster_api(request: Request):
-    """生成海报"""
+    """生成海报
+
+    图片可以是 multipart 上传的 images 分段、JSON 中 images 字段的 base64 data URL，
+    或 image_ids 引用的预览会话和结果金字塔（排在上传的图片之后）。
+    """
     try:
         logger.info("收到海报生成请求")
-        data = request.json
-        images = data.get("images", [])
-        layout = data.get("layout", "grid")
+        params = request_params(request)
+        images = request_images(request, "images")
+        image_ids = poster_image_ids(params)
         
-        if not images:
+        if not images and not image_ids:
             logger.warning("海报生成无图片")
             return json({"error": "没有图片"}, status=400)
         
-        # 生成海报
-        poster = create_poster(images, layout)
+        try:
+            layout = poster_layout(params, len(images) + len(image_ids))
+            images = images + [preview_poster_source(image_id, layout.cell_size) for image_id in image_ids]
+        except (ValueError, TypeError) as e:
+            logger.warning(f"海报参数无效: {e}")
+            return json({"error": "海报参数无效"}, status=400)
+        except KeyError as e:
+            logger.warning(f"图片ID不存在或已过期: {e}")
+            return json({"error": f"图片ID不存在或已过期: {e.args[0]}"}, status=404)
+        
+        # 画布按输出像素做准入检查
+        width, height = layout.size
+        if app.config.MAX_OUTPUT_PIXELS and layout.pixels > app.config.MAX_OUTPUT_PIXELS:
+            raise ImageTooLargeError(f"海报尺寸 {width}x{height} 超出上限")
+        cost = Cost(width, height, [1])
+        
+        # 在执行池中生成海报
+        mode, fmt = negotiate(request)
+        try:
+            encoding = encode_options(request, fmt)
+        except (ValueError, TypeError) as e:
+            return encoding_error_response(e)
+        if app.config.POSTER_CELL_CONCURRENCY > 0:
+            async with app.ctx.admission.reserve(cost):
+                result = await compose_poster(images, layout, encoding)
+        else:
+            result = await run_admitted(cost, poster_image_data, images, layout, encoding)
         
-        if poster:
-            # 转换为base64
-            buffer = io.BytesIO()
-            poster.save(buffer, format='JPEG', quality=95)
-            img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
+        if result:
             logger.info("海报生成成功")
-            return json({
-                "success": True,
-                "poster": f"data:image/jpeg;base64,{img_base64}"
-            })
+            return await send_result(request, mode, encoding, result,
+                                     {"success": True, "layout": layout.describe()}, "poster")
         else:
             logger.error("海报生成失败")
             return json({"error": "海报生成失败"}, status=500)
         
+    except ExecutorError as e:
+        logger.warning(f"执行池拒绝或超时: {e}")
+        return executor_error_response(e)
+    
     except Exception as e:
         logger.error(f"海报生成失败: {e}")
         return json({"error": f"海报生成失败: {str(e)}"}, status=500)
 
+def handle_not_found_response(handle):
+    """图片句柄不存在或已过期时的响应"""
+    logger.warning(f"图片句柄不存在或已过期: {handle}")
+    return json({"error": "图片句柄不存在或已过期"}, status=404)
+
+@app.route("/api/pyramids", methods=["POST"])
+async def create_pyramid_api(request: Request):
+    """保存一张图片（通常是增强结果）的金字塔，返回句柄和各级尺寸"""
+    try:
+        logger.info("收到保存结果金字塔请求")
+        images = request_images(request, "image")
+        if not images:
+            logger.warning("结果金字塔缺少图片数据")
+            return json({"error": "缺少图片数据"}, status=400)
+        
+        try:
+            img_bytes = image_input_bytes(images[0])
+        except (ValueError, IndexError) as e:
+            logger.warning(f"图片数据无效: {e}")
+            return json({"error": "图片数据无效"}, status=400)
+        
+        # 只读取文件头检查尺寸
+        app.ctx.admission.plan(img_bytes)
+        return json({"success": True, **await keep_pyramid(img_bytes)})
+        
+    except ExecutorError as e:
+        logger.warning(f"结果金字塔被拒绝: {e}")
+        return executor_error_response(e)
+    
+    except Exception as e:
+        logger.error(f"保存结果金字塔失败: {e}")
+        return json({"error": f"保存结果金字塔失败: {str(e)}"}, status=500)
+
+@app.route("/api/pyramids/<handle>")
+async def get_pyramid(request: Request, handle: str):
+    """查询结果金字塔的尺寸和级别"""
+    pyramid = app.ctx.pyramids.get(handle)
+    if pyramid is None:
+        return handle_not_found_response(handle)
+    return json({"success": True, **pyramid.describe()})
+
+@app.route("/api/pyramids/<handle>", methods=["DELETE"])
+async def delete_pyramid(request: Request, handle: str):
+    """释放结果金字塔"""
+    if not app.ctx.pyramids.delete(handle):
+        return handle_not_found_response(handle)
+    logger.info(f"结果金字塔已释放: {handle}")
+    return json({"success": True})
+
 @app.route("/api/filters")
 async def get_filters(request: Request):
     """获取可用的滤镜列表"""
@@ -818,6 +1742,15 @@ async def get_filters(request: Request):
     logger.info("返回滤镜列表")
     return json({"filters": filters})
 
+def run_server(host="0.0.0.0", port=8000, **kwargs):
+    """启动服务
+
+    Sanic 的工作进程是守护进程，即使只有一个工作进程也不能创建进程池；
+    POOL_KIND=process 时以单进程模式运行，请求处理在主进程中，执行池才能使用子进程。
+    """
+    kwargs.setdefault("single_process", app.config.POOL_KIND == "process")
+    app.run(host=host, port=port, **kwargs)
+
 if __name__ == "__main__":
     logger.info("应用启动")
-    app.run(host="0.0.0.0", port=8000, debug=True) 
\ No newline at end of file
+    run_server(debug=True) 
\ No newline at end of file
@@ -0,0 +1,537 @@
+"""
+性能基准测试
+
+生成多种分辨率的合成照片（默认 0.3、2、12、24 百万像素），测量：
+
+- 每种增强方法（增强管线注册表中的全部方法，即各 enhance_* 函数）的总耗时和各阶段耗时；
+- 每种增强方法单独的放大耗时，分别使用 PIL 和 OpenCV 放大后端（--resize-policy 据此生成放大后端策略）；
+- AdvancedImageProcessor 的各增强方法（未安装 torch 时跳过AI相关方法）；
+- 解码、每个滤镜预设和每个调整参数的耗时；
+- 在进程内启动 Sanic 服务，以多个并发客户端请求各接口的延迟分位数和吞吐量。
+
+每个用例记录执行期间的峰值常驻内存。结果输出为JSON，便于比较不同提交；
+指定 --baseline 时与基准结果比较，中位耗时变慢超过 --threshold 的用例视为性能回退，
+进程以非零状态退出。
+
+用法：
+    python benchmark.py --sizes 0.3,2 --repeat 3 --output bench.json
+    python benchmark.py --only "*/resize/*" --resize-policy resize_policy.json
+    python benchmark.py --only "*/filter/*" --baseline bench.json --threshold 0.2
+"""
+
+import argparse
+import asyncio
+import base64
+import fnmatch
+import gc
+import importlib.util
+import io
+import json as json_lib
+import logging
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+from PIL import Image
+
+from model_registry import process_rss
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (0.3, 2, 12, 24)
+
+# 调整参数用例：各参数单独计时，再整体计时
+ADJUSTMENTS = {"brightness": 1.1, "contrast": 1.2, "saturation": 1.15, "sharpness": 2.0}
+
+
+def synthetic_image(megapixels, seed=0):
+    """生成 4:3 的合成照片并编码为JPEG，返回 (JPEG字节, 宽, 高)
+
+    由渐变、纹理、色块边缘和噪声组成，编码体积和处理代价接近真实照片。
+    """
+    width = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = int(round(width * 3 / 4))
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    texture = np.sin(x * 90) * np.cos(y * 70) * 25
+    blocks = ((np.floor(x * 7) + np.floor(y * 5)) % 2) * 40
+    channels = []
+    for idx, base in enumerate((x * 150 + 50, y * 140 + 60, (x + y) * 80 + 40)):
+        channel = base + texture * (idx + 1) / 2 + blocks
+        channel = channel + rng.normal(0, 6, (height, width)).astype(np.float32)
+        channels.append(np.clip(channel, 0, 255).astype(np.uint8))
+    buffer = io.BytesIO()
+    Image.fromarray(np.dstack(channels)).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue(), width, height
+
+
+class RssSampler:
+    """后台线程按固定间隔采样常驻内存，记录用例执行期间的峰值"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, process_rss())
+
+    def __enter__(self):
+        gc.collect()
+        self.start = self.peak = process_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, process_rss())
+
+    def report(self):
+        return {
+            "peak_rss_mb": round(self.peak / 1024 / 1024, 1),
+            "rss_delta_mb": round((self.peak - self.start) / 1024 / 1024, 1),
+        }
+
+
+def summarize(durations):
+    """耗时列表（秒）的统计"""
+    ordered = sorted(durations)
+    return {
+        "runs": len(ordered),
+        "median_s": round(statistics.median(ordered), 4),
+        "min_s": round(ordered[0], 4),
+        "max_s": round(ordered[-1], 4),
+    }
+
+
+def measure(func, repeat):
+    """重复执行 func 并统计耗时；func 返回 (结果, 阶段耗时) ，结果为None视为失败"""
+    durations = []
+    stages = None
+    with RssSampler() as rss:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result, stages = func()
+            durations.append(time.perf_counter() - started)
+            if result is None:
+                return {"status": "failed", **rss.report()}
+            del result
+    case = {"status": "ok", **summarize(durations), **rss.report()}
+    if stages:
+        case["stages_ms"] = stages
+    return case
+
+
+class Benchmark:
+    """基准测试运行器，按 "尺寸/分组/名称" 记录用例结果"""
+
+    def __init__(self, sizes, repeat=3, only=None, max_output_mp=100, clients=4, requests_per_client=2):
+        self.sizes = sizes
+        self.repeat = repeat
+        self.only = only or []
+        self.max_output_mp = max_output_mp
+        self.clients = clients
+        self.requests_per_client = requests_per_client
+        self.cases = {}
+        # 各尺寸的接口用例：(尺寸标签, 图片字节)，所有尺寸共用一次服务启动
+        self._endpoint_inputs = []
+
+    def selected(self, name):
+        return not self.only or any(fnmatch.fnmatch(name, pattern) for pattern in self.only)
+
+    def record(self, name, case):
+        self.cases[name] = case
+        status = case["status"]
+        detail = f"{case['median_s']:.3f}s" if status == "ok" else case.get("reason", "")
+        print(f"{name:<48} {status:<8} {detail}", flush=True)
+
+    def run_case(self, name, func, output_pixels=0):
+        if not self.selected(name):
+            return
+        if output_pixels > self.max_output_mp * 1e6:
+            self.record(name, {"status": "skipped",
+                               "reason": f"输出 {output_pixels / 1e6:.0f}MP 超过上限 {self.max_output_mp}MP"})
+            return
+        try:
+            self.record(name, measure(func, self.repeat))
+        except Exception as e:
+            self.record(name, {"status": "failed", "reason": str(e)})
+
+    def run_size(self, megapixels):
+        import app as app_module
+        from pipeline import PIPELINES, run_pipeline
+        from image_processor import AdvancedImageProcessor
+
+        img_bytes, width, height = synthetic_image(megapixels)
+        label = f"{megapixels:g}MP"
+        pixels = width * height
+        print(f"== {label}: {width}x{height}, JPEG {len(img_bytes) / 1024 / 1024:.1f}MB", flush=True)
+
+        def decode():
+            image = app_module.load_oriented(img_bytes)
+            image.load()
+            return image, None
+        self.run_case(f"{label}/decode/oriented", decode)
+
+        # 增强管线：与 enhance_* 函数相同的调用，不使用图片缓存以测量冷启动耗时
+        for pipeline in PIPELINES.values():
+            def enhance(pipeline=pipeline):
+                image, timings = run_pipeline(img_bytes, pipeline.id, app_module.create_engine())
+                return image, app_module.format_timings(timings)
+            self.run_case(f"{label}/enhance/{pipeline.id}", enhance, pixels * pipeline.scale_factor ** 2)
+
+        self.run_resize(label, img_bytes, app_module)
+
+        processor = AdvancedImageProcessor(app_module.app.config.TILE_MEMORY_BUDGET)
+        has_torch = importlib.util.find_spec("torch") is not None
+        for method in ("enhance_traditional", "enhance_quality", "enhance_advanced", "enhance_ai"):
+            name = f"{label}/processor/{method}"
+            if method in ("enhance_advanced", "enhance_ai") and not has_torch:
+                if self.selected(name):
+                    self.record(name, {"status": "skipped", "reason": "未安装torch"})
+                continue
+            self.run_case(name, lambda method=method: (getattr(processor, method)(img_bytes), None), pixels * 4)
+
+        self.run_filters(label, img_bytes, app_module)
+        self._endpoint_inputs.append((label, img_bytes))
+
+    def run_resize(self, label, img_bytes, app_module):
+        """每种增强方法的放大（按配置的插值核）分别用各放大后端计时，记录输出像素数"""
+        from pipeline import PIPELINES
+        from resize import BACKENDS, kernel, resize_image
+
+        names = [f"{label}/resize/{method}/{backend}" for method in PIPELINES for backend in BACKENDS]
+        if not any(self.selected(name) for name in names):
+            return
+        image = app_module.load_oriented(img_bytes)
+        app_module.create_engine()  # 按配置设置 OpenCV 线程数
+        policy = app_module.resize_policy()
+        for pipeline in PIPELINES.values():
+            resample = kernel(policy.kernel(pipeline.id, pipeline.resample))
+            size = (image.width * pipeline.scale_factor, image.height * pipeline.scale_factor)
+            for backend in BACKENDS:
+                name = f"{label}/resize/{pipeline.id}/{backend}"
+                self.run_case(name, lambda backend=backend: (resize_image(image, size, resample, backend), None),
+                              size[0] * size[1])
+                if name in self.cases:
+                    self.cases[name]["output_pixels"] = size[0] * size[1]
+
+    def run_filters(self, label, img_bytes, app_module):
+        """每个滤镜预设整体计时，并单独测量其中每个颜色阶段"""
+        names = [f"{label}/filter/{filter_type}" for filter_type in app_module.FILTER_PRESETS] + [f"{label}/adjust/all"]
+        if not any(self.selected(name) for name in names):
+            return
+        image = app_module.load_oriented(img_bytes)
+        for filter_type, stages in app_module.FILTER_PRESETS.items():
+            def apply(filter_type=filter_type, stages=stages):
+                stage_ms = {}
+                for idx, stage in enumerate(stages):
+                    started = time.perf_counter()
+                    app_module.apply_color_stages(image, [stage])
+                    stage_ms[f"{idx}:{stage.name}"] = round((time.perf_counter() - started) * 1000, 1)
+                started = time.perf_counter()
+                result = app_module.apply_filter(image, filter_type)
+                stage_ms["combined"] = round((time.perf_counter() - started) * 1000, 1)
+                return result, stage_ms
+            self.run_case(f"{label}/filter/{filter_type}", apply)
+
+        def adjust():
+            stage_ms = {}
+            for key, value in ADJUSTMENTS.items():
+                started = time.perf_counter()
+                app_module.apply_adjustments(image, {key: value})
+                stage_ms[key] = round((time.perf_counter() - started) * 1000, 1)
+            started = time.perf_counter()
+            result = app_module.apply_adjustments(image, ADJUSTMENTS)
+            stage_ms["combined"] = round((time.perf_counter() - started) * 1000, 1)
+            return result, stage_ms
+        self.run_case(f"{label}/adjust/all", adjust)
+
+    def run_endpoints(self):
+        """在进程内启动一次服务，以并发客户端请求各尺寸的接口用例"""
+        jobs = []
+        for label, img_bytes in self._endpoint_inputs:
+            for name, scenario in endpoint_scenarios(img_bytes).items():
+                full_name = f"{label}/endpoint/{name}"
+                if self.selected(full_name):
+                    jobs.append((full_name, scenario))
+        if not jobs:
+            return
+        import app as app_module
+        print("== 接口", flush=True)
+        asyncio.run(self._drive_endpoints(app_module.app, jobs))
+
+    async def _drive_endpoints(self, app, jobs):
+        # 绑定随机空闲端口
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        sock.listen()
+        port = sock.getsockname()[1]
+        server = await app.create_server(sock=sock, return_asyncio_server=True)
+        await server.startup()
+        await server.before_start()
+        await server.start_serving()
+        await server.after_start()
+        try:
+            for name, scenario in jobs:
+                self.record(name, await self._drive(port, scenario))
+        finally:
+            await server.before_stop()
+            server.close()
+            await server.wait_closed()
+            await server.after_stop()
+
+    async def _drive(self, port, scenario):
+        """clients 个客户端各自连续发送 requests_per_client 个请求"""
+        prepare, request = scenario
+        context = await prepare(port) if prepare else None
+        latencies = []
+        errors = 0
+
+        async def client():
+            nonlocal errors
+            for _ in range(self.requests_per_client):
+                started = time.perf_counter()
+                status, _ = await request(port, context)
+                latencies.append(time.perf_counter() - started)
+                if status != 200:
+                    errors += 1
+
+        with RssSampler() as rss:
+            started = time.perf_counter()
+            await asyncio.gather(*(client() for _ in range(self.clients)))
+            wall = time.perf_counter() - started
+        ordered = sorted(latencies)
+        return {
+            "status": "ok" if not errors else "failed",
+            **summarize(latencies),
+            "p95_s": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+            "clients": self.clients,
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / wall, 2),
+            **rss.report(),
+        }
+
+    def run(self):
+        for megapixels in self.sizes:
+            self.run_size(megapixels)
+            gc.collect()
+        self.run_endpoints()
+        return self.cases
+
+
+async def http_request(port, method, path, body=b"", headers=None):
+    """最小的 HTTP/1.1 客户端，避免为基准测试引入额外依赖，返回 (状态码, 响应体)"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    lines = [f"{method} {path} HTTP/1.1", "Host: 127.0.0.1", "Connection: close",
+             f"Content-Length: {len(body)}"]
+    lines += [f"{key}: {value}" for key, value in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("utf-8") + body)
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+    head, _, payload = data.partition(b"\r\n\r\n")
+    return int(head.split(b" ", 2)[1]), payload
+
+
+def multipart_body(fields, files):
+    """构造 multipart/form-data 请求体，files 为 [(字段名, 文件名, 字节)]，返回 (请求体, Content-Type)"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8"))
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: image/jpeg\r\n\r\n'.encode("utf-8") + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def endpoint_scenarios(img_bytes):
+    """接口用例：名称 -> (准备函数或None, 请求函数)"""
+    upload, upload_type = multipart_body({"method": "traditional"}, [("file", "bench.jpg", img_bytes)])
+    poster, poster_type = multipart_body({"layout": "grid"}, [("images", f"{i}.jpg", img_bytes) for i in range(3)])
+    binary = {"Content-Type": "image/jpeg", "Accept": "image/jpeg"}
+    encoded = base64.b64encode(img_bytes).decode("ascii")
+    batch = json_lib.dumps({"files": [f"data:image/jpeg;base64,{encoded}"] * 3, "method": "traditional"}).encode()
+    process = json_lib.dumps({"image": f"data:image/jpeg;base64,{encoded}", "method": "traditional",
+                              "filter": "vintage", "adjustments": {"brightness": 1.1, "contrast": 1.2}}).encode()
+
+    async def create_preview(port):
+        status, payload = await http_request(port, "POST", "/api/preview?max_edge=1024", img_bytes,
+                                             {"Content-Type": "image/jpeg"})
+        return json_lib.loads(payload)["session_id"]
+
+    async def run_job(port, _):
+        """提交任务、轮询到完成后取回结果，计时覆盖整个往返"""
+        status, payload = await http_request(port, "POST", "/api/jobs", upload, {"Content-Type": upload_type})
+        if status != 202:
+            return status, payload
+        job_id = json_lib.loads(payload)["job_id"]
+        while True:
+            status, payload = await http_request(port, "GET", f"/api/jobs/{job_id}")
+            if status != 200 or json_lib.loads(payload)["status"] in ("done", "failed"):
+                break
+            await asyncio.sleep(0.02)
+        return await http_request(port, "GET", f"/api/jobs/{job_id}/result", headers={"Accept": "image/jpeg"})
+
+    return {
+        "upload_traditional_json": (None, lambda port, _: http_request(
+            port, "POST", "/api/upload", upload, {"Content-Type": upload_type})),
+        "upload_traditional_binary": (None, lambda port, _: http_request(
+            port, "POST", "/api/upload", upload, {"Content-Type": upload_type, "Accept": "image/jpeg"})),
+        "batch_enhance_json": (None, lambda port, _: http_request(
+            port, "POST", "/api/batch-enhance", batch, {"Content-Type": "application/json"})),
+        "batch_enhance_multipart": (None, lambda port, _: http_request(
+            port, "POST", "/api/batch-enhance", batch, {"Content-Type": "application/json",
+                                                        "Accept": "multipart/mixed"})),
+        "job_roundtrip": (None, run_job),
+        "process_json": (None, lambda port, _: http_request(
+            port, "POST", "/api/process", process, {"Content-Type": "application/json"})),
+        "process_binary": (None, lambda port, _: http_request(
+            port, "POST", "/api/process", process, {"Content-Type": "application/json", "Accept": "image/jpeg"})),
+        "apply_filter": (None, lambda port, _: http_request(
+            port, "POST", "/api/apply-filter?filter=vintage", img_bytes, binary)),
+        "adjust_image": (None, lambda port, _: http_request(
+            port, "POST", "/api/adjust-image?brightness=1.1&contrast=1.2&saturation=1.15", img_bytes, binary)),
+        "preview_render": (create_preview, lambda port, session_id: http_request(
+            port, "POST", f"/api/preview/{session_id}/render?filter=vintage", b"", {"Accept": "image/jpeg"})),
+        "generate_poster": (None, lambda port, _: http_request(
+            port, "POST", "/api/generate-poster", poster, {"Content-Type": poster_type, "Accept": "image/jpeg"})),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(cases, baseline, threshold):
+    """与基准结果比较中位耗时，返回变慢超过 threshold 的用例列表 [(名称, 基准, 当前, 变化比例)]"""
+    regressions = []
+    for name, case in cases.items():
+        before = baseline.get("cases", {}).get(name)
+        if case.get("status") != "ok" or not before or before.get("status") != "ok":
+            continue
+        change = case["median_s"] / before["median_s"] - 1 if before["median_s"] else 0.0
+        marker = "回退" if change > threshold else ""
+        print(f"{name:<48} {before['median_s']:>9.3f}s -> {case['median_s']:>9.3f}s {change:+7.1%} {marker}")
+        if change > threshold:
+            regressions.append((name, before["median_s"], case["median_s"], change))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="图片增强服务性能基准测试")
+    parser.add_argument("--sizes", default=",".join(f"{size:g}" for size in DEFAULT_SIZES),
+                        help="合成图片的尺寸（百万像素），逗号分隔")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例重复次数，取中位数")
+    parser.add_argument("--only", action="append", default=[],
+                        help="只运行匹配的用例（通配符，如 '2MP/filter/*'），可重复指定")
+    parser.add_argument("--max-output-mp", type=float, default=100, help="跳过输出超过该像素数（百万）的增强用例")
+    parser.add_argument("--clients", type=int, default=4, help="接口用例的并发客户端数")
+    parser.add_argument("--requests", type=int, default=2, help="接口用例中每个客户端的请求数")
+    parser.add_argument("--pool-kind", choices=("process", "thread"), help="执行池类型，默认使用应用配置")
+    parser.add_argument("--point-backend", choices=("fused", "opencv", "pil"), help="逐像素颜色阶段后端，默认使用应用配置")
+    parser.add_argument("--resize-backend", choices=("auto", "pil", "opencv"), help="放大后端，默认使用应用配置")
+    parser.add_argument("--resize-threads", type=int, help="OpenCV 线程数（cv2.setNumThreads），默认使用应用配置")
+    parser.add_argument("--resize-policy", help="根据 resize 用例生成放大后端策略并保存到该文件（RESIZE_POLICY_FILE）")
+    parser.add_argument("--with-cache", action="store_true", help="保留结果缓存和图片缓存（默认关闭以测量实际计算）")
+    parser.add_argument("--output", help="结果JSON文件，默认输出到标准输出")
+    parser.add_argument("--baseline", help="基准结果JSON文件，用于检测性能回退")
+    parser.add_argument("--threshold", type=float, default=0.2, help="中位耗时变慢超过该比例视为回退")
+    parser.add_argument("--log-level", default="WARNING", help="基准测试期间的日志级别")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    import app as app_module
+
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger("sanic").setLevel(args.log_level)
+    config = app_module.app.config
+    # 服务在本进程中启动，与单进程部署相同，POOL_KIND=process 时执行池使用子进程
+    if args.pool_kind:
+        config.POOL_KIND = args.pool_kind
+    if args.point_backend:
+        config.POINT_OPS_BACKEND = args.point_backend
+    if args.resize_backend:
+        config.RESIZE_BACKEND = args.resize_backend
+    if args.resize_threads is not None:
+        config.RESIZE_THREADS = args.resize_threads
+    if not args.with_cache:
+        config.RESULT_CACHE_SIZE = 0
+        config.RESULT_CACHE_DIR = ""
+        config.IMAGE_CACHE_SIZE = 0
+
+    sizes = [float(size) for size in args.sizes.split(",") if size]
+    benchmark = Benchmark(sizes, args.repeat, args.only, args.max_output_mp, args.clients, args.requests)
+    started = time.perf_counter()
+    cases = benchmark.run()
+    result = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "sizes": sizes,
+            "repeat": args.repeat,
+            "pool_kind": config.POOL_KIND,
+            "point_backend": config.POINT_OPS_BACKEND,
+            "resize_backend": config.RESIZE_BACKEND,
+            "resize_threads": config.RESIZE_THREADS,
+            "cache": args.with_cache,
+            "total_seconds": round(time.perf_counter() - started, 1),
+        },
+        "cases": cases,
+    }
+
+    text = json_lib.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"结果已保存: {args.output}")
+    else:
+        print(text)
+
+    if args.resize_policy:
+        from resize import ResizePolicy
+        policy = ResizePolicy.from_cases(cases, kernels=config.RESIZE_KERNELS)
+        with open(args.resize_policy, "w", encoding="utf-8") as f:
+            json_lib.dump(policy.to_dict(), f, ensure_ascii=False, indent=2)
+        print(f"放大后端策略已保存: {args.resize_policy} {policy.rules}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json_lib.load(f)
+        regressions = compare(cases, baseline, args.threshold)
+        if regressions:
+            print(f"发现 {len(regressions)} 个性能回退（阈值 {args.threshold:.0%}）")
+            return 1
+        print("未发现性能回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""
+结果缓存
+
+用户经常重复提交同一张图片和同一种方法（刷新页面、对比不同方法），
+每次都会完整重跑增强管线。本模块提供两类缓存：
+
+- 结果缓存（ResultCache）：以输入字节的哈希加上方法、放大倍数、调整参数等作为键，
+  保存编码后的结果。内存层按LRU淘汰，可选的磁盘层按总大小淘汰，并统计命中、未命中和淘汰次数。
+- 图片缓存（进程内 LRUCache）：保存已解码的输入图片和放大后的基础图，
+  同一张源图的滤镜、调整或其他方法的增强请求可以跳过解码和放大。
+  进程池模式下每个工作进程各自持有一份。
+"""
+
+import hashlib
+import json as json_lib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def content_digest(data):
+    """图片字节的内容哈希"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(digest, *params):
+    """由输入内容哈希和处理参数生成缓存键"""
+    payload = json_lib.dumps([digest, *params], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def image_nbytes(image):
+    """PIL图片或numpy数组占用的内存估计（字节）"""
+    if hasattr(image, "nbytes"):
+        return image.nbytes
+    return image.width * image.height * len(image.getbands())
+
+
+class LRUCache:
+    """按总大小限制的线程安全LRU缓存
+
+    sizeof 用于计算条目大小，max_bytes 为0时不缓存任何内容。
+    """
+
+    def __init__(self, max_bytes, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+                self.evictions += 1
+
+    def resize(self, max_bytes):
+        """调整容量，缩小时立即淘汰"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class DiskCache:
+    """磁盘缓存层，按文件总大小淘汰最久未使用的条目"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._index = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._load_index()
+
+    def _file(self, key):
+        return os.path.join(self.path, key)
+
+    def _load_index(self):
+        """启动时按访问时间重建索引，保留上次运行的缓存"""
+        entries = []
+        for name in os.listdir(self.path):
+            full = self._file(name)
+            if name.endswith(".tmp") or not os.path.isfile(full):
+                continue
+            stat = os.stat(full)
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._size += size
+        logger.info(f"磁盘缓存已加载: {self.path}, {len(self._index)} 个条目, {self._size} 字节")
+        self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            try:
+                os.remove(self._file(key))
+            except OSError as e:
+                logger.error(f"删除磁盘缓存失败: {key}, {e}")
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+        try:
+            with open(self._file(key), "rb") as f:
+                data = f.read()
+            # 更新访问时间，重启后仍按最近使用排序
+            os.utime(self._file(key))
+        except OSError:
+            with self._lock:
+                self._size -= self._index.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        temp = self._file(key) + f".{threading.get_ident()}.tmp"
+        try:
+            with open(temp, "wb") as f:
+                f.write(data)
+            os.replace(temp, self._file(key))
+        except OSError as e:
+            logger.error(f"写入磁盘缓存失败: {key}, {e}")
+            if os.path.exists(temp):
+                os.remove(temp)
+            return
+        with self._lock:
+            self._size -= self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._size += len(data)
+            self._evict()
+
+    def stats(self):
+        return {
+            "entries": len(self._index),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class ResultCache:
+    """两级结果缓存：内存LRU层 + 可选的磁盘层
+
+    写入时同时写入两层；磁盘层命中时提升到内存层。
+    memory_bytes 为0且未配置磁盘目录时缓存关闭。
+    """
+
+    def __init__(self, memory_bytes, disk_path=None, disk_bytes=0):
+        self.memory = LRUCache(memory_bytes)
+        self.disk = DiskCache(disk_path, disk_bytes) if disk_path and disk_bytes else None
+        logger.info(f"结果缓存已启用: 内存 {memory_bytes} 字节, 磁盘 {disk_path or '未启用'}")
+
+    @property
+    def enabled(self):
+        return self.memory.max_bytes > 0 or self.disk is not None
+
+    def get(self, key):
+        data = self.memory.get(key)
+        if data is not None or self.disk is None:
+            return data
+        data = self.disk.get(key)
+        if data is not None:
+            self.memory.put(key, data)
+        return data
+
+    def put(self, key, data):
+        self.memory.put(key, data)
+        if self.disk is not None:
+            self.disk.put(key, data)
+
+    def stats(self):
+        return {
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk else None,
+        }
+
+
+_image_cache = None
+
+
+def process_image_cache(max_bytes):
+    """当前进程共享的图片缓存，容量按配置调整"""
+    global _image_cache
+    if _image_cache is None:
+        _image_cache = LRUCache(max_bytes, sizeof=image_nbytes)
+    elif _image_cache.max_bytes != max_bytes:
+        _image_cache.resize(max_bytes)
+    return _image_cache
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+接口测试的公共夹具：在同一个测试服务上发送多个请求，以及生成测试图片
+"""
+
+import base64
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def image_bytes(width=48, height=32, fmt="PNG", color=(120, 160, 200)):
+    """生成一张带渐变的测试图片并编码"""
+    img = Image.new("RGB", (width, height), color)
+    for x in range(width):
+        img.putpixel((x, x % height), (x * 5 % 256, 80, 255 - x * 5 % 256))
+    buffer = io.BytesIO()
+    img.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def data_url(data, mime="image/png"):
+    """图片字节转换为 base64 data URL"""
+    return f"data:{mime};base64,{base64.b64encode(data).decode()}"
+
+
+def decode_data_url(url):
+    """解码响应中的 data URL，返回PIL图片"""
+    return Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1])))
+
+
+def parse_multipart(response):
+    """按 Content-Type 中的 boundary 拆分 multipart/mixed 响应，返回 [(分段头, 内容)]"""
+    boundary = response.headers["content-type"].split("boundary=", 1)[1].encode()
+    parts = []
+    for chunk in response.body.split(b"--" + boundary)[1:]:
+        if chunk.startswith(b"--"):
+            break
+        head, body = chunk[2:].split(b"\r\n\r\n", 1)
+        headers = dict(line.split(": ", 1) for line in head.decode().split("\r\n"))
+        parts.append((headers, body[:-2]))
+    return parts
+
+
+@pytest.fixture
+def app_module():
+    """服务模块，执行池使用线程；测试中修改的配置在结束后恢复"""
+    import app as module
+
+    saved = dict(module.app.config)
+    module.app.config.POOL_KIND = "thread"
+    yield module
+    for key, value in saved.items():
+        if module.app.config.get(key) != value:
+            module.app.config[key] = value
+
+
+@pytest.fixture
+def client(app_module):
+    """在测试期间保持运行的测试服务客户端，多个请求共享服务端状态（任务、会话、句柄）"""
+    from sanic_testing.reusable import ReusableClient
+
+    with ReusableClient(app_module.app) as test_client:
+        yield test_client
@@ -0,0 +1,239 @@
+"""
+输出编码
+
+所有结果图片都经由这里编码。客户端可以指定：
+
+- format：JPEG、PNG、WEBP，Pillow 支持时还有 AVIF（也可通过 Accept 头协商）；
+- quality：1-100 的质量，或预设名 max/high/balanced/small/tiny；
+- target_size：目标字节数（支持 300k、2m 写法），在质量范围内二分查找
+  不超过目标的最高质量，找不到时使用最低质量并在统计中标记 target_met=false；
+- progressive / optimize：JPEG 的渐进式编码和优化的霍夫曼表，
+  optimize 对 WebP 使用最慢但最小的压缩方式，对 PNG 使用 optimize；
+- subsampling：色度抽样 4:4:4、4:2:2、4:2:0（JPEG、AVIF）。
+
+默认参数与原来的输出一致（JPEG，质量95）。编码统计（格式、质量、字节数、
+编码耗时、尝试次数）随结果返回给客户端。
+"""
+
+import io
+import logging
+import time
+
+from PIL import features
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_FORMAT = "JPEG"
+DEFAULT_QUALITY = 95
+
+# 质量预设
+QUALITY_PRESETS = {
+    "max": 95,
+    "high": 90,
+    "balanced": 82,
+    "small": 70,
+    "tiny": 50,
+}
+
+# 按目标大小查找质量时的最低质量
+MIN_TARGET_QUALITY = 20
+
+# 可用的输出格式，AVIF 取决于 Pillow 的编译选项
+FORMATS = ("JPEG", "PNG", "WEBP") + (("AVIF",) if features.check("avif") else ())
+
+# 有损格式：支持 quality 和 target_size
+LOSSY_FORMATS = ("JPEG", "WEBP", "AVIF")
+
+# 色度抽样：请求参数 -> Pillow 参数
+SUBSAMPLING = {"4:4:4": "4:4:4", "444": "4:4:4", "4:2:2": "4:2:2", "422": "4:2:2",
+               "4:2:0": "4:2:0", "420": "4:2:0"}
+
+FORMAT_ALIASES = {"JPG": "JPEG"}
+
+_TRUE = ("1", "true", "yes", "on")
+
+
+def parse_bool(value):
+    """表单/查询参数中的布尔值"""
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in _TRUE
+
+
+def _parse_size(value):
+    """目标字节数，支持 k/m 后缀"""
+    if isinstance(value, (int, float)):
+        size = int(value)
+    else:
+        text = str(value).strip().lower().rstrip("b")
+        unit = {"k": 1024, "m": 1024 * 1024}.get(text[-1:], 1)
+        size = int(float(text[:-1] if unit > 1 else text) * unit)
+    if size <= 0:
+        raise ValueError(f"目标大小无效: {value}")
+    return size
+
+
+def parse_format(value):
+    """请求参数中的输出格式，不支持时抛出 ValueError"""
+    fmt = str(value).strip().upper()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的输出格式: {value}")
+    return fmt
+
+
+class EncodeOptions:
+    """一次编码的参数，可pickle，随任务交给执行池"""
+
+    def __init__(self, format=DEFAULT_FORMAT, quality=DEFAULT_QUALITY, target_size=None,
+                 progressive=False, optimize=False, subsampling=None):
+        self.format = format
+        self.quality = quality
+        self.target_size = target_size
+        self.progressive = progressive
+        self.optimize = optimize
+        self.subsampling = subsampling
+
+    @classmethod
+    def from_params(cls, params, fmt=DEFAULT_FORMAT, quality=DEFAULT_QUALITY):
+        """从请求参数解析编码参数，fmt 和 quality 为参数未指定时的默认值
+
+        参数无效时抛出 ValueError。
+        """
+        if params.get("format"):
+            fmt = parse_format(params["format"])
+        value = params.get("quality")
+        if value not in (None, ""):
+            if str(value).lower() in QUALITY_PRESETS:
+                quality = QUALITY_PRESETS[str(value).lower()]
+            else:
+                quality = int(value)
+                if not 1 <= quality <= 100:
+                    raise ValueError(f"质量超出范围: {value}")
+        target_size = params.get("target_size")
+        subsampling = params.get("subsampling")
+        if subsampling not in (None, ""):
+            if str(subsampling) not in SUBSAMPLING:
+                raise ValueError(f"不支持的色度抽样: {subsampling}")
+            subsampling = SUBSAMPLING[str(subsampling)]
+        return cls(
+            fmt,
+            quality,
+            _parse_size(target_size) if target_size not in (None, "") else None,
+            parse_bool(params.get("progressive") or False),
+            parse_bool(params.get("optimize") or False),
+            subsampling or None,
+        )
+
+    @property
+    def lossy(self):
+        return self.format in LOSSY_FORMATS
+
+    def key(self):
+        """结果缓存键中的编码部分，不影响输出的参数不计入"""
+        if not self.lossy:
+            return f"{self.format}:opt={int(self.optimize)}"
+        parts = [self.format, f"q={self.quality}", f"opt={int(self.optimize)}"]
+        if self.target_size:
+            parts.append(f"target={self.target_size}")
+        if self.format == "JPEG":
+            parts.append(f"prog={int(self.progressive)}")
+        if self.subsampling and self.format in ("JPEG", "AVIF"):
+            parts.append(f"sub={self.subsampling}")
+        return ":".join(parts)
+
+    def save_params(self, quality):
+        """按 quality 编码时传给 Image.save 的参数"""
+        params = {}
+        if self.format == "PNG":
+            params["optimize"] = self.optimize
+            return params
+        params["quality"] = quality
+        if self.format == "JPEG":
+            params["progressive"] = self.progressive
+            params["optimize"] = self.optimize
+        elif self.format == "WEBP":
+            params["method"] = 6 if self.optimize else 4
+        if self.subsampling and self.format in ("JPEG", "AVIF"):
+            params["subsampling"] = self.subsampling
+        return params
+
+
+def _save(image, options, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format=options.format, **options.save_params(quality))
+    return buffer.getvalue()
+
+
+def _search_quality(image, options):
+    """二分查找编码结果不超过 target_size 的最高质量，返回 (字节, 质量, 尝试次数, 是否达到目标)"""
+    high = options.quality
+    data = _save(image, options, high)
+    attempts = 1
+    if len(data) <= options.target_size:
+        return data, high, attempts, True
+
+    low = min(MIN_TARGET_QUALITY, high - 1)
+    best = None
+    smallest = (data, high)
+    high -= 1
+    while low <= high:
+        quality = (low + high) // 2
+        data = _save(image, options, quality)
+        attempts += 1
+        if len(data) <= options.target_size:
+            best = (data, quality)
+            low = quality + 1
+        else:
+            if len(data) < len(smallest[0]):
+                smallest = (data, quality)
+            high = quality - 1
+    if best is None:
+        return smallest[0], smallest[1], attempts, False
+    return best[0], best[1], attempts, True
+
+
+def encode(image, options=None):
+    """按 options 编码图片，返回 (字节, 编码统计)"""
+    options = options or EncodeOptions()
+    if options.format == "JPEG" and image.mode not in ("RGB", "L", "CMYK"):
+        image = image.convert("RGB")
+    started = time.perf_counter()
+    if options.target_size and options.lossy:
+        data, quality, attempts, target_met = _search_quality(image, options)
+        if not target_met:
+            logger.warning(f"编码结果 {len(data)} 字节未达到目标 {options.target_size} 字节")
+    else:
+        data = _save(image, options, options.quality)
+        quality, attempts, target_met = options.quality, 1, None
+    stats = {
+        "format": options.format,
+        "quality": quality if options.lossy else None,
+        "bytes": len(data),
+        "encode_ms": round((time.perf_counter() - started) * 1000, 1),
+        "attempts": attempts,
+    }
+    if options.target_size:
+        stats["target_size"] = options.target_size
+        stats["target_met"] = target_met if options.lossy else len(data) <= options.target_size
+    return data, stats
+
+
+def cached_stats(data, options):
+    """命中结果缓存时的编码统计"""
+    return {"format": options.format, "bytes": len(data), "cached": True}
+
+
+def stats_headers(stats):
+    """二进制响应中的编码统计头"""
+    if not stats:
+        return {}
+    headers = {"X-Encoded-Bytes": str(stats["bytes"])}
+    if "encode_ms" in stats:
+        headers["X-Encode-Ms"] = str(stats["encode_ms"])
+    if stats.get("quality") is not None:
+        headers["X-Encode-Quality"] = str(stats["quality"])
+    if stats.get("cached"):
+        headers["X-Cache"] = "hit"
+    return headers
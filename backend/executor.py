@@ -0,0 +1,147 @@
+"""
+增强任务执行层
+
+把CPU密集的图像处理函数从Sanic事件循环中移出，交给进程池（或线程池）执行，
+事件循环只负责等待结果，从而让健康检查等轻量请求不被大图处理阻塞。
+"""
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class ExecutorError(Exception):
+    """执行层错误基类，status_code 用于生成HTTP响应"""
+    status_code = 500
+
+
+class ExecutorBusyError(ExecutorError):
+    """等待队列已满"""
+    status_code = 503
+
+
+class ExecutorTimeoutError(ExecutorError):
+    """任务执行超时"""
+    status_code = 504
+
+
+class EnhancementExecutor:
+    """增强任务执行器
+
+    kind: "process" 使用进程池，"thread" 使用线程池。
+    max_workers: 工作进程/线程数，0 或 None 表示使用CPU核心数。
+    max_queue: 所有工作者都忙时允许排队等待的任务数，超出后直接拒绝。
+    task_timeout: 单个任务的最长等待时间（秒），0 或 None 表示不限制。
+    initializer/initargs: 进程池模式下每个工作进程启动时调用的初始化函数及其参数。
+    """
+
+    def __init__(self, kind="process", max_workers=None, max_queue=32, task_timeout=300,
+                 initializer=None, initargs=()):
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.task_timeout = task_timeout or None
+        self.initializer = initializer
+        self.initargs = initargs
+        self._pool = None
+        self._active_kind = None
+        # 配置为进程池但实际使用线程池的原因
+        self._fallback_reason = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """创建底层执行池"""
+        if self._pool is not None:
+            return
+        self._fallback_reason = None
+        kind = self.kind
+        if kind == "process" and multiprocessing.current_process().daemon:
+            # Sanic 的多进程工作者是守护进程，不允许再创建子进程
+            self._fallback_reason = "Sanic工作进程为守护进程，不能创建子进程"
+            logger.warning(f"进程池未启用（POOL_KIND=process 不生效）: {self._fallback_reason}，改用线程池；"
+                           f"CPU密集的处理与事件循环共享GIL，需要隔离时以单进程模式运行服务")
+            kind = "thread"
+        if kind == "process":
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             initializer=self.initializer, initargs=self.initargs)
+            # 进程池在第一次提交任务时才 fork 工作进程，在请求中 fork 的子进程会继承当时打开的
+            # 客户端连接，服务端关闭连接后客户端收不到EOF；在服务开始接受连接前预先创建工作进程
+            self._pool.submit(os.getpid)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix="enhance")
+        self._active_kind = kind
+        logger.info(f"执行池已启动: 类型={kind}, 工作者={self.max_workers}, "
+                    f"队列上限={self.max_queue}, 超时={self.task_timeout}")
+
+    def shutdown(self):
+        """关闭执行池"""
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        logger.info("执行池已关闭")
+
+    @property
+    def pending(self):
+        """正在执行和排队中的任务数"""
+        return self._pending
+
+    def _rebuild(self, broken):
+        """重建已损坏的执行池，并发失败的任务只重建一次"""
+        with self._lock:
+            if self._pool is not broken:
+                return
+            logger.error("工作进程异常退出，重建执行池")
+            self._pool = None
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.start()
+
+    def stats(self):
+        """执行池状态，供健康检查使用"""
+        return {
+            "kind": self._active_kind or self.kind,
+            "configured_kind": self.kind,
+            "process_pool_active": self._active_kind == "process",
+            "fallback_reason": self._fallback_reason,
+            "workers": self.max_workers,
+            "pending": self._pending,
+            "max_queue": self.max_queue,
+            "task_timeout": self.task_timeout,
+        }
+
+    async def run(self, func, *args, **kwargs):
+        """在执行池中运行 func 并等待结果
+
+        进程池模式下 func 及其参数、返回值都必须可以被 pickle。
+        """
+        if self._pool is None:
+            self.start()
+        if self._pending >= self.max_workers + self.max_queue:
+            raise ExecutorBusyError("服务器繁忙，请稍后重试")
+
+        self._pending += 1
+        pool = self._pool
+        try:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))
+            return await asyncio.wait_for(future, self.task_timeout)
+        except asyncio.TimeoutError:
+            # 进程池中已开始的任务无法中断，只能放弃等待
+            logger.error(f"任务执行超时: {getattr(func, '__name__', func)}")
+            raise ExecutorTimeoutError("处理超时，请尝试缩小图片或更换增强方法")
+        except BrokenProcessPool:
+            # 工作进程异常退出（例如被OOM终止），重建进程池以便后续请求可用
+            self._rebuild(pool)
+            raise ExecutorError("处理进程异常退出")
+        finally:
+            self._pending -= 1
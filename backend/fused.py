@@ -0,0 +1,305 @@
+"""
+逐像素颜色操作融合
+
+ImageEnhance 的对比度、饱和度、亮度以及灰度转换都是逐像素操作：每次调用都会生成一幅
+整图大小的退化图再与原图混合。本模块把一串连续的这类阶段编译为尽量少的遍历：
+
+- 只作用于单个通道的阶段（亮度、对比度）合并为一张查找表，按 Image.blend 的
+  单精度计算和截断规则生成，结果与PIL链逐位一致；
+- 混合通道的阶段（饱和度、灰度）合并为一个 3x4 颜色矩阵，由PIL的矩阵转换一次完成；
+- 通过取值范围分析，确认中间结果不会被裁剪时，把相邻阶段折叠进同一个矩阵。
+
+对比度需要输入的平均灰度，未提供时根据输入图的通道直方图沿管线推算，
+只有无法推算时才执行已编译的前半段并重新统计。
+
+编译结果有两种执行方式："fused" 后端由PIL的 point/convert 执行；"opencv" 后端在
+uint8 NumPy 数组上用 cv2.transform（颜色矩阵）和 cv2.LUT（查找表）执行，
+滤镜预设通常编译为一个颜色矩阵加一张查找表。"opencv" 后端还把连续多次的
+SHARPEN 合并为一个等效的大卷积核，一次 cv2.filter2D 完成。
+
+校验模式会同时运行原有PIL链并比较，超出容差时记录错误并返回PIL结果。
+
+颜色矩阵的结果与PIL链有1~2级差异，后续的卷积滤镜会放大这一差异，
+所以后面还有卷积滤镜的阶段组只在能编译为纯查找表时融合，否则执行PIL链，
+最终结果中的差异只来自末尾的颜色阶段组（滤镜预设、调整），不超过2级。
+"""
+
+import logging
+
+import numpy as np
+from PIL import Image
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# PIL 转换为 L 模式时使用的亮度权重
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114])
+
+_LEVELS = np.arange(256)
+
+
+def is_point_stage(stage):
+    """阶段是否为可融合的逐像素颜色操作"""
+    return hasattr(stage, "affine")
+
+
+def blend_lut(degenerate, factor):
+    """与纯色图混合的查找表，计算和截断规则与 Image.blend 相同"""
+    levels = _LEVELS.astype(np.float32)
+    degenerate = np.float32(degenerate)
+    temp = degenerate + np.float32(factor) * (levels - degenerate)
+    return np.clip(temp, 0, 255).astype(np.uint8)
+
+
+class _LutOp:
+    """逐通道查找表"""
+
+    def __init__(self, lut):
+        self.luts = np.stack([lut, lut, lut])
+
+    def extend(self, lut):
+        self.luts = lut[self.luts]
+
+    def run(self, image):
+        return image.point(self.luts.ravel().tolist())
+
+    def run_array(self, arr):
+        import cv2
+        return cv2.LUT(arr, np.ascontiguousarray(self.luts.T.reshape(1, 256, 3)))
+
+
+class _MatrixOp:
+    """3x4 颜色矩阵，clips 表示输出可能超出 [0, 255] 而被裁剪"""
+
+    def __init__(self, matrix, offset, clips):
+        self.matrix = matrix
+        self.offset = offset
+        self.clips = clips
+
+    def extend(self, matrix, offset, clips):
+        self.matrix = matrix @ self.matrix
+        self.offset = matrix @ self.offset + offset
+        self.clips = clips
+
+    def values(self):
+        # 矩阵转换四舍五入，偏移减0.5以模拟 Image.blend 的向下截断
+        return np.hstack([self.matrix, (self.offset - 0.5)[:, None]])
+
+    def run(self, image):
+        return image.convert("RGB", tuple(self.values().ravel().tolist()))
+
+    def run_array(self, arr):
+        import cv2
+        # cv2.transform 的结果饱和截断到 uint8
+        return cv2.transform(arr, self.values().astype(np.float32))
+
+
+def _affine_range(matrix, offset, lo, hi):
+    """仿射变换在输入区间 [lo, hi] 上的输出区间"""
+    low = offset + np.where(matrix > 0, matrix * lo, matrix * hi).sum(axis=1)
+    high = offset + np.where(matrix > 0, matrix * hi, matrix * lo).sum(axis=1)
+    return low, high
+
+
+class _Tracker:
+    """沿管线跟踪中间结果的取值范围和通道统计，用于折叠判断和推算平均灰度"""
+
+    def __init__(self, image, with_stats):
+        self.lo = np.zeros(3)
+        self.hi = np.full(3, 255.0)
+        self.hist = None
+        self.mean = None
+        if with_stats:
+            self.hist = np.asarray(image.histogram(), dtype=np.float64).reshape(3, 256)
+            self.lo, self.hi = self._hist_range()
+
+    def _hist_range(self):
+        present = self.hist > 0
+        lo = np.array([_LEVELS[row].min() if row.any() else 0 for row in present], dtype=float)
+        hi = np.array([_LEVELS[row].max() if row.any() else 0 for row in present], dtype=float)
+        return lo, hi
+
+    def luma_mean(self):
+        """当前中间结果的平均灰度，无法推算时返回None"""
+        if self.hist is not None:
+            total = self.hist[0].sum()
+            mean_rgb = (self.hist * _LEVELS).sum(axis=1) / max(total, 1)
+        elif self.mean is not None:
+            mean_rgb = self.mean
+        else:
+            return None
+        return int(float(LUMA_WEIGHTS @ mean_rgb) + 0.5)
+
+    def apply_lut(self, lut):
+        if self.hist is not None:
+            self.hist = np.stack([np.bincount(lut, weights=row, minlength=256) for row in self.hist])
+            self.lo, self.hi = self._hist_range()
+            return
+        lo, hi = self.lo.astype(int), self.hi.astype(int)
+        self.lo = np.array([lut[a:b + 1].min() for a, b in zip(lo, hi)], dtype=float)
+        self.hi = np.array([lut[a:b + 1].max() for a, b in zip(lo, hi)], dtype=float)
+        self.mean = None
+
+    def apply_affine(self, matrix, offset, clips):
+        """应用仿射变换，clips 为真时输出被裁剪，平均值无法再线性推算"""
+        if self.hist is not None:
+            total = self.hist[0].sum()
+            self.mean = (self.hist * _LEVELS).sum(axis=1) / max(total, 1)
+            self.hist = None
+        if self.mean is not None:
+            self.mean = None if clips else matrix @ self.mean + offset
+        low, high = _affine_range(matrix, offset, self.lo, self.hi)
+        self.lo, self.hi = np.clip(low, 0, 255), np.clip(high, 0, 255)
+
+    def clips(self, matrix, offset):
+        low, high = _affine_range(matrix, offset, self.lo, self.hi)
+        return bool((low < 0).any() or (high > 255).any())
+
+
+def _run_ops(target, ops, array):
+    for op in ops:
+        target = op.run_array(target) if array else op.run(target)
+    return target
+
+
+def compile_and_run(image, stages, means=None, array=False):
+    """编译并执行一串逐像素阶段，返回结果图
+
+    means 是对比度阶段下标到平均灰度的映射（分块引擎按整幅图统计后传入），
+    缺省的平均灰度沿管线推算。array 为真时在 uint8 数组上用OpenCV执行。
+    """
+    means = dict(means or {})
+    target = np.asarray(image) if array else image
+    with_stats = any(getattr(stage, "needs_mean", False) and idx not in means
+                     for idx, stage in enumerate(stages))
+    tracker = _Tracker(image, with_stats)
+    ops = []
+
+    for idx, stage in enumerate(stages):
+        mean = means.get(idx)
+        if getattr(stage, "needs_mean", False) and mean is None:
+            mean = tracker.luma_mean()
+            if mean is None:
+                # 无法推算时先执行已编译的部分，再精确统计
+                target = _run_ops(target, ops, array)
+                ops = []
+                tracker = _Tracker(Image.fromarray(target) if array else target, True)
+                mean = tracker.luma_mean()
+
+        matrix, offset = stage.affine(mean)
+        last = ops[-1] if ops else None
+        clips = tracker.clips(matrix, offset)
+        if isinstance(last, _MatrixOp) and not last.clips:
+            # 前面的矩阵输出不会被裁剪，可以直接折叠
+            last.extend(matrix, offset, clips)
+        elif getattr(stage, "diagonal", False):
+            # 单通道阶段：合并进查找表，逐位精确
+            lut = stage.lut(mean)
+            if isinstance(last, _LutOp):
+                last.extend(lut)
+            else:
+                ops.append(_LutOp(lut))
+            tracker.apply_lut(lut)
+            continue
+        else:
+            ops.append(_MatrixOp(matrix, offset, clips))
+        tracker.apply_affine(matrix, offset, clips)
+
+    target = _run_ops(target, ops, array)
+    return Image.fromarray(target) if array else target
+
+
+def apply_sequential(image, stages, means=None):
+    """逐阶段用PIL执行，结果与原有 ImageEnhance 链一致"""
+    means = means or {}
+    for idx, stage in enumerate(stages):
+        if getattr(stage, "needs_mean", False):
+            image = stage.apply(image, means.get(idx))
+        else:
+            image = stage.apply(image)
+    return image
+
+
+def max_difference(first, second):
+    """两幅图逐像素的最大绝对差"""
+    diff = np.abs(np.asarray(first, dtype=np.int16) - np.asarray(second, dtype=np.int16))
+    return int(diff.max()) if diff.size else 0
+
+
+def is_exact(stages):
+    """阶段链是否全部编译为查找表，融合结果与PIL链逐位一致"""
+    return all(getattr(stage, "diagonal", False) for stage in stages)
+
+
+def apply_point_stages(image, stages, means=None, backend="fused", verify_tolerance=None, before_kernel=False):
+    """执行一串逐像素阶段
+
+    backend: "fused" 编译为查找表/颜色矩阵后由PIL执行，"opencv" 编译后在 uint8 数组上
+    由OpenCV执行，"pil" 逐阶段执行原有PIL链。
+    means: 对比度阶段的平均灰度，缺省时融合模式沿管线推算、PIL模式按中间图精确统计。
+    verify_tolerance: 不为None时进入校验模式，同时运行PIL链并比较，
+    差异超出容差则记录错误并返回PIL结果。
+    before_kernel: 结果之后还要经过卷积滤镜（锐化、边缘增强）。卷积会放大颜色矩阵1~2级的
+    取整差异（super_clear 的最终结果相差可达百级），因此这时只有逐位精确的查找表链才融合，
+    其余按PIL链执行。
+    """
+    if not stages:
+        return image
+    if before_kernel and not is_exact(stages):
+        backend = "pil"
+    if image.mode != "RGB" or backend == "pil":
+        return apply_sequential(image, stages, means)
+
+    fused = compile_and_run(image, stages, means, array=backend == "opencv")
+
+    if verify_tolerance is not None:
+        reference = apply_sequential(image, stages, means)
+        difference = max_difference(fused, reference)
+        names = "+".join(stage.name for stage in stages)
+        if difference > verify_tolerance:
+            logger.error(f"融合结果超出容差: {names}, 最大差异 {difference} > {verify_tolerance}")
+            return reference
+        logger.info(f"融合结果校验通过: {names}, 最大差异 {difference}")
+    return fused
+
+
+def repeated_kernel(kernel, passes):
+    """连续 passes 次卷积等效的单个卷积核（对称核的卷积与相关相同）"""
+    result = kernel
+    for _ in range(passes - 1):
+        size = (result.shape[0] + kernel.shape[0] - 1, result.shape[1] + kernel.shape[1] - 1)
+        combined = np.zeros(size)
+        for (row, col), weight in np.ndenumerate(kernel):
+            combined[row:row + result.shape[0], col:col + result.shape[1]] += weight * result
+        result = combined
+    return result
+
+
+def filter_kernel(image_filter):
+    """PIL 3x3/5x5 卷积滤镜的浮点卷积核（已除以 scale，不含 offset）"""
+    size, scale, _, values = image_filter.filterargs
+    return np.array(values, dtype=np.float64).reshape(size[1], size[0]) / scale
+
+
+def apply_repeated_filter(image, image_filter, passes, backend="fused"):
+    """连续 passes 次应用卷积滤镜
+
+    "opencv" 后端合并为一个 (2*passes+1) 见方的卷积核，一次 cv2.filter2D 完成；
+    与逐次执行的差异来自每次的取整和裁剪，只在强边缘附近明显。
+    与PIL一样保留最外一圈像素不变。其他后端逐次调用 image.filter。
+    """
+    if passes <= 0:
+        return image
+    if backend != "opencv" or image.mode != "RGB":
+        for _ in range(passes):
+            image = image.filter(image_filter)
+        return image
+
+    import cv2
+    arr = np.asarray(image)
+    kernel = repeated_kernel(filter_kernel(image_filter), passes).astype(np.float32)
+    result = cv2.filter2D(arr, -1, kernel, borderType=cv2.BORDER_REPLICATE)
+    if arr.shape[0] > 2 and arr.shape[1] > 2:
+        result[[0, -1], :] = arr[[0, -1], :]
+        result[:, [0, -1]] = arr[:, [0, -1]]
+    return Image.fromarray(result)
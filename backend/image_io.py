@@ -0,0 +1,205 @@
+"""
+图片读取与预处理
+
+增强管线共用的前置步骤：打开图片、按EXIF修复方向、转换为RGB模式。
+
+所有入口都接受文件路径、字节（bytes/bytearray/memoryview）、文件对象或已解码的图像，
+上传内容直接在内存中解码，不再先写入临时文件：PIL 通过 BytesIO 读取，
+OpenCV 通过 cv2.imdecode 读取字节的零拷贝 memoryview。
+
+probe 只读取文件头得到尺寸、模式和EXIF方向，用于准入检查等不需要像素的场景；
+load_reduced 在目标尺寸小于原图时（海报缩略图、预览代理图）让 JPEG 在解码阶段
+按 1/2、1/4、1/8 缩小，不必解码全分辨率像素。
+"""
+
+import io
+import logging
+import time
+
+import numpy as np
+from PIL import Image
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# EXIF 方向标签
+ORIENTATION_TAG = 274
+
+# 修复方向后宽高互换的EXIF方向
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+# EXIF 方向 -> 转为正向的无损变换
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# 已修复方向的标记，只存在于服务端已解码的图片（包括预览会话和金字塔保存的图片）的 info 中，
+# 不写入输出文件。键是元组：文件中的文本块、注释解码后都是字符串键，客户端无法伪造
+ORIENTED_KEY = ("image-enhancer", "oriented")
+
+
+def is_oriented(image):
+    """图片是否已在服务端修复过方向"""
+    return bool(image.info.get(ORIENTED_KEY))
+
+
+def fix_image_orientation(image):
+    """按EXIF方向信息把图片转为正向，覆盖全部8种方向
+
+    使用无损的 transpose（只重排像素，不经过仿射重采样）。已修复过方向的图片直接返回，
+    结果在 info 中标记（只在服务端有效），并从随图片保留的EXIF中删除方向，
+    即使编码器写出EXIF，输出文件也不会被再次旋转。
+    """
+    if is_oriented(image):
+        return image
+    try:
+        orientation = read_orientation(image)
+        method = ORIENTATION_TRANSPOSE.get(orientation)
+        if method is not None:
+            exif = image.getexif()
+            image = image.transpose(method)
+            del exif[ORIENTATION_TAG]
+            image.info["exif"] = exif.tobytes()
+            logger.info(f"按EXIF方向 {orientation} 修复图片方向")
+    except Exception as e:
+        logger.error(f"修复图片方向时出错: {e}")
+    image.info[ORIENTED_KEY] = True
+    return image
+
+
+def is_bytes(source):
+    """source 是否为内存中的图片字节"""
+    return isinstance(source, (bytes, bytearray, memoryview))
+
+
+def describe_source(source):
+    """用于日志的图片来源描述，避免把图片内容写入日志"""
+    if is_bytes(source):
+        return f"<内存图片 {len(source)} 字节>"
+    if isinstance(source, np.ndarray):
+        return f"<图像数组 {source.shape}>"
+    if isinstance(source, Image.Image):
+        return f"<PIL图片 {source.width}x{source.height}>"
+    return str(getattr(source, "name", source))
+
+
+def open_image(source):
+    """以PIL图片打开 source，已是PIL图片时直接返回"""
+    if isinstance(source, Image.Image):
+        return source
+    if is_bytes(source):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+class ImageInfo:
+    """只读取文件头得到的图片信息"""
+
+    def __init__(self, width, height, mode, format, orientation=1):
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.format = format
+        self.orientation = orientation
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def oriented_size(self):
+        """修复方向后的 (宽, 高)"""
+        if self.orientation in TRANSPOSED_ORIENTATIONS:
+            return self.height, self.width
+        return self.width, self.height
+
+    @property
+    def pixels(self):
+        return self.width * self.height
+
+
+def read_orientation(img):
+    """从已打开图片的EXIF读取方向，没有方向信息或已修复过方向时返回1"""
+    if is_oriented(img):
+        return 1
+    if img.format == "PNG" and "exif" not in img.info:
+        # 位于图像数据之后的 eXIf 块要解码像素才能读到，未解码时按无方向处理
+        return 1
+    try:
+        orientation = img.getexif().get(ORIENTATION_TAG)
+    except Exception:
+        return 1
+    return orientation if orientation in ORIENTATION_TRANSPOSE else 1
+
+
+def probe(source):
+    """只读取文件头获取尺寸、模式、格式和EXIF方向，不解码像素"""
+    if isinstance(source, Image.Image):
+        return ImageInfo(source.width, source.height, source.mode, source.format, read_orientation(source))
+    with open_image(source) as img:
+        return ImageInfo(img.width, img.height, img.mode, img.format, read_orientation(img))
+
+
+def load_reduced(source, size, reducing_gap=2.0):
+    """解码不小于所需尺寸的缩小图片并修复方向
+
+    size 为修复方向后需要的 (宽, 高)。JPEG 通过 draft 在解码时按 1/2、1/4、1/8 缩小，
+    解码结果的宽高不小于 size 的 reducing_gap 倍，由调用方再精确缩放；其他格式完整解码。
+    """
+    img = open_image(source)
+    if img.format == "JPEG":
+        width, height = size
+        if read_orientation(img) in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+        img.draft("RGB", (int(width * reducing_gap), int(height * reducing_gap)))
+    img.load()
+    return fix_image_orientation(img)
+
+
+def decode_bgr(source):
+    """以OpenCV BGR数组读取 source，失败返回None
+
+    字节直接在内存中解码，已解码的数组原样返回。
+    """
+    # 延迟导入，只使用PIL的进程不需要加载OpenCV
+    import cv2
+
+    if isinstance(source, np.ndarray):
+        return source
+    if is_bytes(source):
+        buffer = np.frombuffer(memoryview(source), dtype=np.uint8)
+        return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if hasattr(source, "read"):
+        return cv2.imdecode(np.frombuffer(source.read(), dtype=np.uint8), cv2.IMREAD_COLOR)
+    return cv2.imread(source)
+
+
+def load_rgb(source, timings=None):
+    """打开图片、修复方向并转换为RGB模式
+
+    source 可以是文件路径、图片字节、文件对象或PIL图片。
+    timings 为字典时记录 "decode"（解码像素）和 "orient"（修复方向并转换模式）的耗时（秒）。
+    """
+    started = time.perf_counter()
+    img = open_image(source)
+    if timings is not None:
+        img.load()
+        timings["decode"] = time.perf_counter() - started
+        started = time.perf_counter()
+    
+    # 修复图片方向
+    img = fix_image_orientation(img)
+    
+    # 转换为RGB模式（处理RGBA等格式）
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+        logger.info("图片已转换为RGB模式")
+    if timings is not None:
+        timings["orient"] = time.perf_counter() - started
+    return img
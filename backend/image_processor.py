@@ -1,88 +1,113 @@
 import cv2
 import numpy as np
-import torch
-import torch.nn as nn
-import torch.nn.functional as F
-from torchvision import transforms
 import logging
+import threading
+from tiling import TiledEngine, ArrayStage
+from image_io import decode_bgr, describe_source
+import model_registry
+import metrics
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 非局部均值降噪的邻域半径：搜索窗口半径 + 模板窗口半径
+NLM_RADIUS = 21 // 2 + 7 // 2
+
+# 降噪块同时存在的工作副本数估计（LAB转换、边界扩展、权重累加缓冲区等）
+NLM_WORKING_COPIES = 12
+
+def _cv2_resizer(interpolation):
+    """生成分块引擎使用的OpenCV放大函数"""
+    def resize(crop, size):
+        return cv2.resize(crop, size, interpolation=interpolation)
+    return resize
+
 class AdvancedImageProcessor:
     """高级图像处理器"""
     
-    def __init__(self):
+    def __init__(self, tile_memory_budget=None, inference_tile=192, inference_batch=4,
+                 inference_wait=0.01, inference_threads=None, model_backend=None, model_weights=None):
         logger.info("初始化高级图像处理器...")
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        logger.info(f"使用设备: {self.device}")
-        self.model = self._load_model()
-        logger.info("高级图像处理器初始化完成")
+        self.engine = TiledEngine(tile_memory_budget)
+        # 推理后端：eager、torchscript 或 onnx，与 eager 输出不一致时自动回退；
+        # 为空时使用模型注册表的默认配置
+        self.model_backend = model_backend
+        self.model_weights = model_weights
+        # AI增强分块批量推理的参数，并发请求的块合并成批执行
+        self.inference_options = {
+            "tile_size": inference_tile,
+            "max_batch": inference_batch,
+            "max_wait": inference_wait,
+            "threads": inference_threads,
+        }
+        logger.info("高级图像处理器初始化完成（AI模型在首次使用时加载）")
     
     def _load_model(self):
-        """加载深度学习模型"""
-        logger.info("开始加载深度学习模型...")
-        model = SimpleSRNet().to(self.device)
-        model.eval()
-        logger.info("深度学习模型加载完成")
-        return model
+        """从进程共享的模型注册表获取深度学习模型，首次调用时加载"""
+        return model_registry.get_model(self.model_backend, self.model_weights, **self.inference_options)
+    
+    @property
+    def model(self):
+        return self._load_model().model
     
-    def enhance_traditional(self, image_path, scale_factor=2):
-        """传统图像增强方法"""
+    @property
+    def device(self):
+        return self._load_model().device
+    
+    @property
+    def inference(self):
+        return self._load_model().inference
+    
+    def enhance_traditional(self, source, scale_factor=2):
+        """传统图像增强方法
+
+        source 可以是文件路径、图片字节或已解码的BGR数组，结果为BGR数组。
+        """
         try:
-            logger.info(f"开始传统图像增强: {image_path}")
+            logger.info(f"开始传统图像增强: {describe_source(source)}")
             
             # 读取图像
             logger.info("读取图像...")
-            img = cv2.imread(image_path)
+            img = decode_bgr(source)
             if img is None:
                 logger.error("图像读取失败")
                 return None
             logger.info(f"图像读取成功，尺寸: {img.shape}")
             
-            # 1. 双三次插值放大
+            # 1-3. 分块执行：双三次插值放大 -> 降噪 -> 锐化
             height, width = img.shape[:2]
             logger.info(f"原始图像尺寸: {width}x{height}")
-            enhanced = cv2.resize(img, (width * scale_factor, height * scale_factor), 
-                                interpolation=cv2.INTER_CUBIC)
-            logger.info(f"图像已放大到: {width * scale_factor}x{height * scale_factor}")
-            
-            # 2. 降噪
-            logger.info("开始降噪处理...")
-            enhanced = cv2.fastNlMeansDenoisingColored(enhanced, None, 10, 10, 7, 21)
-            logger.info("降噪处理完成")
-            
-            # 3. 锐化
-            logger.info("开始锐化处理...")
             kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-            enhanced = cv2.filter2D(enhanced, -1, kernel)
-            logger.info("锐化处理完成")
+            timings = {}
+            enhanced = self.engine.run_array(img, scale_factor, [
+                ArrayStage("降噪", lambda tile: cv2.fastNlMeansDenoisingColored(tile, None, 10, 10, 7, 21),
+                           radius=NLM_RADIUS),
+                ArrayStage("锐化", lambda tile: cv2.filter2D(tile, -1, kernel), radius=1),
+            ], resize=_cv2_resizer(cv2.INTER_CUBIC), working_copies=NLM_WORKING_COPIES, timings=timings)
+            metrics.observe_timings(timings, "processor/traditional")
+            logger.info(f"图像已放大到: {width * scale_factor}x{height * scale_factor}，降噪和锐化完成")
             
             # 4. 对比度增强
             logger.info("开始对比度增强...")
-            lab = cv2.cvtColor(enhanced, cv2.COLOR_BGR2LAB)
-            l, a, b = cv2.split(lab)
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-            l = clahe.apply(l)
-            enhanced = cv2.merge([l, a, b])
-            enhanced = cv2.cvtColor(enhanced, cv2.COLOR_LAB2BGR)
+            with metrics.span("clahe", "processor/traditional"):
+                enhanced = self._apply_clahe(enhanced)
             logger.info("对比度增强完成")
             
-            logger.info(f"传统图像增强完成: {image_path}")
+            logger.info(f"传统图像增强完成: {describe_source(source)}")
             return enhanced
             
         except Exception as e:
             logger.error(f"传统增强失败: {e}")
             return None
     
-    def enhance_ai(self, image_path, scale_factor=2):
+    def enhance_ai(self, source, scale_factor=2):
         """AI深度学习增强方法"""
         try:
-            logger.info(f"开始AI深度学习增强: {image_path}")
+            logger.info(f"开始AI深度学习增强: {describe_source(source)}")
             
             # 读取图像
             logger.info("读取图像...")
-            img = cv2.imread(image_path)
+            img = decode_bgr(source)
             if img is None:
                 logger.error("图像读取失败")
                 return None
@@ -93,44 +118,38 @@ class AdvancedImageProcessor:
             img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
             logger.info("图像格式转换完成")
             
-            # 预处理
-            logger.info("开始图像预处理...")
-            img_tensor = transforms.ToTensor()(img_rgb).unsqueeze(0).to(self.device)
-            logger.info("图像预处理完成")
-            
-            # 模型推理
+            # 分块批量推理（预处理和后处理与 ToTensor/ToPILImage 相同）
             logger.info("开始AI模型推理...")
-            with torch.no_grad():
-                enhanced = self.model(img_tensor)
-            logger.info("AI模型推理完成")
-            
-            # 后处理
-            logger.info("开始后处理...")
-            enhanced = enhanced.squeeze(0).cpu()
-            enhanced = transforms.ToPILImage()(enhanced)
-            enhanced_np = np.array(enhanced)
-            logger.info("后处理完成")
+            with metrics.span("inference", "processor/ai"):
+                enhanced_np = self.inference.infer(img_rgb)
+            logger.info(f"AI模型推理完成: {self.inference.stats()}")
             
             # 转换为BGR格式
             logger.info("转换图像格式为BGR...")
             enhanced_bgr = cv2.cvtColor(enhanced_np, cv2.COLOR_RGB2BGR)
             logger.info("图像格式转换完成")
             
-            logger.info(f"AI深度学习增强完成: {image_path}")
+            logger.info(f"AI深度学习增强完成: {describe_source(source)}")
             return enhanced_bgr
             
         except Exception as e:
             logger.error(f"AI增强失败: {e}")
             return None
     
-    def enhance_advanced(self, image_path, scale_factor=2):
+    def enhance_advanced(self, source, scale_factor=2):
         """高级增强方法（结合传统和AI）"""
         try:
-            logger.info(f"开始高级增强: {image_path}")
+            logger.info(f"开始高级增强: {describe_source(source)}")
+            
+            # 只解码一次，传统增强和AI增强共用解码结果
+            img = decode_bgr(source)
+            if img is None:
+                logger.error("图像读取失败")
+                return None
             
             # 先进行传统增强
             logger.info("开始传统增强步骤...")
-            traditional = self.enhance_traditional(image_path, scale_factor)
+            traditional = self.enhance_traditional(img, scale_factor)
             if traditional is None:
                 logger.error("传统增强失败")
                 return None
@@ -138,7 +157,7 @@ class AdvancedImageProcessor:
             
             # 再进行AI增强
             logger.info("开始AI增强步骤...")
-            ai_enhanced = self.enhance_ai(image_path, scale_factor)
+            ai_enhanced = self.enhance_ai(img, scale_factor)
             if ai_enhanced is None:
                 logger.warning("AI增强失败，使用传统增强结果")
                 return traditional
@@ -150,116 +169,91 @@ class AdvancedImageProcessor:
             enhanced = cv2.addWeighted(ai_enhanced, alpha, traditional, 1-alpha, 0)
             logger.info("结果混合完成")
             
-            logger.info(f"高级增强完成: {image_path}")
+            logger.info(f"高级增强完成: {describe_source(source)}")
             return enhanced
             
         except Exception as e:
             logger.error(f"高级增强失败: {e}")
             return None
     
-    def enhance_quality(self, image_path, scale_factor=2):
+    def enhance_quality(self, source, scale_factor=2):
         """质量优先的增强方法"""
         try:
-            logger.info(f"开始质量优先增强: {image_path}")
+            logger.info(f"开始质量优先增强: {describe_source(source)}")
             
             # 读取图像
             logger.info("读取图像...")
-            img = cv2.imread(image_path)
+            img = decode_bgr(source)
             if img is None:
                 logger.error("图像读取失败")
                 return None
             logger.info(f"图像读取成功，尺寸: {img.shape}")
             
-            # 1. 高质量放大
+            # 分块执行全部步骤：高质量放大 -> 多步骤降噪 -> 边缘保持滤波 -> 自适应锐化 -> 色彩增强
             height, width = img.shape[:2]
             logger.info(f"原始图像尺寸: {width}x{height}")
-            enhanced = cv2.resize(img, (width * scale_factor, height * scale_factor), 
-                                interpolation=cv2.INTER_LANCZOS4)
-            logger.info(f"图像已高质量放大到: {width * scale_factor}x{height * scale_factor}")
+            timings = {}
+            enhanced = self.engine.run_array(img, scale_factor, [
+                ArrayStage("多步骤降噪", lambda tile: cv2.fastNlMeansDenoisingColored(tile, None, 15, 15, 7, 21),
+                           radius=NLM_RADIUS),
+                ArrayStage("边缘保持滤波", lambda tile: cv2.bilateralFilter(tile, 9, 75, 75), radius=9 // 2),
+                ArrayStage("自适应锐化", self._adaptive_sharpen, radius=1),
+                ArrayStage("色彩增强", lambda tile: cv2.convertScaleAbs(tile, alpha=1.1, beta=10)),
+            ], resize=_cv2_resizer(cv2.INTER_LANCZOS4), working_copies=NLM_WORKING_COPIES, timings=timings)
+            metrics.observe_timings(timings, "processor/quality")
+            logger.info(f"图像已高质量放大到: {width * scale_factor}x{height * scale_factor}，降噪、滤波、锐化和色彩增强完成")
             
-            # 2. 多步骤降噪
-            logger.info("开始多步骤降噪...")
-            enhanced = cv2.fastNlMeansDenoisingColored(enhanced, None, 15, 15, 7, 21)
-            logger.info("多步骤降噪完成")
-            
-            # 3. 边缘保持滤波
-            logger.info("开始边缘保持滤波...")
-            enhanced = cv2.bilateralFilter(enhanced, 9, 75, 75)
-            logger.info("边缘保持滤波完成")
-            
-            # 4. 自适应锐化
-            logger.info("开始自适应锐化...")
-            gray = cv2.cvtColor(enhanced, cv2.COLOR_BGR2GRAY)
-            laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-            laplacian = np.uint8(np.absolute(laplacian))
-            enhanced = cv2.addWeighted(enhanced, 1.5, cv2.cvtColor(laplacian, cv2.COLOR_GRAY2BGR), -0.5, 0)
-            logger.info("自适应锐化完成")
-            
-            # 5. 色彩增强
-            logger.info("开始色彩增强...")
-            enhanced = cv2.convertScaleAbs(enhanced, alpha=1.1, beta=10)
-            logger.info("色彩增强完成")
-            
-            logger.info(f"质量优先增强完成: {image_path}")
+            logger.info(f"质量优先增强完成: {describe_source(source)}")
             return enhanced
             
         except Exception as e:
             logger.error(f"质量增强失败: {e}")
             return None
-
-
-class SimpleSRNet(nn.Module):
-    """简单的超分辨率网络"""
     
-    def __init__(self, scale_factor=2):
-        super(SimpleSRNet, self).__init__()
-        logger.info("初始化简单超分辨率网络...")
-        self.scale_factor = scale_factor
-        
-        # 特征提取层
-        self.conv1 = nn.Conv2d(3, 64, kernel_size=3, padding=1)
-        self.conv2 = nn.Conv2d(64, 64, kernel_size=3, padding=1)
-        self.conv3 = nn.Conv2d(64, 64, kernel_size=3, padding=1)
-        
-        # 上采样层
-        self.upsample = nn.ConvTranspose2d(64, 64, kernel_size=4, stride=2, padding=1)
-        
-        # 重建层
-        self.conv4 = nn.Conv2d(64, 3, kernel_size=3, padding=1)
-        
-        # 初始化权重
-        self._initialize_weights()
-        logger.info("简单超分辨率网络初始化完成")
+    @staticmethod
+    def _adaptive_sharpen(img):
+        """基于拉普拉斯边缘的自适应锐化"""
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        laplacian = cv2.Laplacian(gray, cv2.CV_64F)
+        laplacian = np.uint8(np.absolute(laplacian))
+        return cv2.addWeighted(img, 1.5, cv2.cvtColor(laplacian, cv2.COLOR_GRAY2BGR), -0.5, 0)
     
-    def _initialize_weights(self):
-        """初始化网络权重"""
-        logger.info("初始化网络权重...")
-        for m in self.modules():
-            if isinstance(m, nn.Conv2d):
-                nn.init.kaiming_normal_(m.weight, mode='fan_out', nonlinearity='relu')
-                if m.bias is not None:
-                    nn.init.constant_(m.bias, 0)
-            elif isinstance(m, nn.ConvTranspose2d):
-                nn.init.kaiming_normal_(m.weight, mode='fan_out', nonlinearity='relu')
-                if m.bias is not None:
-                    nn.init.constant_(m.bias, 0)
-        logger.info("网络权重初始化完成")
-    
-    def forward(self, x):
-        # 特征提取
-        x = F.relu(self.conv1(x))
-        x = F.relu(self.conv2(x))
-        x = F.relu(self.conv3(x))
+    def _apply_clahe(self, img):
+        """对LAB亮度通道做CLAHE，按条带转换颜色空间，避免整幅LAB副本"""
+        height, width = img.shape[:2]
+        rows = self.engine.strip_rows(width, working_copies=3)
         
-        # 上采样
-        x = self.upsample(x)
+        # CLAHE 依赖整幅亮度通道的分块直方图，只保留单通道的整幅副本
+        l_channel = np.empty((height, width), dtype=np.uint8)
+        for y in range(0, height, rows):
+            l_channel[y:y + rows] = cv2.cvtColor(img[y:y + rows], cv2.COLOR_BGR2LAB)[:, :, 0]
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
+        l_channel = clahe.apply(l_channel)
         
-        # 重建
-        x = self.conv4(x)
-        return x
+        for y in range(0, height, rows):
+            lab = cv2.cvtColor(img[y:y + rows], cv2.COLOR_BGR2LAB)
+            lab[:, :, 0] = l_channel[y:y + rows]
+            img[y:y + rows] = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+        return img
+
+
+_processor = None
+_processor_lock = threading.Lock()
 
 
 def create_processor():
-    """创建图像处理器实例"""
-    logger.info("创建图像处理器实例...")
-    return AdvancedImageProcessor() 
\ No newline at end of file
+    """获取进程共享的图像处理器实例，首次调用时创建"""
+    global _processor
+    with _processor_lock:
+        if _processor is None:
+            logger.info("创建图像处理器实例...")
+            _processor = AdvancedImageProcessor()
+        return _processor
+
+
+def __getattr__(name):
+    # 兼容 from image_processor import SimpleSRNet，按需导入 torch
+    if name == "SimpleSRNet":
+        from sr_model import SimpleSRNet
+        return SimpleSRNet
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}") 
\ No newline at end of file
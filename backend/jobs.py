@@ -0,0 +1,359 @@
+"""
+异步任务队列
+
+提交增强任务后立即返回任务ID，客户端轮询任务状态并单独获取结果，
+避免大图处理期间长时间占用HTTP连接。任务按优先级通道（lane）分别排队，
+快速方法不会被慢速方法阻塞。任务元数据和结果保存在可插拔的本地存储中
+（内存或SQLite），无需外部服务。
+
+多个工作进程共享同一个SQLite文件时，每个任务记录所属进程（owner，进程ID）。
+工作进程启动时只把自己、已退出进程和旧版本遗留的未结束任务标记为失败，
+不会影响其他仍在运行的工作进程；服务启动时由主进程统一清理上次运行遗留的任务。
+存储的读写都在线程中执行，不阻塞事件循环。
+"""
+
+import asyncio
+import json as json_lib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from log_pipeline import request_context
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+def process_alive(pid):
+    """进程是否仍在运行"""
+    if os.name == "nt":
+        # Windows 上 os.kill 会终止进程，无法安全探测，遗留任务由主进程启动时清理
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class MemoryJobStore:
+    """内存任务存储，进程重启后任务丢失"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._results = {}
+
+    def create(self, job):
+        self._jobs[job["id"]] = dict(job)
+
+    def update(self, job_id, **fields):
+        if job_id in self._jobs:
+            self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    def save_results(self, job_id, items):
+        self._results[job_id] = list(items)
+
+    def get_results(self, job_id):
+        return self._results.get(job_id)
+
+    def purge(self, before):
+        """删除 before 时间戳之前结束的任务，返回删除数量"""
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] and job["finished_at"] < before]
+        for job_id in expired:
+            self._jobs.pop(job_id, None)
+            self._results.pop(job_id, None)
+        return len(expired)
+
+    def unfinished_owners(self):
+        return {job.get("owner") for job in self._jobs.values() if job["status"] in (QUEUED, RUNNING)}
+
+    def fail_unfinished(self, error, owners=None):
+        """把未结束的任务标记为失败，owners 不为None时只处理这些进程的任务"""
+        for job in self._jobs.values():
+            if job["status"] in (QUEUED, RUNNING) and (owners is None or job.get("owner") in owners):
+                job.update(status=FAILED, error=error, finished_at=time.time())
+
+    def close(self):
+        pass
+
+
+class SQLiteJobStore:
+    """SQLite任务存储，任务状态和结果写入本地数据库文件"""
+
+    _FIELDS = ("id", "method", "lane", "status", "progress", "total", "completed",
+               "error", "created_at", "started_at", "finished_at", "owner")
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    method TEXT,
+                    lane TEXT,
+                    status TEXT,
+                    progress REAL,
+                    total INTEGER,
+                    completed INTEGER,
+                    error TEXT,
+                    created_at REAL,
+                    started_at REAL,
+                    finished_at REAL,
+                    owner INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS job_results (
+                    job_id TEXT,
+                    idx INTEGER,
+                    data BLOB,
+                    error TEXT,
+                    encoding TEXT,
+                    PRIMARY KEY (job_id, idx)
+                );
+            """)
+            # 旧版本创建的数据库缺少的列
+            self._add_column("jobs", "owner", "INTEGER")
+            self._add_column("job_results", "encoding", "TEXT")
+            self._conn.commit()
+
+    def _add_column(self, table, column, kind):
+        columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+
+    def create(self, job):
+        values = [job.get(field) for field in self._FIELDS]
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO jobs ({', '.join(self._FIELDS)}) "
+                f"VALUES ({', '.join('?' * len(self._FIELDS))})", values)
+            self._conn.commit()
+
+    def update(self, job_id, **fields):
+        if not fields:
+            return
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?",
+                               [*fields.values(), job_id])
+            self._conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self._FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(zip(self._FIELDS, row)) if row else None
+
+    def save_results(self, job_id, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO job_results (job_id, idx, data, error, encoding) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, idx, item["data"], item["error"],
+                  json_lib.dumps(item["encoding"]) if item.get("encoding") is not None else None)
+                 for idx, item in enumerate(items)])
+            self._conn.commit()
+
+    def get_results(self, job_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data, error, encoding FROM job_results WHERE job_id = ? ORDER BY idx",
+                (job_id,)).fetchall()
+        if not rows:
+            return None
+        return [{"data": data, "error": error, "encoding": json_lib.loads(encoding) if encoding else None}
+                for data, error, encoding in rows]
+
+    def purge(self, before):
+        with self._lock:
+            expired = [row[0] for row in self._conn.execute(
+                "SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (before,))]
+            self._conn.executemany("DELETE FROM job_results WHERE job_id = ?", [(i,) for i in expired])
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in expired])
+            self._conn.commit()
+        return len(expired)
+
+    def unfinished_owners(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT owner FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+        return {row[0] for row in rows}
+
+    def fail_unfinished(self, error, owners=None):
+        """把未结束的任务标记为失败，owners 不为None时只处理这些进程（None 表示旧版本遗留）的任务"""
+        query = "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?)"
+        params = [FAILED, error, time.time(), QUEUED, RUNNING]
+        if owners is not None:
+            pids = [owner for owner in owners if owner is not None]
+            conditions = [f"owner IN ({', '.join('?' * len(pids))})"] if pids else []
+            if None in owners:
+                conditions.append("owner IS NULL")
+            if not conditions:
+                return
+            query += f" AND ({' OR '.join(conditions)})"
+            params += pids
+        with self._lock:
+            self._conn.execute(query, params)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def fail_unfinished_jobs(backend="memory", path="jobs.sqlite3"):
+    """服务启动时（工作进程启动前）把上次运行遗留的未结束任务标记为失败"""
+    if backend != "sqlite":
+        return
+    store = SQLiteJobStore(path)
+    try:
+        store.fail_unfinished("服务重启，任务已中断")
+    finally:
+        store.close()
+
+
+def create_job_store(backend="memory", path="jobs.sqlite3"):
+    """按配置创建任务存储"""
+    if backend == "sqlite":
+        logger.info(f"使用SQLite任务存储: {path}")
+        return SQLiteJobStore(path)
+    logger.info("使用内存任务存储")
+    return MemoryJobStore()
+
+
+class JobManager:
+    """任务管理器
+
+    lanes: 通道名到并发数的映射，例如 {"fast": 2, "slow": 1}。
+    每个通道有独立的等待队列和工作协程，慢速任务最多占用其通道的并发数。
+    ttl: 已结束任务的保留时间（秒），超时后状态和结果被清理。
+    """
+
+    def __init__(self, store, lanes, ttl=3600):
+        self.store = store
+        self.lanes = dict(lanes)
+        self.ttl = ttl
+        # 本进程提交的任务记录的所属进程
+        self.owner = os.getpid()
+        self._queues = {}
+        self._workers = []
+
+    async def _call(self, func, *args, **kwargs):
+        """在线程中执行存储操作"""
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def start(self):
+        """为每个通道启动工作协程"""
+        # 已退出的工作进程遗留的任务无法恢复（输入只保存在内存中），其他工作进程的任务不受影响
+        owners = await self._call(self.store.unfinished_owners)
+        stale = {owner for owner in owners
+                 if owner is None or owner == self.owner or not process_alive(owner)}
+        if stale:
+            await self._call(self.store.fail_unfinished, "工作进程已退出，任务已中断", stale)
+        for lane, concurrency in self.lanes.items():
+            queue = asyncio.Queue()
+            self._queues[lane] = queue
+            for _ in range(max(1, concurrency)):
+                self._workers.append(asyncio.create_task(self._worker(lane, queue)))
+        logger.info(f"任务队列已启动: {self.lanes}")
+
+    async def stop(self):
+        """停止所有工作协程"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queues = {}
+        logger.info("任务队列已停止")
+
+    def queue_depths(self):
+        """各通道排队中的任务数"""
+        return {lane: queue.qsize() for lane, queue in self._queues.items()}
+
+    async def submit(self, method, lane, runner, total=1):
+        """提交任务并立即返回任务ID
+
+        runner 是协程函数 runner(report)，await report(completed) 用于上报已完成的条目数，
+        返回值为条目列表，每个条目是 {"data": bytes或None, "error": str或None, "encoding": 编码统计}。
+        """
+        if lane not in self._queues:
+            raise ValueError(f"未知的任务通道: {lane}")
+        await self._call(self.store.purge, time.time() - self.ttl)
+
+        job_id = uuid.uuid4().hex
+        await self._call(self.store.create, {
+            "id": job_id,
+            "method": method,
+            "lane": lane,
+            "status": QUEUED,
+            "progress": 0.0,
+            "total": total,
+            "completed": 0,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "owner": self.owner,
+        })
+        self._queues[lane].put_nowait((job_id, runner, total))
+        logger.info(f"任务已提交: {job_id}, 方法={method}, 通道={lane}")
+        return job_id
+
+    async def get(self, job_id):
+        """获取任务状态"""
+        return await self._call(self.store.get, job_id)
+
+    async def get_results(self, job_id):
+        """获取任务结果条目"""
+        return await self._call(self.store.get_results, job_id)
+
+    async def _worker(self, lane, queue):
+        while True:
+            job_id, runner, total = await queue.get()
+            try:
+                # 任务执行期间的日志归入任务ID
+                with request_context(job_id):
+                    await self._run(job_id, runner, total)
+            finally:
+                queue.task_done()
+
+    async def _run(self, job_id, runner, total):
+        logger.info(f"任务开始执行: {job_id}")
+        await self._call(self.store.update, job_id, status=RUNNING, started_at=time.time())
+
+        async def report(completed):
+            await self._call(self.store.update, job_id, completed=completed, progress=completed / max(total, 1))
+
+        try:
+            items = await runner(report)
+            await self._call(self.store.save_results, job_id, items)
+            failed = all(item["data"] is None for item in items)
+            await self._call(
+                self.store.update,
+                job_id,
+                status=FAILED if failed else DONE,
+                error=items[0]["error"] if failed and items else None,
+                completed=len(items),
+                progress=1.0,
+                finished_at=time.time(),
+            )
+            logger.info(f"任务执行结束: {job_id}, 状态={FAILED if failed else DONE}")
+        except Exception as e:
+            logger.error(f"任务执行失败: {job_id}, {e}")
+            await self._call(self.store.update, job_id, status=FAILED, error=str(e), finished_at=time.time())
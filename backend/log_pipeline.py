@@ -0,0 +1,173 @@
+"""
+异步日志管线
+
+每次增强会产生十几到几十条 INFO 日志，原先由 FileHandler 在事件循环线程和执行池
+线程中同步写文件，日志I/O直接计入请求延迟。这里把根日志器的处理器换成
+QueueHandler：调用方只把记录放入内存队列，由后台的 QueueListener 线程格式化并写入
+控制台和文件。进程池的工作进程通过 multiprocessing 队列把记录交给主进程写入，
+同一进程内只有监听线程一个写者。多个 Sanic 工作进程各自有监听线程，以追加模式
+写同一个文件，每条记录一次写入，不共享文件锁。
+
+每条记录带有请求ID（客户端的 X-Request-ID 或自动生成），执行池任务和异步任务
+沿用提交它的请求ID（异步任务使用任务ID），便于把一次请求的日志串起来。
+
+采样策略：
+- 警告及以上级别始终记录；
+- 请求内的 INFO/DEBUG 记录按请求ID采样，sample_rate 为保留详细日志的请求比例，
+  同一请求的详细日志要么全部保留、要么全部丢弃；
+- 没有请求ID的记录（启动、关闭等）不采样；
+- 图像处理模块（STAGE_LOGGERS）的逐阶段日志可以单独提高级别，
+  在创建记录之前就被过滤，开销最低。
+"""
+
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import zlib
+from contextlib import contextmanager
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+# 产生逐阶段日志的图像处理模块，app.edits 为服务中滤镜和调整的逐阶段日志
+STAGE_LOGGERS = ("image_processor", "image_io", "tiling", "fused", "pipeline", "inference", "cache", "app.edits")
+
+# 没有请求上下文时的请求ID
+NO_REQUEST = "-"
+
+_request_id = contextvars.ContextVar("request_id", default=NO_REQUEST)
+
+
+def current_request_id():
+    """当前上下文的请求ID"""
+    return _request_id.get()
+
+
+@contextmanager
+def request_context(request_id):
+    """在 with 块内把当前上下文的日志归入 request_id"""
+    token = _request_id.set(request_id or NO_REQUEST)
+    try:
+        yield
+    finally:
+        _request_id.reset(token)
+
+
+def set_request_id(request_id):
+    """设置当前上下文的请求ID，用于请求中间件（请求结束后上下文随之丢弃）"""
+    _request_id.set(request_id or NO_REQUEST)
+
+
+def run_with_request_id(request_id, func, *args):
+    """在执行池中以提交方的请求ID运行 func"""
+    with request_context(request_id):
+        return func(*args)
+
+
+class RequestContextFilter(logging.Filter):
+    """给记录附加请求ID，并按请求ID对详细日志采样"""
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def sampled(self, request_id):
+        """同一请求ID的结果固定，保证一次请求的详细日志完整"""
+        if self.sample_rate >= 1.0 or request_id == NO_REQUEST:
+            return True
+        if self.sample_rate <= 0.0:
+            return False
+        return zlib.crc32(request_id.encode("utf-8")) % 10000 < self.sample_rate * 10000
+
+    def filter(self, record):
+        request_id = getattr(record, "request_id", None) or _request_id.get()
+        record.request_id = request_id
+        return record.levelno >= logging.WARNING or self.sampled(request_id)
+
+
+class _LocalQueueHandler(logging.handlers.QueueHandler):
+    """进程内队列：记录原样入队，消息格式化在监听线程中进行
+
+    本项目的日志消息都是预先格式化好的字符串，不需要复制记录来冻结参数。
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class LogPipeline:
+    """根日志器的队列处理器和后台监听线程"""
+
+    def __init__(self, handlers, level=logging.INFO, sample_rate=1.0):
+        self.handlers = list(handlers)
+        self.level = level
+        self.context_filter = RequestContextFilter(sample_rate)
+        self._queue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(self._queue, *self.handlers,
+                                                        respect_handler_level=True)
+        self._worker_queue = None
+        self._worker_listener = None
+        self._listeners = []
+
+    def start(self):
+        """替换根日志器的处理器并启动监听线程"""
+        handler = _LocalQueueHandler(self._queue)
+        handler.addFilter(self.context_filter)
+        root = logging.getLogger()
+        for old in root.handlers[:]:
+            root.removeHandler(old)
+        root.addHandler(handler)
+        root.setLevel(self.level)
+        self._listener.start()
+        self._listeners.append(self._listener)
+        atexit.register(self.stop)
+
+    def stop(self):
+        """写完队列中剩余的记录并停止监听线程"""
+        while self._listeners:
+            self._listeners.pop().stop()
+
+    def configure(self, sample_rate=None, stage_level=None):
+        """调整采样比例和图像处理模块的日志级别"""
+        if sample_rate is not None:
+            self.context_filter.sample_rate = float(sample_rate)
+        if stage_level is not None:
+            for name in STAGE_LOGGERS:
+                logging.getLogger(name).setLevel(stage_level)
+
+    def worker_initializer(self):
+        """返回进程池的 (initializer, initargs)，工作进程的日志经队列交给本进程写入"""
+        if self._worker_queue is None:
+            self._worker_queue = multiprocessing.Queue()
+            self._worker_listener = logging.handlers.QueueListener(self._worker_queue, *self.handlers,
+                                                                   respect_handler_level=True)
+            self._worker_listener.start()
+            self._listeners.append(self._worker_listener)
+        stage_level = logging.getLogger(STAGE_LOGGERS[0]).level
+        return configure_worker, (self._worker_queue, self.level, self.context_filter.sample_rate, stage_level)
+
+
+def configure_worker(log_queue, level, sample_rate, stage_level):
+    """进程池工作进程的初始化函数：日志记录放入主进程监听的队列"""
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter(sample_rate))
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name in STAGE_LOGGERS:
+        logging.getLogger(name).setLevel(stage_level)
+
+
+def setup_logging(filename, level=logging.INFO, sample_rate=1.0):
+    """配置写入控制台和 filename 的异步日志管线并启动"""
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(), logging.FileHandler(filename, encoding='utf-8')]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    pipeline = LogPipeline(handlers, level, sample_rate)
+    pipeline.start()
+    return pipeline
@@ -0,0 +1,214 @@
+"""
+运行指标
+
+进程内累计计数器、仪表和直方图，由 /metrics 接口以 Prometheus 文本格式输出，
+包括各处理阶段（解码、方向修复、放大、各滤镜、编码、base64）的耗时分布、
+请求耗时、进行中的请求数、请求/响应字节数以及执行池和任务队列深度。
+
+记录一次观测只需要一次加锁和一次二分查找，不写日志、不做I/O，可以在生产环境中常开。
+
+阶段耗时按 operation（如 enhance/traditional、filter、adjust）和 stage 两个标签分组。
+执行池中运行的任务通过 collect 收集样本并随结果返回，由主进程写入直方图，
+进程池和线程池模式下的统计方式一致。
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# 耗时直方图的桶上界（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+        return tuple(str(value) for value in labelvalues)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type_name = "counter"
+
+    def inc(self, *labelvalues, amount=1):
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """可增可减、也可直接设置的仪表"""
+
+    type_name = "gauge"
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value, *labelvalues):
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """按桶累计观测值的直方图"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        key = self._key(labelvalues)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def render():
+    """所有指标的 Prometheus 文本格式"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram("image_stage_seconds", "图片处理各阶段耗时（秒）", ("operation", "stage"))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "请求处理耗时（秒）", ("route", "method"))
+REQUESTS = Counter("http_requests_total", "请求数", ("route", "method", "status"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "正在处理的请求数")
+REQUEST_BYTES = Counter("http_request_bytes_total", "请求体字节数", ("route",))
+RESPONSE_BYTES = Counter("http_response_bytes_total", "响应体字节数", ("route",))
+EXECUTOR_PENDING = Gauge("executor_pending_tasks", "执行池中执行和排队的任务数")
+JOB_QUEUE_DEPTH = Gauge("job_queue_depth", "异步任务队列中等待的任务数", ("lane",))
+
+# 当前线程的处理类型和样本收集列表
+_local = threading.local()
+
+
+@contextmanager
+def operation(name):
+    """在 with 块内把当前线程记录的阶段耗时归入 name"""
+    previous = getattr(_local, "operation", None)
+    _local.operation = name
+    try:
+        yield
+    finally:
+        _local.operation = previous
+
+
+def observe_stage(stage, seconds, operation=None):
+    """记录一个阶段的耗时，operation 为空时使用当前线程的处理类型"""
+    operation = operation or getattr(_local, "operation", None) or "other"
+    samples = getattr(_local, "samples", None)
+    if samples is not None:
+        samples.append((operation, stage, seconds))
+    else:
+        STAGE_SECONDS.observe(seconds, operation, stage)
+
+
+def observe_timings(timings, operation=None):
+    """记录管线返回的 {阶段: 秒} 耗时字典"""
+    for stage, seconds in timings.items():
+        observe_stage(stage, seconds, operation)
+
+
+@contextmanager
+def span(stage, operation=None):
+    """记录 with 块的耗时"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, operation)
+
+
+def collect(func, *args):
+    """运行 func 并收集期间记录的阶段耗时，返回 (结果, 样本)
+
+    在执行池中调用，样本由 record_samples 写入主进程的直方图。
+    """
+    _local.samples = []
+    try:
+        result = func(*args)
+    finally:
+        samples, _local.samples = _local.samples, None
+    return result, samples
+
+
+def record_samples(samples):
+    for operation_name, stage, seconds in samples:
+        STAGE_SECONDS.observe(seconds, operation_name, stage)
+
+
+def route_label(request):
+    """请求对应的路由模板，未匹配的请求归为一类，避免标签数量无限增长"""
+    route = getattr(request, "route", None)
+    return "/" + route.path if route is not None else "unmatched"
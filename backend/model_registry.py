@@ -0,0 +1,176 @@
+"""
+进程级模型注册表
+
+AI增强用到的 torch、SimpleSRNet、推理运行时和分块推理引擎都在首次请求时才加载，
+同一进程内所有处理器共享一份；也可以在 Sanic before_server_start 阶段预热。
+
+没有配置权重文件时（默认），模型以固定的随机种子初始化，各进程得到相同的权重，但各自持有一份。
+配置了权重文件时，各进程以 mmap 方式加载同一份 state dict，权重页由操作系统共享；
+文件不存在时先保存当前初始化的权重。保存的卷积权重使用 channels_last 布局，
+eager 后端转换内存布局时不再复制，mmap 的页保持共享；旧版本保存的连续布局文件在加载时
+记录警告，删除后重新生成即可。
+进程池以 fork 方式创建子进程时，预热后的模型以写时复制方式共享。
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_models = {}
+
+# 未指定时使用的推理后端和权重文件，由 configure 设置
+_defaults = {"backend": "eager", "weights_path": None}
+
+# 没有权重文件时初始化模型使用的随机种子
+INIT_SEED = 0
+
+
+class LoadedModel:
+    """已加载的模型及其推理运行时、分块推理引擎"""
+
+    def __init__(self, backend, model, runtime, inference, device, load_seconds):
+        self.backend = backend
+        self.model = model
+        self.runtime = runtime
+        self.inference = inference
+        self.device = device
+        self.load_seconds = load_seconds
+
+
+def process_rss():
+    """当前进程的常驻内存（字节）"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # 非Linux系统使用峰值常驻内存
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+def _create_model():
+    """以固定种子初始化模型，不影响全局随机数状态"""
+    import torch
+    from sr_model import SimpleSRNet
+
+    with torch.random.fork_rng(devices=[]):
+        torch.manual_seed(INIT_SEED)
+        return SimpleSRNet()
+
+
+def _save_weights(model, path):
+    """保存 state dict，卷积权重转换为 channels_last 布局"""
+    import torch
+
+    state = {name: tensor.contiguous(memory_format=torch.channels_last) if tensor.dim() == 4 else tensor
+             for name, tensor in model.state_dict().items()}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp = f"{path}.{os.getpid()}.tmp"
+    torch.save(state, temp)
+    os.replace(temp, path)
+    logger.info(f"已保存模型初始权重: {path}")
+
+
+def _load_weights(model, path):
+    """从权重文件加载 state dict，文件不存在时保存当前权重供其他工作进程共享"""
+    import torch
+
+    if not os.path.exists(path):
+        _save_weights(model, path)
+    try:
+        state = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+        model.load_state_dict(state, assign=True)
+        logger.info(f"已以mmap方式加载模型权重: {path}")
+        if any(tensor.dim() == 4 and not tensor.is_contiguous(memory_format=torch.channels_last)
+               for tensor in state.values()):
+            logger.warning(f"权重文件不是 channels_last 布局，eager 后端会在每个进程中复制权重: {path}")
+    except TypeError:
+        # 旧版本 torch 不支持 mmap/assign 参数
+        model.load_state_dict(torch.load(path, map_location="cpu"))
+        logger.info(f"已加载模型权重: {path}")
+
+
+def configure(backend=None, weights_path=None):
+    """设置默认的推理后端和权重文件，已加载的模型不受影响"""
+    if backend:
+        _defaults["backend"] = backend
+    if weights_path:
+        _defaults["weights_path"] = weights_path
+
+
+def get_model(backend=None, weights_path=None, **inference_options):
+    """获取进程共享的模型，首次调用时加载
+
+    backend、weights_path 为空时使用 configure 设置的默认值；
+    inference_options 传给分块推理引擎（tile_size、max_batch、max_wait、threads），
+    只在首次加载时生效。
+    """
+    backend = backend or _defaults["backend"]
+    weights_path = weights_path or _defaults["weights_path"]
+    key = (backend, weights_path)
+    entry = _models.get(key)
+    if entry is not None:
+        return entry
+
+    with _lock:
+        entry = _models.get(key)
+        if entry is not None:
+            return entry
+
+        started = time.perf_counter()
+        rss_before = process_rss()
+        logger.info(f"开始加载AI模型: 后端={backend}")
+        import torch
+        from model_runtime import build_runtime
+        from inference import TileInferenceEngine
+
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        model = _create_model()
+        if weights_path:
+            _load_weights(model, weights_path)
+        model = model.to(device)
+        model.eval()
+        runtime = build_runtime(model, backend)
+        inference = TileInferenceEngine(runtime, device, scale_factor=model.scale_factor, **inference_options)
+
+        load_seconds = time.perf_counter() - started
+        entry = LoadedModel(backend, model, runtime, inference, device, load_seconds)
+        _models[key] = entry
+        logger.info(f"AI模型加载完成: 后端={runtime.backend}, 设备={device}, 耗时 {load_seconds:.2f}s, "
+                    f"常驻内存增加 {(process_rss() - rss_before) / 1024 / 1024:.1f}MB")
+        return entry
+
+
+def warm_up(backend=None, weights_path=None, **inference_options):
+    """预加载模型并执行一次小图推理，分配好推理所需的内存"""
+    import numpy as np
+
+    entry = get_model(backend, weights_path, **inference_options)
+    started = time.perf_counter()
+    entry.inference.infer(np.zeros((32, 32, 3), dtype=np.uint8))
+    logger.info(f"AI模型预热完成: 耗时 {time.perf_counter() - started:.2f}s")
+    return entry
+
+
+def stats():
+    """注册表状态，供健康检查使用"""
+    return {
+        "torch_loaded": "torch" in sys.modules,
+        "models": [
+            {
+                "backend": entry.runtime.backend,
+                "device": str(entry.device),
+                "load_seconds": round(entry.load_seconds, 3),
+                "inference": entry.inference.stats(),
+            }
+            for entry in _models.values()
+        ],
+    }
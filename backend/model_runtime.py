@@ -0,0 +1,144 @@
+"""
+SimpleSRNet CPU推理运行时
+
+同一个模型可以按以下后端之一提供推理，由一个配置项选择：
+
+- eager：原始 nn.Module，权重和输入使用 channels_last 内存布局；
+- torchscript：trace 后冻结（torch.jit.freeze），再用 optimize_for_inference
+  做常量折叠和卷积+ReLU融合；
+- onnx：导出为ONNX（批次和空间维度可变），由 ONNX Runtime CPU 执行，需要安装 onnxruntime
+  （torch 2.9 及以上的导出器还需要 onnxscript）。
+
+不提供 int8（FX静态量化）后端：SimpleSRNet 的激活范围很宽，即使用图片块校准，
+与 eager 的差异仍在 0.07 左右，始终无法通过校验而回退到 eager。配置为 int8 时按未知后端处理。
+
+每个运行时都是 runtime(batch) -> batch 的可调用对象，可直接交给分块推理引擎。
+构建后与 eager 模型比较输出，差异超出容差时记录错误并回退到 eager。
+"""
+
+import copy
+import io
+import logging
+
+import torch
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("eager", "torchscript", "onnx")
+
+# 各后端与 eager 输出允许的最大差异（输出按 [0, 1] 归一化）
+DEFAULT_TOLERANCES = {
+    "eager": 1e-5,
+    "torchscript": 1e-4,
+    "onnx": 1e-4,
+}
+
+# 构建和校验时使用的样例块：批大小、边长
+SAMPLE_BATCH = 2
+SAMPLE_SIZE = 64
+
+
+class ModelRuntime:
+    """推理运行时：包装具体后端的可调用对象"""
+
+    def __init__(self, backend, forward, channels_last=False):
+        self.backend = backend
+        self._forward = forward
+        self.channels_last = channels_last
+
+    def __call__(self, batch):
+        if self.channels_last:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        return self._forward(batch)
+
+
+def _sample_input():
+    return torch.rand(SAMPLE_BATCH, 3, SAMPLE_SIZE, SAMPLE_SIZE)
+
+
+def _build_eager(model):
+    # 已是 channels_last 布局的权重（model_registry 保存的权重文件）不会被复制
+    model = model.to(memory_format=torch.channels_last)
+
+    def forward(batch):
+        with torch.inference_mode():
+            return model(batch)
+    return ModelRuntime("eager", forward, channels_last=True)
+
+
+def _build_torchscript(model):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, _sample_input())
+        frozen = torch.jit.freeze(traced)
+        optimized = torch.jit.optimize_for_inference(frozen)
+
+    def forward(batch):
+        with torch.no_grad():
+            return optimized(batch)
+    return ModelRuntime("torchscript", forward)
+
+
+def _build_onnx(model):
+    # 可选依赖，只有选择 onnx 后端时才需要安装
+    import onnxruntime
+
+    buffer = io.BytesIO()
+    dynamic = {0: "batch", 2: "height", 3: "width"}
+    with torch.no_grad():
+        torch.onnx.export(model, _sample_input(), buffer, input_names=["input"], output_names=["output"],
+                          dynamic_axes={"input": dynamic, "output": dynamic}, opset_version=17)
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = torch.get_num_threads()
+    session = onnxruntime.InferenceSession(buffer.getvalue(), options, providers=["CPUExecutionProvider"])
+
+    def forward(batch):
+        output = session.run(None, {"input": batch.contiguous().numpy()})[0]
+        return torch.from_numpy(output)
+    return ModelRuntime("onnx", forward)
+
+
+_BUILDERS = {
+    "eager": _build_eager,
+    "torchscript": _build_torchscript,
+    "onnx": _build_onnx,
+}
+
+
+def parity_check(runtime, reference, sample=None):
+    """比较运行时与参考 eager 模型的输出，返回最大绝对差异"""
+    sample = _sample_input() if sample is None else sample
+    with torch.inference_mode():
+        expected = reference(sample)
+    actual = runtime(sample.clone())
+    return float((actual.float() - expected).abs().max())
+
+
+def build_runtime(model, backend="eager", tolerance=None):
+    """按后端构建推理运行时
+
+    model 为 eval 模式的 eager 模型。构建失败或与 eager 输出的差异超出容差时，
+    记录错误并回退到 eager 后端。
+    """
+    if backend not in _BUILDERS:
+        logger.warning(f"未知的推理后端: {backend}, 使用 eager")
+        backend = "eager"
+    model.eval()
+    # eager 后端会修改权重的内存布局，保留一份原始模型作为校验参考
+    reference = copy.deepcopy(model)
+    tolerance = DEFAULT_TOLERANCES[backend] if tolerance is None else tolerance
+
+    try:
+        runtime = _BUILDERS[backend](model)
+    except Exception as e:
+        logger.error(f"构建推理后端 {backend} 失败: {e}, 回退到 eager")
+        return _build_eager(model)
+
+    difference = parity_check(runtime, reference)
+    if difference > tolerance:
+        logger.error(f"推理后端 {backend} 与 eager 输出差异 {difference:.6f} 超出容差 {tolerance}, 回退到 eager")
+        return _build_eager(reference)
+    logger.info(f"推理后端已就绪: {backend}, 与 eager 最大差异 {difference:.6f}")
+    return runtime
+
@@ -0,0 +1,279 @@
+"""
+增强管线注册表
+
+每种增强方法声明为一组带参数的阶段，/api/methods 的列表和各 enhance_* 函数都由注册表生成。
+运行时把 打开 -> 修复方向 -> 转换RGB -> 放大 的公共前缀只执行一次：同一张图请求多种方法时，
+放大倍数相同的方法共享放大结果以及相同的前几个滤镜阶段，并记录每个阶段的耗时。
+
+放大的插值核由方法声明（默认 lanczos），放大后端（PIL 或 OpenCV）由 ResizePolicy
+按方法和输出像素数选择，插值核、后端不同的方法不共享放大结果。
+
+调用方可以在方法的阶段之后追加额外阶段（如滤镜和调整），与方法自身的阶段一起分块执行，
+相邻的逐像素颜色阶段由引擎合并为一次遍历。
+"""
+
+import logging
+
+from PIL import ImageFilter
+
+from cache import content_digest
+from image_io import is_bytes, load_rgb
+from resize import kernel
+from tiling import KernelStage, ContrastStage, ColorStage, BrightnessStage
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 未知方法时使用的默认方法
+DEFAULT_METHOD = "traditional"
+
+
+class Pipeline:
+    """一种增强方法：元数据 + 放大倍数 + 放大后依次执行的阶段"""
+
+    def __init__(self, method_id, name, description, speed, stages, scale_factor=2, listed=True, resample="lanczos"):
+        self.id = method_id
+        self.name = name
+        self.description = description
+        self.speed = speed
+        self.stages = list(stages)
+        self.scale_factor = scale_factor
+        # 放大使用的插值核名称，见 resize.KERNELS
+        self.resample = resample
+        # 是否在 /api/methods 中列出
+        self.listed = listed
+
+    def describe(self):
+        """/api/methods 使用的方法描述"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "speed": self.speed,
+            "scale_factor": self.scale_factor,
+            "resample": self.resample,
+            "stages": [stage.name for stage in self.stages],
+        }
+
+
+PIPELINES = {}
+
+
+def register_pipeline(pipeline):
+    """注册增强方法，同名方法会被替换"""
+    PIPELINES[pipeline.id] = pipeline
+    return pipeline
+
+
+def get_pipeline(method):
+    """按方法ID获取管线，未知方法使用默认方法"""
+    return PIPELINES.get(method) or PIPELINES[DEFAULT_METHOD]
+
+
+def list_methods():
+    """列出公开的增强方法"""
+    return [pipeline.describe() for pipeline in PIPELINES.values() if pipeline.listed]
+
+
+def _common_prefix(stage_lists):
+    """多组阶段共同的前缀长度"""
+    length = 0
+    for stages in zip(*stage_lists):
+        if any(stage.key != stages[0].key for stage in stages[1:]):
+            break
+        length += 1
+    return length
+
+
+def _load_source(source, image_cache, digest, timings):
+    """解码源图，配置了图片缓存时复用已解码的结果"""
+    if digest is None:
+        return load_rgb(source, timings)
+    key = ("decoded", digest)
+    img = image_cache.get(key)
+    if img is None:
+        img = load_rgb(source, timings)
+        img.load()
+        image_cache.put(key, img)
+    else:
+        logger.info("命中已解码图片缓存")
+    return img
+
+
+def _upscaled_base(img, scale, engine, image_cache, digest, timings, resample_name="lanczos", backend=None,
+                   max_pixels=0):
+    """获取放大后的基础图
+
+    基础图超过 max_pixels 或无法放入图片缓存时返回None，由引擎分块放大并执行后续阶段，
+    不保留整张基础图，峰值内存仍受分块预算限制。
+    """
+    pixels = img.width * img.height * scale * scale
+    if digest is None or pixels > max_pixels or pixels * 3 > image_cache.max_bytes:
+        return None
+    key = ("upscaled", digest, scale, resample_name, backend or engine.resize_backend)
+    base = image_cache.get(key)
+    if base is None:
+        base = engine.run(img, scale, [], kernel(resample_name), timings=timings, resize_backend=backend)
+        image_cache.put(key, base)
+    else:
+        logger.info(f"命中 {scale} 倍放大基础图缓存")
+    return base
+
+
+def run_pipelines(source, methods, engine, scale_factor=None, image_cache=None, max_scale=None, extra_stages=(),
+                  resize_policy=None, base_cache_pixels=0):
+    """对同一张图执行一种或多种增强方法
+
+    source: 文件路径、图片字节或文件对象；methods: 方法ID列表；
+    scale_factor: 覆盖各方法默认的放大倍数；
+    image_cache: 可选的图片缓存（LRUCache），source 为字节时缓存解码结果，
+    以及不超过 base_cache_pixels 的放大基础图（0 表示不缓存基础图）；
+    max_scale: 放大倍数上限，由准入控制在输出尺寸过大时设置；
+    extra_stages: 追加在每种方法的阶段之后执行的阶段；
+    resize_policy: 可选的 ResizePolicy，按方法和输出像素数选择放大后端和插值核，为空时使用引擎的默认后端。
+    返回 {方法ID: (结果图, 各阶段耗时)}，公共前缀的耗时计入每种方法。
+    """
+    digest = None
+    if image_cache is not None and image_cache.max_bytes and is_bytes(source):
+        digest = content_digest(source)
+
+    shared = {}
+    img = _load_source(source, image_cache, digest, shared)
+
+    pipelines = {}
+    for method in methods:
+        pipeline = get_pipeline(method)
+        scale = scale_factor or pipeline.scale_factor
+        pipelines[method] = (pipeline, min(scale, max_scale) if max_scale else scale)
+
+    # 放大倍数、插值核和放大后端都相同的方法共享放大以及相同的前几个阶段
+    groups = {}
+    for method, (pipeline, scale) in pipelines.items():
+        resample_name, backend = pipeline.resample, None
+        if resize_policy is not None:
+            resample_name = resize_policy.kernel(pipeline.id, pipeline.resample)
+            backend = resize_policy.choose(pipeline.id, img.width * img.height * scale * scale)
+        groups.setdefault((scale, resample_name, backend), []).append(method)
+
+    results = {}
+    for (scale, resample_name, backend), group in groups.items():
+        stage_lists = [pipelines[method][0].stages + list(extra_stages) for method in group]
+        group_timings = dict(shared)
+        resample = kernel(resample_name)
+        # 放大后的基础图可缓存时，后续阶段在基础图上以1倍执行
+        source_img, run_scale = img, scale
+        upscaled = _upscaled_base(img, scale, engine, image_cache, digest, group_timings, resample_name, backend,
+                                  base_cache_pixels)
+        if upscaled is not None:
+            source_img, run_scale = upscaled, 1
+
+        if len(group) == 1:
+            image = engine.run(source_img, run_scale, stage_lists[0], resample, timings=group_timings,
+                               resize_backend=backend)
+            results[group[0]] = (image, group_timings)
+            continue
+
+        prefix = _common_prefix(stage_lists)
+        base = engine.run(source_img, run_scale, stage_lists[0][:prefix], resample, timings=group_timings,
+                          resize_backend=backend)
+        logger.info(f"方法 {group} 共享放大和前 {prefix} 个阶段")
+        for method, stages in zip(group, stage_lists):
+            timings = dict(group_timings)
+            rest = stages[prefix:]
+            image = engine.run(base, 1, rest, timings=timings, first_index=prefix) if rest else base
+            results[method] = (image, timings)
+    return results
+
+
+def run_pipeline(source, method, engine, scale_factor=None, image_cache=None, max_scale=None, extra_stages=(),
+                 resize_policy=None, base_cache_pixels=0):
+    """执行单个增强方法，返回 (结果图, 各阶段耗时)"""
+    return run_pipelines(source, [method], engine, scale_factor, image_cache, max_scale, extra_stages,
+                         resize_policy, base_cache_pixels)[method]
+
+
+register_pipeline(Pipeline(
+    "traditional",
+    "传统增强",
+    "基于传统图像处理算法，温和提升分辨率与清晰度，保持自然效果。处理速度：极快（1-3秒）",
+    "fast",
+    [
+        # 放大 -> 轻微锐化 -> 适中的对比度增强 -> 轻微的亮度增强
+        KernelStage(ImageFilter.SHARPEN),
+        ContrastStage(1.05),  # 降低对比度增强强度
+        BrightnessStage(1.01),  # 轻微提升亮度
+    ],
+))
+
+register_pipeline(Pipeline(
+    "super_clear",
+    "超级清晰",
+    "重新优化版8倍放大算法，多级锐化处理，强对比度和饱和度增强，追求极致清晰度。处理速度：较慢（8-15秒）",
+    "slow",
+    [
+        # 第一阶段：LANCZOS高质量放大（由引擎完成）
+        # 第二阶段：多级锐化处理 - 增强清晰度
+        KernelStage(ImageFilter.SHARPEN),
+        KernelStage(ImageFilter.EDGE_ENHANCE),
+        KernelStage(ImageFilter.EDGE_ENHANCE_MORE),
+        # 第三阶段：强对比度增强 - 突出细节
+        ContrastStage(1.25),
+        # 第四阶段：饱和度增强 - 让色彩更鲜艳
+        ColorStage(1.2),
+        # 第五阶段：亮度调整 - 确保细节可见
+        BrightnessStage(1.05),
+        # 第六阶段：再次锐化 - 强化边缘细节
+        KernelStage(ImageFilter.SHARPEN),
+        # 第七阶段：最终边缘增强 - 确保极致清晰
+        KernelStage(ImageFilter.EDGE_ENHANCE_MORE),
+        # 第八阶段：最终锐化 - 确保每个细节都清晰可见
+        KernelStage(ImageFilter.SHARPEN),
+    ],
+    scale_factor=5,
+))
+
+register_pipeline(Pipeline(
+    "advanced",
+    "高级增强",
+    "结合传统和AI技术，温和的图像增强，保持自然色彩和清晰度。处理速度：中等（3-6秒）",
+    "medium",
+    [
+        # LANCZOS高质量放大 -> 温和锐化 -> 对比度 -> 饱和度 -> 亮度 -> 边缘增强（只做一次）
+        KernelStage(ImageFilter.SHARPEN),
+        ContrastStage(1.1),  # 降低对比度增强强度
+        ColorStage(1.05),  # 降低饱和度增强强度
+        BrightnessStage(1.02),  # 轻微提升亮度
+        KernelStage(ImageFilter.EDGE_ENHANCE),
+    ],
+))
+
+register_pipeline(Pipeline(
+    "super_quality",
+    "超级质量",
+    "高质量图像处理，温和的增强参数，确保图片清晰自然。处理速度：较慢（8-15秒）",
+    "slow",
+    [
+        # 直接LANCZOS高质量放大（避免分步放大导致的失真）-> 温和锐化
+        # -> 对比度 -> 饱和度 -> 亮度微调 -> 细节增强（使用边缘增强而非锐化）
+        KernelStage(ImageFilter.SHARPEN),
+        ContrastStage(1.1),  # 降低对比度增强强度
+        ColorStage(1.05),  # 降低饱和度增强强度
+        BrightnessStage(1.02),  # 轻微提升亮度
+        KernelStage(ImageFilter.EDGE_ENHANCE),
+    ],
+))
+
+register_pipeline(Pipeline(
+    "quality_basic",
+    "质量增强",
+    "质量优先的基础增强，温和锐化并轻微提升对比度、饱和度和亮度。",
+    "fast",
+    [
+        # 高质量放大 -> 温和锐化 -> 对比度 -> 饱和度 -> 亮度
+        KernelStage(ImageFilter.SHARPEN),
+        ContrastStage(1.08),  # 降低对比度增强强度
+        ColorStage(1.03),  # 降低饱和度增强强度
+        BrightnessStage(1.01),  # 轻微提升亮度
+    ],
+    listed=False,
+))
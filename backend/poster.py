@@ -0,0 +1,119 @@
+"""
+海报合成
+
+海报由固定大小的单元格排成网格（grid，按列数换行）或单行（horizontal）。
+每张图片只解码到单元格尺寸：JPEG 通过 draft 在解码阶段按 1/2、1/4、1/8 缩小，
+再用 LANCZOS 缩放到单元格大小后立即粘贴到预先分配好的画布上，逐行合成，
+同一时刻只保留正在处理的单元格，不会同时持有所有全尺寸解码结果。
+
+单元格的解码和缩放可以逐个在同一线程中完成（render_poster），
+也可以由调用方分散到执行池，再用 PosterCompositor 按完成顺序粘贴。
+"""
+
+import logging
+
+from PIL import Image
+
+import metrics
+from image_io import load_reduced
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+LAYOUTS = ("grid", "horizontal")
+
+# 画布背景色
+BACKGROUND = (255, 255, 255)
+
+
+class PosterLayout:
+    """海报布局：count 张图片，每个单元格 cell_size 见方，四周留 padding 像素
+
+    layout 为 grid 时每行 columns 个单元格，horizontal 时所有单元格排成一行。
+    """
+
+    def __init__(self, count, layout="grid", columns=3, cell_size=280, padding=10):
+        if layout not in LAYOUTS:
+            layout = "grid"
+        self.count = count
+        self.layout = layout
+        self.columns = max(1, min(columns, count)) if layout == "grid" else max(1, count)
+        self.rows = (count + self.columns - 1) // self.columns
+        self.cell_size = cell_size
+        self.padding = padding
+        self.pitch = cell_size + 2 * padding
+
+    @property
+    def size(self):
+        return self.columns * self.pitch, self.rows * self.pitch
+
+    @property
+    def pixels(self):
+        width, height = self.size
+        return width * height
+
+    def position(self, index):
+        """第 index 张图片在画布上的左上角坐标"""
+        row, col = divmod(index, self.columns)
+        return col * self.pitch + self.padding, row * self.pitch + self.padding
+
+    def row_slices(self):
+        """按行产出每行的图片序号范围"""
+        for row in range(self.rows):
+            yield range(row * self.columns, min((row + 1) * self.columns, self.count))
+
+    def describe(self):
+        width, height = self.size
+        return {
+            "layout": self.layout,
+            "columns": self.columns,
+            "rows": self.rows,
+            "cell_size": self.cell_size,
+            "width": width,
+            "height": height,
+        }
+
+
+def render_cell(source, cell_size):
+    """把一张图片解码并缩放为 cell_size 见方的RGB单元格
+
+    source 为图片字节、文件对象或已解码的图片（如预览代理图）。
+    """
+    with metrics.span("decode"):
+        img = load_reduced(source, (cell_size, cell_size))
+    with metrics.span("resize"):
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return img.resize((cell_size, cell_size), Image.Resampling.LANCZOS)
+
+
+class PosterCompositor:
+    """预先分配画布，按序号把单元格粘贴到对应位置"""
+
+    def __init__(self, layout, background=BACKGROUND):
+        self.layout = layout
+        self.canvas = Image.new("RGB", layout.size, background)
+        self.placed = 0
+
+    def paste(self, index, cell):
+        x, y = self.layout.position(index)
+        self.canvas.paste(cell, (x, y))
+        self.placed += 1
+        logger.info(f"处理海报图片 {index}: 粘贴到位置 ({x}, {y})")
+
+
+def render_poster(sources, layout, load=None):
+    """逐行解码、缩放并粘贴 sources，返回 (海报, 成功粘贴的图片数)
+
+    load(source) 把请求中的图片转换为 render_cell 接受的输入（如解码 base64），
+    单张图片失败时记录错误并留空对应单元格。
+    """
+    compositor = PosterCompositor(layout)
+    for row in layout.row_slices():
+        for index in row:
+            try:
+                source = load(sources[index]) if load else sources[index]
+                compositor.paste(index, render_cell(source, layout.cell_size))
+            except Exception as e:
+                logger.error(f"处理海报图片 {index} 失败: {e}")
+    return compositor.canvas, compositor.placed
@@ -0,0 +1,150 @@
+"""
+交互式预览会话
+
+前端的滤镜和调整滑块每次变化都会提交整张图片，服务端重新解码、修复方向、
+处理全分辨率图片并以质量95编码，交互延迟很高。预览会话在创建时解码一次，
+保存按视口尺寸缩小的代理图，之后的滤镜/调整只作用于代理图，以较低质量编码，
+耗时在毫秒级；用户导出时才按同样的参数渲染全分辨率原图。
+
+代理图尺寸由文件头计算，JPEG 通过 draft 模式在解码阶段按 1/2、1/4、1/8 缩小，
+不必解码全分辨率像素。
+会话保存在创建它的服务进程内存中，按最近使用淘汰并在空闲超时后过期；
+多个 Sanic 工作进程时需要把同一会话的请求路由到同一进程。
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from PIL import Image
+
+from image_io import load_reduced, probe
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def make_proxy(img_bytes, max_edge):
+    """解码图片并缩小到长边不超过 max_edge，返回 (代理图, 原图尺寸)
+
+    原图尺寸为修复方向后的宽高。
+    """
+    full_size = probe(img_bytes).oriented_size
+    ratio = min(1.0, max_edge / max(full_size))
+    target = (max(1, round(full_size[0] * ratio)), max(1, round(full_size[1] * ratio)))
+    # 按DCT缩放直接解码出不小于目标尺寸的图片
+    oriented = load_reduced(img_bytes, target, reducing_gap=1.0)
+    proxy = oriented.convert("RGB") if oriented.mode != "RGB" else oriented
+    proxy.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    proxy.load()
+    return proxy, full_size
+
+
+class PreviewSession:
+    """一个预览会话：原图字节（用于导出）和缩小后的代理图"""
+
+    def __init__(self, session_id, source, proxy, full_size):
+        self.id = session_id
+        self.source = source
+        self.proxy = proxy
+        self.full_size = full_size
+        self.last_used = time.monotonic()
+
+    def describe(self):
+        return {
+            "session_id": self.id,
+            "width": self.full_size[0],
+            "height": self.full_size[1],
+            "preview_width": self.proxy.width,
+            "preview_height": self.proxy.height,
+        }
+
+
+class PreviewStore:
+    """预览会话存储，超过 max_sessions 时淘汰最久未使用的会话，空闲超过 ttl 秒的会话过期
+
+    也用于保存其他带 id 和 last_used 的会话对象（如结果金字塔），name 为日志中的名称；
+    max_bytes 大于0时会话对象需提供 memory_bytes，总大小超出时同样淘汰最久未使用的会话（至少保留一个）。
+    """
+
+    def __init__(self, max_sessions=32, ttl=1800, name="预览会话", max_bytes=0):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.name = name
+        self.ttl = ttl
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        now = time.monotonic()
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used <= self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self.expired += 1
+            logger.info(f"{self.name}已过期: {session.id}")
+
+    def add(self, session):
+        """加入会话，超过 max_sessions 时淘汰最久未使用的会话"""
+        with self._lock:
+            self._prune()
+            self._sessions[session.id] = session
+            self.created += 1
+            self._evict()
+        return session
+
+    def _memory_bytes(self):
+        return sum(session.memory_bytes for session in self._sessions.values()) if self.max_bytes else 0
+
+    def _evict(self):
+        while len(self._sessions) > self.max_sessions:
+            evicted, _ = self._sessions.popitem(last=False)
+            self.evicted += 1
+            logger.info(f"{self.name}数超出上限，淘汰: {evicted}")
+        while len(self._sessions) > 1 and self._memory_bytes() > self.max_bytes:
+            evicted, _ = self._sessions.popitem(last=False)
+            self.evicted += 1
+            logger.info(f"{self.name}总大小超出上限，淘汰: {evicted}")
+
+    def trim(self):
+        """会话对象的内存增长后（如金字塔生成了新级别）按 max_bytes 淘汰"""
+        with self._lock:
+            self._evict()
+
+    def create(self, source, proxy, full_size):
+        session = self.add(PreviewSession(uuid.uuid4().hex, source, proxy, full_size))
+        logger.info(f"创建预览会话: {session.id}, 原图 {full_size[0]}x{full_size[1]}, "
+                    f"代理图 {proxy.width}x{proxy.height}")
+        return session
+
+    def get(self, session_id):
+        """获取会话并刷新使用时间，不存在或已过期时返回None"""
+        with self._lock:
+            self._prune()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "memory_bytes": self._memory_bytes(),
+                "max_bytes": self.max_bytes,
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
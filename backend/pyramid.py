@@ -0,0 +1,111 @@
+"""
+结果图片的多分辨率金字塔
+
+增强完成后，前端的调整/滤镜滑块每次变化都会把放大后的结果以 base64 发回服务端，
+服务端再按全分辨率解码和处理。金字塔把结果的编码字节保存在服务进程中，
+以不透明的句柄引用，客户端只需提交句柄和目标级别：
+
+- 第0级为全分辨率，直接使用保存的字节，走与上传图片相同的执行池路径和结果缓存；
+- 第k级为长宽各缩小到 1/2^k 的图片，首次使用时生成并缓存在金字塔中：
+  从已缓存的上一级缩小一半，没有时从原字节按 JPEG draft 缩小解码，
+  不必解码全分辨率像素。
+
+金字塔保存在创建它的服务进程内存中，与预览会话一样按最近使用淘汰并在空闲超时后过期，
+总大小（原字节 + 已缓存的级别）超出上限时也淘汰最久未使用的金字塔。
+"""
+
+import logging
+import math
+import threading
+import time
+import uuid
+
+from PIL import Image
+
+from image_io import load_reduced, probe
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 最小一级的长边不小于该像素数
+MIN_LEVEL_EDGE = 64
+
+
+class ImagePyramid:
+    """一张结果图片：编码后的字节 + 按需生成的缩小级别"""
+
+    def __init__(self, handle, source, max_levels=6):
+        self.id = handle
+        self.source = source
+        self.full_size = probe(source).oriented_size
+        longest = max(self.full_size)
+        self.levels = 1 + max(0, min(max_levels - 1, int(math.log2(max(longest / MIN_LEVEL_EDGE, 1)))))
+        self.last_used = time.monotonic()
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def level_size(self, level):
+        """第 level 级的 (宽, 高)"""
+        width, height = self.full_size
+        return max(1, math.ceil(width / 2 ** level)), max(1, math.ceil(height / 2 ** level))
+
+    def level_for_edge(self, max_edge):
+        """长边不小于 max_edge 的最小级别，max_edge 超过原图时为第0级"""
+        for level in range(self.levels - 1, 0, -1):
+            if max(self.level_size(level)) >= max_edge:
+                return level
+        return 0
+
+    def check_level(self, level):
+        if not 0 <= level < self.levels:
+            raise ValueError(f"金字塔级别超出范围: {level}，共 {self.levels} 级")
+        return level
+
+    def image(self, level):
+        """第 level（>=1）级的RGB图片，首次使用时生成并缓存"""
+        self.check_level(level)
+        with self._lock:
+            cached = self._images.get(level)
+            if cached is not None:
+                return cached
+            size = self.level_size(level)
+            upper = self._images.get(level - 1)
+            if upper is not None:
+                img = upper.resize(size, Image.Resampling.LANCZOS)
+            else:
+                img = reduce_image(self.source, size)
+            img.load()
+            self._images[level] = img
+            logger.info(f"生成金字塔级别: {self.id} 第{level}级 {size[0]}x{size[1]}")
+            return img
+
+    @property
+    def memory_bytes(self):
+        """原字节和已缓存级别占用的内存，PreviewStore 按它限制金字塔的总大小"""
+        return len(self.source) + sum(img.width * img.height * 3 for img in self._images.values())
+
+    def describe(self):
+        return {
+            "handle": self.id,
+            "width": self.full_size[0],
+            "height": self.full_size[1],
+            "levels": [
+                {"level": level, "width": self.level_size(level)[0], "height": self.level_size(level)[1]}
+                for level in range(self.levels)
+            ],
+        }
+
+
+def reduce_image(source, size):
+    """从编码后的字节直接缩小解码为 size 的RGB图片，不解码全分辨率像素"""
+    img = load_reduced(source, size, reducing_gap=1.0)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if img.size != size:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    return img
+
+
+def create_pyramid(source, max_levels=6):
+    """为编码后的结果图片创建金字塔，只读取文件头"""
+    return ImagePyramid(uuid.uuid4().hex, bytes(source), max_levels)
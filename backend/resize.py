@@ -0,0 +1,206 @@
+"""
+放大后端
+
+增强管线的放大原来都由 PIL 的 Image.resize(LANCZOS) 单线程完成。这里把放大抽象为
+后端 + 插值核：
+
+- "pil"：Image.resize，安装 Pillow-SIMD（同名替换包）时自动使用其SIMD实现；
+- "opencv"：cv2.resize，由 OpenCV 的线程池并行，线程数由 configure_threads 设置。
+
+插值核按名称选择：lanczos（PIL LANCZOS / cv2.INTER_LANCZOS4）、cubic（BICUBIC / INTER_CUBIC）、
+area（BOX / INTER_AREA）、bilinear（BILINEAR / INTER_LINEAR）。两个后端的同名插值核
+结果接近但不逐位一致，且速度差异随图片尺寸、插值核和CPU核心数变化很大
+（单核时 cv2 的 LANCZOS4 通常比 PIL 慢，CUBIC 则快数倍），因此由 ResizePolicy
+按方法和输出像素数选择后端，策略由 benchmark.py --resize-policy 根据实测结果生成。
+"""
+
+import functools
+import json
+import logging
+import math
+import threading
+
+import numpy as np
+import PIL
+from PIL import Image
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("pil", "opencv")
+
+# 插值核名称 -> PIL 插值方式
+KERNELS = {
+    "lanczos": Image.Resampling.LANCZOS,
+    "cubic": Image.Resampling.BICUBIC,
+    "area": Image.Resampling.BOX,
+    "bilinear": Image.Resampling.BILINEAR,
+}
+
+# PIL 插值方式 -> cv2 插值标志名
+CV2_INTERPOLATION = {
+    Image.Resampling.LANCZOS: "INTER_LANCZOS4",
+    Image.Resampling.BICUBIC: "INTER_CUBIC",
+    Image.Resampling.BOX: "INTER_AREA",
+    Image.Resampling.BILINEAR: "INTER_LINEAR",
+    Image.Resampling.NEAREST: "INTER_NEAREST",
+}
+
+# opencv 后端按 box 放大时源图裁剪区域额外包含的像素（LANCZOS4 的核半径）
+BOX_PADDING = 4
+
+
+def is_pillow_simd(version):
+    """Pillow-SIMD 的版本号带 .post 后缀（如 9.5.0.post1）"""
+    return ".post" in version
+
+
+PILLOW_SIMD = is_pillow_simd(PIL.__version__)
+
+_threads_lock = threading.Lock()
+_configured_threads = None
+
+
+def kernel(name):
+    """插值核名称对应的 PIL 插值方式，未知名称时抛出 ValueError"""
+    if name not in KERNELS:
+        raise ValueError(f"不支持的插值核: {name}")
+    return KERNELS[name]
+
+
+def configure_threads(threads):
+    """设置本进程 cv2.resize 使用的线程数，0 表示保持 OpenCV 默认值
+
+    执行池有多个工作者时，每个工作者的线程数乘以工作者数不宜超过CPU核心数。
+    """
+    global _configured_threads
+    if not threads or threads == _configured_threads:
+        return
+    import cv2
+    with _threads_lock:
+        cv2.setNumThreads(int(threads))
+        _configured_threads = threads
+    logger.info(f"OpenCV 线程数: {threads}")
+
+
+def resize_image(img, size, resample=Image.Resampling.LANCZOS, backend="pil", box=None):
+    """把 RGB 图片（或其中 box 区域）缩放到 size
+
+    box 与 Image.resize 的含义相同；opencv 后端在 box 外多取 BOX_PADDING 个源像素一起缩放
+    再裁掉，box 为整数坐标且缩放倍数为整数时与整幅缩放后裁剪的结果一致。
+    """
+    if backend != "opencv":
+        return img.resize(size, resample, box=box)
+
+    import cv2
+    interpolation = getattr(cv2, CV2_INTERPOLATION[resample])
+    arr = np.asarray(img)
+    if box is None:
+        return Image.fromarray(cv2.resize(arr, size, interpolation=interpolation))
+
+    x0, y0, x1, y1 = box
+    scale_x, scale_y = size[0] / (x1 - x0), size[1] / (y1 - y0)
+    px0, py0 = max(0, math.floor(x0) - BOX_PADDING), max(0, math.floor(y0) - BOX_PADDING)
+    px1, py1 = min(img.width, math.ceil(x1) + BOX_PADDING), min(img.height, math.ceil(y1) + BOX_PADDING)
+    padded = cv2.resize(arr[py0:py1, px0:px1],
+                        (round((px1 - px0) * scale_x), round((py1 - py0) * scale_y)),
+                        interpolation=interpolation)
+    ox, oy = round((x0 - px0) * scale_x), round((y0 - py0) * scale_y)
+    return Image.fromarray(np.ascontiguousarray(padded[oy:oy + size[1], ox:ox + size[0]]))
+
+
+class ResizePolicy:
+    """按增强方法和输出像素数选择放大后端，并可按方法覆盖插值核
+
+    rules: {方法ID或"*": [[最小输出像素数, 后端], ...]}，同一方法的规则按像素数升序，
+    取不超过输出像素数的最后一条；没有匹配的规则时使用 default。
+    kernels: {方法ID: 插值核名称}，覆盖管线声明的插值核。
+    """
+
+    def __init__(self, rules=None, default="pil", kernels=None):
+        if default not in BACKENDS:
+            raise ValueError(f"不支持的放大后端: {default}")
+        self.rules = {method: sorted((int(pixels), backend) for pixels, backend in entries)
+                      for method, entries in (rules or {}).items()}
+        for entries in self.rules.values():
+            for _, backend in entries:
+                if backend not in BACKENDS:
+                    raise ValueError(f"不支持的放大后端: {backend}")
+        self.default = default
+        self.kernels = dict(kernels or {})
+        for name in self.kernels.values():
+            kernel(name)
+
+    def choose(self, method, pixels):
+        """输出 pixels 像素时 method 使用的放大后端"""
+        backend = self.default
+        for min_pixels, candidate in self.rules.get(method) or self.rules.get("*") or ():
+            if pixels < min_pixels:
+                break
+            backend = candidate
+        return backend
+
+    def kernel(self, method, default="lanczos"):
+        """method 使用的插值核名称"""
+        return self.kernels.get(method, default)
+
+    @classmethod
+    def from_cases(cls, cases, default="pil", kernels=None):
+        """从基准测试结果生成策略
+
+        cases 中 "<尺寸>/resize/<方法ID>/<后端>" 用例记录了各后端放大的中位耗时和输出像素数，
+        每种方法在每个测得的输出像素数上选择最快的后端，相邻相同的规则合并；
+        kernels 为测量时使用的插值核覆盖，随策略保存。
+        """
+        timings = {}
+        for name, case in cases.items():
+            parts = name.split("/")
+            if len(parts) != 4 or parts[1] != "resize" or case.get("status") != "ok":
+                continue
+            _, _, method, backend = parts
+            pixels = case["output_pixels"]
+            timings.setdefault(method, {}).setdefault(pixels, {})[backend] = case["median_s"]
+
+        rules = {}
+        for method, by_pixels in timings.items():
+            entries = []
+            for index, pixels in enumerate(sorted(by_pixels)):
+                fastest = min(by_pixels[pixels], key=by_pixels[pixels].get)
+                if not entries or entries[-1][1] != fastest:
+                    entries.append([0 if index == 0 else pixels, fastest])
+            rules[method] = entries
+        return cls(rules, default, kernels)
+
+    @classmethod
+    def load(cls, path, default="pil", kernels=None):
+        """读取 benchmark.py --resize-policy 生成的策略文件"""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("rules"), data.get("default", default), {**data.get("kernels", {}), **(kernels or {})})
+
+    def to_dict(self):
+        return {
+            "default": self.default,
+            "rules": {method: [list(entry) for entry in entries] for method, entries in self.rules.items()},
+            "kernels": self.kernels,
+        }
+
+    def describe(self):
+        return {**self.to_dict(), "pillow_simd": PILLOW_SIMD, "opencv_threads": _configured_threads}
+
+
+@functools.lru_cache(maxsize=8)
+def load_policy(backend="auto", path="", kernels=()):
+    """按配置生成放大策略，每个进程按参数缓存
+
+    backend 为 pil 或 opencv 时所有方法都使用该后端；为 auto 时读取 path 处的策略文件，
+    没有策略文件、或文件不存在、格式错误时使用 pil。kernels 为 (方法ID, 插值核名称) 元组。
+    """
+    if backend != "auto":
+        return ResizePolicy(default=backend, kernels=dict(kernels))
+    if path:
+        try:
+            return ResizePolicy.load(path, kernels=dict(kernels))
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"放大策略文件 {path} 无法读取，使用 pil: {e}")
+    return ResizePolicy(kernels=dict(kernels))
@@ -0,0 +1,179 @@
+"""
+结果响应格式协商
+
+默认仍返回包含 base64 data URL 的JSON，兼容旧客户端。客户端通过 Accept 头声明
+image/jpeg、image/png、image/webp（Pillow 支持时还有 image/avif）时直接返回二进制图片，按块发送；
+多结果请求声明 multipart/mixed 时返回 multipart 响应，每个结果一个分段；
+声明 application/x-ndjson 或 text/event-stream 时每个结果完成后立即发送一行JSON
+或一个SSE事件。多结果的响应都可以接收异步迭代器，结果按完成顺序边处理边发送，
+内存只与处理中的条目数有关。
+二进制模式避免了 base64 带来的33%体积膨胀以及构造大JSON字符串的内存副本。
+"""
+
+import json as json_lib
+import logging
+import uuid
+
+import metrics
+from encoding import FORMATS
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 支持的二进制响应格式：MIME类型 -> PIL格式名
+IMAGE_FORMATS = {
+    "image/jpeg": "JPEG",
+    "image/png": "PNG",
+    "image/webp": "WEBP",
+}
+if "AVIF" in FORMATS:
+    IMAGE_FORMATS["image/avif"] = "AVIF"
+
+# PIL格式名 -> MIME类型、文件扩展名
+FORMAT_MIME = {fmt: mime for mime, fmt in IMAGE_FORMATS.items()}
+FORMAT_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "AVIF": "avif"}
+
+# 响应模式
+JSON = "json"
+BINARY = "binary"
+MULTIPART = "multipart"
+NDJSON = "ndjson"
+EVENTS = "events"
+
+# 逐条发送结果的流式JSON类型
+STREAM_TYPES = {
+    "application/x-ndjson": NDJSON,
+    "application/jsonl": NDJSON,
+    "text/event-stream": EVENTS,
+}
+
+# 默认每次发送的字节数
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+
+def negotiate(request, multiple=False):
+    """根据 Accept 头选择响应模式，返回 (模式, PIL格式名)
+
+    按客户端偏好顺序匹配：application/json 或 */* 返回JSON；
+    单结果请求匹配到图片类型时返回二进制；多结果请求匹配到 multipart/mixed
+    或图片类型时返回 multipart，图片类型决定各分段的格式；
+    多结果请求匹配到 NDJSON 或 text/event-stream 时逐条发送JSON。
+    """
+    fmt = "JPEG"
+    for media in request.accept:
+        mime = f"{media.type}/{media.subtype}"
+        if mime in IMAGE_FORMATS or mime == "image/*":
+            fmt = IMAGE_FORMATS.get(mime, "JPEG")
+            return (MULTIPART if multiple else BINARY), fmt
+        if multiple and (mime == "multipart/mixed" or mime in STREAM_TYPES):
+            # 分段/data URL 的格式可由后续的图片类型指定
+            for other in request.accept:
+                other_mime = f"{other.type}/{other.subtype}"
+                if other_mime in IMAGE_FORMATS:
+                    fmt = IMAGE_FORMATS[other_mime]
+                    break
+            return STREAM_TYPES.get(mime, MULTIPART), fmt
+        if mime in ("application/json", "*/*", "application/*"):
+            break
+    return JSON, fmt
+
+
+async def _send_chunks(response, data, chunk_size):
+    view = memoryview(data)
+    for offset in range(0, len(view), chunk_size):
+        await response.send(view[offset:offset + chunk_size])
+
+
+async def send_image(request, data, fmt="JPEG", headers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """以二进制图片响应按块发送已编码的图片
+
+    图片先在执行池中完整编码（按目标大小搜索质量、写入结果缓存和 Content-Length
+    都需要完整的编码结果），这里只是把内存中的字节分块写出，避免一次写入大缓冲区；
+    编码器的输出并没有边编码边发送，单个结果的峰值内存仍包含整张编码后的图片。
+    """
+    response = await request.respond(
+        content_type=FORMAT_MIME[fmt],
+        headers={"Content-Length": str(len(data)), **(headers or {})},
+    )
+    await _send_chunks(response, data, chunk_size)
+    await response.eof()
+    metrics.RESPONSE_BYTES.inc(metrics.route_label(request), amount=len(data))
+    logger.info(f"二进制响应发送完成: {FORMAT_MIME[fmt]}, {len(data)} 字节")
+
+
+async def _indexed(items):
+    """把条目列表或按完成顺序产出 (序号, 条目) 的异步迭代器统一为异步迭代"""
+    if hasattr(items, "__aiter__"):
+        async for idx, item in items:
+            yield idx, item
+    else:
+        for idx, item in enumerate(items):
+            yield idx, item
+
+
+async def send_multipart(request, items, fmt="JPEG", chunk_size=DEFAULT_CHUNK_SIZE):
+    """以 multipart/mixed 响应逐个发送结果
+
+    items 是条目列表，或按完成顺序产出 (序号, 条目) 的异步迭代器；
+    每个条目为 {"data": bytes或None, "error": str或None}，
+    可带 "headers" 附加到分段头。失败的条目以 application/json 分段返回错误信息。
+    """
+    boundary = uuid.uuid4().hex
+    response = await request.respond(content_type=f"multipart/mixed; boundary={boundary}")
+    sent = 0
+    count = 0
+    async for idx, item in _indexed(items):
+        count += 1
+        data = item.get("data")
+        extra = {"X-Item-Index": str(idx), **item.get("headers", {})}
+        if data:
+            part_headers = {
+                "Content-Type": FORMAT_MIME[fmt],
+                "Content-Disposition": f'attachment; filename="result_{idx}.{FORMAT_EXTENSIONS[fmt]}"',
+            }
+        else:
+            data = json_lib.dumps({"success": False, "error": item.get("error")}, ensure_ascii=False).encode("utf-8")
+            part_headers = {"Content-Type": "application/json; charset=utf-8"}
+        part_headers.update(extra)
+        part_headers["Content-Length"] = str(len(data))
+        head = f"--{boundary}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in part_headers.items()) + "\r\n"
+        head = head.encode("utf-8")
+        await response.send(head)
+        await _send_chunks(response, data, chunk_size)
+        await response.send(b"\r\n")
+        sent += len(head) + len(data) + 2
+    tail = f"--{boundary}--\r\n".encode("utf-8")
+    await response.send(tail)
+    await response.eof()
+    metrics.RESPONSE_BYTES.inc(metrics.route_label(request), amount=sent + len(tail))
+    logger.info(f"multipart响应发送完成: {count} 个分段")
+
+
+def _stream_line(mode, payload, event="result"):
+    data = json_lib.dumps(payload, ensure_ascii=False)
+    if mode == EVENTS:
+        return f"event: {event}\ndata: {data}\n\n".encode("utf-8")
+    return f"{data}\n".encode("utf-8")
+
+
+async def send_stream(request, mode, items, render):
+    """以 NDJSON 或 SSE 逐条发送结果
+
+    items 与 send_multipart 相同；render(序号, 条目) 返回该条目的JSON对象。
+    全部发送后以 {"done": true, "total": 条目数, "succeeded": 成功数} 结束（SSE 中为 done 事件）。
+    """
+    content_type = "text/event-stream; charset=utf-8" if mode == EVENTS else "application/x-ndjson"
+    response = await request.respond(content_type=content_type,
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    sent = total = succeeded = 0
+    async for idx, item in _indexed(items):
+        total += 1
+        succeeded += 1 if item.get("data") else 0
+        line = _stream_line(mode, render(idx, item))
+        await response.send(line)
+        sent += len(line)
+    line = _stream_line(mode, {"done": True, "total": total, "succeeded": succeeded}, event="done")
+    await response.send(line)
+    await response.eof()
+    metrics.RESPONSE_BYTES.inc(metrics.route_label(request), amount=sent + len(line))
+    logger.info(f"流式响应发送完成: {total} 条, 成功 {succeeded} 条")
@@ -0,0 +1,65 @@
+"""
+SimpleSRNet 超分辨率网络
+
+单独成模块，只有首次使用AI增强时才由模型注册表导入，
+只提供PIL/OpenCV方法的工作进程不需要加载 torch。
+"""
+
+import logging
+
+import torch.nn as nn
+import torch.nn.functional as F
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class SimpleSRNet(nn.Module):
+    """简单的超分辨率网络"""
+    
+    def __init__(self, scale_factor=2):
+        super(SimpleSRNet, self).__init__()
+        logger.info("初始化简单超分辨率网络...")
+        self.scale_factor = scale_factor
+        
+        # 特征提取层
+        self.conv1 = nn.Conv2d(3, 64, kernel_size=3, padding=1)
+        self.conv2 = nn.Conv2d(64, 64, kernel_size=3, padding=1)
+        self.conv3 = nn.Conv2d(64, 64, kernel_size=3, padding=1)
+        
+        # 上采样层
+        self.upsample = nn.ConvTranspose2d(64, 64, kernel_size=4, stride=2, padding=1)
+        
+        # 重建层
+        self.conv4 = nn.Conv2d(64, 3, kernel_size=3, padding=1)
+        
+        # 初始化权重
+        self._initialize_weights()
+        logger.info("简单超分辨率网络初始化完成")
+    
+    def _initialize_weights(self):
+        """初始化网络权重"""
+        logger.info("初始化网络权重...")
+        for m in self.modules():
+            if isinstance(m, nn.Conv2d):
+                nn.init.kaiming_normal_(m.weight, mode='fan_out', nonlinearity='relu')
+                if m.bias is not None:
+                    nn.init.constant_(m.bias, 0)
+            elif isinstance(m, nn.ConvTranspose2d):
+                nn.init.kaiming_normal_(m.weight, mode='fan_out', nonlinearity='relu')
+                if m.bias is not None:
+                    nn.init.constant_(m.bias, 0)
+        logger.info("网络权重初始化完成")
+    
+    def forward(self, x):
+        # 特征提取
+        x = F.relu(self.conv1(x))
+        x = F.relu(self.conv2(x))
+        x = F.relu(self.conv3(x))
+        
+        # 上采样
+        x = self.upsample(x)
+        
+        # 重建
+        x = self.conv4(x)
+        return x
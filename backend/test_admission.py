@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+准入控制测试：按文件头估算成本、自动降低放大倍数、像素预算排队，以及接口返回的413/429
+"""
+
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionError, ImageTooLargeError
+from conftest import image_bytes
+
+# 48x32 的测试图片
+INPUT_PIXELS = 48 * 32
+
+
+def test_plan_downgrades_scale():
+    """输出超出上限时放大倍数逐级降低，直到不超过上限"""
+    controller = AdmissionController(0, INPUT_PIXELS * 9, 0)
+    cost = controller.plan(image_bytes(), [5, 2])
+    # 多种方法的输出像素合计：3 倍 + 2 倍仍超出上限，降到 2 倍
+    assert cost.scale_factors == [2, 2] and cost.max_scale == 2 and cost.downgraded
+    assert cost.output_pixels <= INPUT_PIXELS * 9
+    assert controller.downgraded == 1
+
+
+def test_plan_rejects_too_large():
+    """输入超出上限、或不允许降级时输出超出上限，抛出413"""
+    controller = AdmissionController(INPUT_PIXELS - 1, 0, 0)
+    with pytest.raises(ImageTooLargeError) as info:
+        controller.plan(image_bytes())
+    assert info.value.status_code == 413
+
+    controller = AdmissionController(0, INPUT_PIXELS * 9, 0, auto_downgrade=False)
+    with pytest.raises(ImageTooLargeError):
+        controller.plan(image_bytes(), [5])
+    # 降到最低倍数仍超出上限
+    controller = AdmissionController(0, INPUT_PIXELS * 3, 0, min_scale=2)
+    with pytest.raises(ImageTooLargeError):
+        controller.plan(image_bytes(), [5])
+    assert controller.rejected == 1
+
+
+def test_acquire_queues_in_order():
+    """预算不足时按先后顺序排队，小请求不插到排队的大请求前面"""
+    async def scenario():
+        controller = AdmissionController(0, 0, 100, max_wait=None)
+        order = []
+
+        async def request(name, pixels):
+            await controller.acquire(pixels)
+            order.append(name)
+
+        await controller.acquire(80)
+        tasks = [asyncio.create_task(request("large", 50)), asyncio.create_task(request("small", 10))]
+        await asyncio.sleep(0)
+        assert order == [] and controller.stats()["waiting"] == 2
+        controller.release(80)
+        await asyncio.gather(*tasks)
+        assert order == ["large", "small"] and controller.in_flight == 60
+
+    asyncio.run(scenario())
+
+
+def test_acquire_rejects_with_retry_after():
+    """排队已满或等待超时时抛出429，并给出重试秒数"""
+    async def scenario():
+        controller = AdmissionController(0, 0, 100, max_wait=0.05, max_waiting=1)
+        await controller.acquire(80)
+        waiting = asyncio.create_task(controller.acquire(50))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionError) as info:
+            await controller.acquire(50)
+        assert info.value.status_code == 429 and info.value.retry_after >= 1
+
+        with pytest.raises(AdmissionError):
+            await waiting
+        assert controller.stats()["waiting"] == 0 and controller.rejected == 2
+
+    asyncio.run(scenario())
+
+
+def upload(client, method="traditional", **kwargs):
+    return client.post("/api/upload", files={"file": ("a.png", image_bytes(), "image/png")},
+                       data={"method": method}, **kwargs)[1]
+
+
+def test_upload_input_too_large(client, app_module):
+    """输入像素超出上限返回413"""
+    app_module.app.ctx.admission.max_input_pixels = INPUT_PIXELS - 1
+    response = upload(client)
+    assert response.status == 413
+    assert app_module.app.ctx.admission.stats()["rejected"] == 1
+
+
+def test_upload_downgrades_scale(client, app_module):
+    """输出超出上限时自动降低放大倍数，关闭自动降级时返回413"""
+    admission = app_module.app.ctx.admission
+    admission.max_output_pixels = INPUT_PIXELS * 9
+    response = upload(client, "super_clear")
+    assert response.status == 200 and response.json["scale_factor"] == 3
+    response = upload(client, "super_clear", headers={"Accept": "image/png"})
+    assert response.status == 200 and response.headers["X-Scale-Factor"] == "3"
+
+    admission.auto_downgrade = False
+    response = upload(client, "super_clear")
+    assert response.status == 413
+
+
+def test_upload_busy_returns_429(client, app_module):
+    """像素预算被占用且不允许排队时返回429和 Retry-After"""
+    admission = app_module.app.ctx.admission
+    admission.pixel_budget = INPUT_PIXELS
+    admission.max_wait = 0
+    admission.in_flight = 1
+    response = upload(client)
+    assert response.status == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+    admission.in_flight = 0
+    response = upload(client)
+    assert response.status == 200
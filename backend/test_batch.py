@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量高清化测试：有限并发的条目调度，以及 JSON、NDJSON、SSE 和 multipart 四种批量响应
+"""
+
+import asyncio
+import io
+import json
+
+import pytest
+from PIL import Image
+
+from conftest import data_url, decode_data_url, image_bytes, parse_multipart
+
+SIZES = [(48, 32), (40, 24), (24, 40)]
+BROKEN = "data:image/png;base64,bm90IGFuIGltYWdl"
+
+
+def batch_files():
+    """三张不同尺寸的图片，第二个位置插入一个无法解码的条目"""
+    files = [data_url(image_bytes(*size)) for size in SIZES]
+    return files[:1] + [BROKEN] + files[1:]
+
+
+def expected_sizes():
+    return [(width * 2, height * 2) for width, height in SIZES]
+
+
+def post_batch(client, accept=None):
+    headers = {"Accept": accept} if accept else None
+    _, response = client.post("/api/batch-enhance", json={"files": batch_files(), "method": "traditional"},
+                              headers=headers)
+    return response
+
+
+def test_iter_completed_bounds_concurrency(app_module):
+    """同时运行的条目不超过 concurrency，结果按完成顺序产出并带原序号"""
+    async def scenario():
+        running = peak = 0
+
+        async def worker(delay):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(delay)
+            running -= 1
+            return delay
+
+        delays = [0.05, 0.01, 0.03, 0.0]
+        results = [item async for item in app_module.iter_completed(delays, worker, 2)]
+        assert peak == 2
+        assert sorted(results) == sorted(enumerate(delays))
+        assert results[0] == (1, 0.01)
+
+    asyncio.run(scenario())
+
+
+def test_batch_json_keeps_order(client):
+    """JSON 响应在全部完成后按原顺序返回，失败的条目不影响其他条目"""
+    response = post_batch(client)
+    assert response.status == 200
+    results = response.json["results"]
+    assert [result["success"] for result in results] == [True, False, True, True]
+    sizes = [decode_data_url(result["enhanced_image"]).size for result in results if result["success"]]
+    assert sizes == expected_sizes()
+
+
+@pytest.mark.parametrize("concurrency", [1, 3])
+def test_batch_ndjson(client, app_module, concurrency):
+    """NDJSON 每个条目一行（带原序号），最后一行汇总"""
+    app_module.app.config.BATCH_CONCURRENCY = concurrency
+    response = post_batch(client, "application/x-ndjson")
+    assert response.status == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.body.decode().splitlines()]
+    assert lines[-1] == {"done": True, "total": 4, "succeeded": 3}
+    items = sorted(lines[:-1], key=lambda item: item["index"])
+    assert [item["index"] for item in items] == [0, 1, 2, 3]
+    assert not items[1]["success"] and items[1]["error"]
+    sizes = [decode_data_url(item["enhanced_image"]).size for item in items if item["success"]]
+    assert sizes == expected_sizes()
+    assert all(item["encoding"]["format"] == "JPEG" for item in items if item["success"])
+
+
+def test_batch_event_stream(client):
+    """SSE 每个条目一个 result 事件，以 done 事件结束；后续的图片类型决定 data URL 格式"""
+    response = post_batch(client, "text/event-stream, image/png")
+    assert response.status == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = []
+    for block in response.body.decode().strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    assert [event for event, _ in events] == ["result"] * 4 + ["done"]
+    assert events[-1][1]["succeeded"] == 3
+    assert all(payload["enhanced_image"].startswith("data:image/png")
+               for _, payload in events[:-1] if payload["success"])
+
+
+def test_batch_multipart(client):
+    """multipart 按完成顺序发送分段，X-Item-Index 为原序号，失败的条目为 JSON 分段"""
+    response = post_batch(client, "image/webp")
+    assert response.status == 200
+    assert response.headers["content-type"].startswith("multipart/mixed")
+    parts = {int(headers["X-Item-Index"]): (headers, body) for headers, body in parse_multipart(response)}
+    assert sorted(parts) == [0, 1, 2, 3]
+
+    headers, body = parts.pop(1)
+    assert headers["Content-Type"].startswith("application/json")
+    assert json.loads(body)["success"] is False
+    sizes = []
+    for _, (headers, body) in sorted(parts.items()):
+        assert headers["Content-Type"] == "image/webp"
+        assert int(headers["Content-Length"]) == int(headers["X-Encoded-Bytes"]) == len(body)
+        image = Image.open(io.BytesIO(body))
+        assert image.format == "WEBP"
+        sizes.append(image.size)
+    assert sizes == expected_sizes()
+
+
+def test_batch_without_files(client):
+    _, response = client.post("/api/batch-enhance", json={"files": []})
+    assert response.status == 400
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+结果缓存测试：缓存键区分、内存LRU层和磁盘层，以及管线缓存放大基础图的上限和准入估算
+"""
+
+import os
+import sys
+
+import pytest
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import app as app_module
+from admission import AdmissionController, Cost
+from cache import DiskCache, LRUCache, ResultCache, content_digest, image_nbytes, make_key
+from conftest import image_bytes
+from pipeline import run_pipeline
+from tiling import TiledEngine
+
+
+@pytest.fixture
+def config():
+    """测试中修改的配置在结束后恢复"""
+    config = app_module.app.config
+    saved = {name: config[name] for name in ("POINT_OPS_BACKEND", "RESIZE_BACKEND", "RESIZE_KERNELS")}
+    yield config
+    config.update(saved)
+
+
+def test_make_key_separates_params():
+    """相同输入、不同参数的键不同，相同参数的键稳定"""
+    digest = content_digest(b"image")
+    assert make_key(digest, "enhance", "traditional", 2) == make_key(digest, "enhance", "traditional", 2)
+    assert make_key(digest, "enhance", "traditional", 2) != make_key(digest, "enhance", "traditional", 3)
+    assert make_key(digest, "filter", {"a": 1}) != make_key(content_digest(b"other"), "filter", {"a": 1})
+
+
+@pytest.mark.parametrize("name, value", [
+    ("POINT_OPS_BACKEND", "pil"),
+    ("RESIZE_BACKEND", "opencv"),
+    ("RESIZE_KERNELS", {"traditional": "cubic"}),
+])
+def test_pipeline_key_tracks_config(config, name, value):
+    """逐像素后端、放大后端和插值核的配置变化都会改变增强结果的缓存键"""
+    cost = Cost(100, 80, [2])
+    config.update(POINT_OPS_BACKEND="fused", RESIZE_BACKEND="pil", RESIZE_KERNELS={})
+    before = app_module.pipeline_key("traditional", cost, 2)
+    config[name] = value
+    after = app_module.pipeline_key("traditional", cost, 2)
+    assert before != after
+    assert app_module.pipeline_key("traditional", cost, 2) == after
+
+
+def test_lru_evicts_least_recently_used():
+    """超出容量时淘汰最久未使用的条目，超过容量的单个条目不缓存"""
+    cache = LRUCache(10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa" and cache.get("c") == b"cccc"
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["bytes"] == 8 and stats["evictions"] == 1
+    cache.resize(4)
+    assert cache.stats()["entries"] == 1
+
+
+def test_disk_cache_persists_and_evicts(tmp_path):
+    """磁盘层在重建后保留条目，并按总大小淘汰最久未使用的条目"""
+    cache = DiskCache(str(tmp_path), 10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+    assert cache.get("b") is None
+    assert not (tmp_path / "b").exists()
+
+    reopened = DiskCache(str(tmp_path), 10)
+    assert reopened.get("a") == b"aaaa" and reopened.get("c") == b"cccc"
+    assert reopened.stats()["bytes"] == 8
+
+
+def test_result_cache_promotes_disk_hits(tmp_path):
+    """磁盘层命中的结果提升到内存层，重启后仍可从磁盘层读取"""
+    cache = ResultCache(100, str(tmp_path), 100)
+    cache.put("key", b"data")
+    restarted = ResultCache(100, str(tmp_path), 100)
+    assert restarted.memory.get("key") is None
+    assert restarted.get("key") == b"data"
+    assert restarted.memory.get("key") == b"data"
+    assert restarted.stats()["disk"]["hits"] == 1
+
+
+def test_result_cache_disabled():
+    """内存层容量为0且没有磁盘层时缓存关闭"""
+    cache = ResultCache(0)
+    assert not cache.enabled
+    cache.put("key", b"data")
+    assert cache.get("key") is None
+
+
+@pytest.mark.parametrize("base_cache_pixels, cached", [(96 * 64, True), (96 * 64 - 1, False), (0, False)])
+def test_upscaled_base_cache_limit(base_cache_pixels, cached):
+    """只有不超过 base_cache_pixels 的放大基础图放入图片缓存，结果与不缓存时相同"""
+    source = image_bytes()
+    image_cache = LRUCache(64 * 1024 * 1024, sizeof=image_nbytes)
+    image, _ = run_pipeline(source, "traditional", TiledEngine(), image_cache=image_cache,
+                            base_cache_pixels=base_cache_pixels)
+    keys = [key[0] for key in image_cache._entries]
+    assert ("upscaled" in keys) == cached
+    expected, _ = run_pipeline(source, "traditional", TiledEngine())
+    assert image.size == (96, 64) and image.tobytes() == expected.tobytes()
+
+
+def test_cost_counts_cached_base():
+    """准入估算包含会被缓存的放大基础图，每种放大倍数一张"""
+    cost = Cost(100, 80, [2, 2, 4], base_cache_pixels=100 * 80 * 4)
+    assert cost.base_pixels == 100 * 80 * 4
+    assert cost.working_pixels == cost.output_pixels + cost.base_pixels
+    assert Cost(100, 80, [2]).working_pixels == 100 * 80 * 4
+
+    controller = AdmissionController(0, 0, 0, base_cache_pixels=48 * 32 * 4)
+    planned = controller.plan(image_bytes(), [2])
+    assert planned.base_pixels == 48 * 32 * 4
+    assert planned.memory_bytes > Cost(48, 32, [2]).memory_bytes
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+输出编码测试：参数解析、目标大小搜索，以及接口中的格式协商和编码参数
+"""
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import data_url, decode_data_url, image_bytes
+from encoding import QUALITY_PRESETS, EncodeOptions, encode
+
+
+def noisy_image(width=160, height=120):
+    """噪声图片，编码大小随质量明显变化"""
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def test_from_params():
+    """格式别名、质量预设、目标大小和色度抽样"""
+    options = EncodeOptions.from_params({"format": "jpg", "quality": "small", "target_size": "20k",
+                                         "subsampling": "420", "progressive": "true"})
+    assert options.format == "JPEG" and options.quality == QUALITY_PRESETS["small"]
+    assert options.target_size == 20 * 1024 and options.subsampling == "4:2:0"
+    assert options.progressive and not options.optimize
+    assert EncodeOptions.from_params({}, "PNG").format == "PNG"
+
+
+@pytest.mark.parametrize("params", [{"format": "tiff"}, {"quality": "0"}, {"quality": "101"},
+                                    {"target_size": "-1"}, {"subsampling": "4:1:1"}])
+def test_invalid_params(params):
+    with pytest.raises(ValueError):
+        EncodeOptions.from_params(params)
+
+
+def test_key_ignores_lossy_params_for_png():
+    """缓存键只包含影响输出的参数"""
+    assert EncodeOptions("PNG", quality=50).key() == EncodeOptions("PNG", quality=90).key()
+    assert EncodeOptions("JPEG", quality=50).key() != EncodeOptions("JPEG", quality=90).key()
+
+
+def test_target_size_search():
+    """目标大小在质量范围内二分查找，结果不超过目标"""
+    image = noisy_image()
+    full, _ = encode(image, EncodeOptions("JPEG", 95))
+    target = len(full) // 2
+    data, stats = encode(image, EncodeOptions("JPEG", 95, target_size=target))
+    assert len(data) <= target and stats["target_met"]
+    assert stats["quality"] < 95 and stats["attempts"] > 1
+
+    data, stats = encode(image, EncodeOptions("JPEG", 95, target_size=100))
+    assert not stats["target_met"]
+
+
+@pytest.mark.parametrize("accept, mime", [("image/png", "image/png"), ("image/webp", "image/webp"),
+                                          ("image/jpeg", "image/jpeg")])
+def test_accept_negotiates_binary(client, accept, mime):
+    """Accept 为图片类型时返回该格式的二进制图片和编码统计头"""
+    _, response = client.post("/api/apply-filter", json={"image": data_url(image_bytes()), "filter": "warm"},
+                              headers={"Accept": accept})
+    assert response.status == 200
+    assert response.headers["content-type"] == mime
+    assert int(response.headers["X-Encoded-Bytes"]) == len(response.body)
+    assert Image.open(io.BytesIO(response.body)).size == (48, 32)
+
+
+def test_json_response_with_encoding_params(client):
+    """format、quality 参数覆盖默认编码，JSON响应带编码统计"""
+    _, response = client.post("/api/apply-filter?format=webp&quality=balanced",
+                              json={"image": data_url(image_bytes()), "filter": "cool"})
+    assert response.status == 200
+    assert response.json["filtered_image"].startswith("data:image/webp")
+    assert response.json["encoding"]["format"] == "WEBP"
+    assert response.json["encoding"]["quality"] == QUALITY_PRESETS["balanced"]
+    assert decode_data_url(response.json["filtered_image"]).format == "WEBP"
+
+
+def test_target_size_param(client):
+    """target_size 限制输出字节数"""
+    buffer = io.BytesIO()
+    noisy_image().save(buffer, "PNG")
+    _, response = client.post("/api/apply-filter", json={"image": data_url(buffer.getvalue()),
+                                                         "filter": "warm", "target_size": "8k"},
+                              headers={"Accept": "image/jpeg"})
+    assert response.status == 200
+    assert len(response.body) <= 8 * 1024
+
+
+def test_invalid_encoding_returns_400(client):
+    _, response = client.post("/api/apply-filter?format=tiff",
+                              json={"image": data_url(image_bytes()), "filter": "warm"})
+    assert response.status == 400
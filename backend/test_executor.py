@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+执行层测试：工作进程异常退出后的重建、守护进程中的线程池回退、工作进程随执行池启动，以及默认启动方式下实际使用的执行池
+"""
+
+import asyncio
+import base64
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+from PIL import Image
+
+# 添加当前目录到Python路径
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BACKEND_DIR)
+
+import executor as executor_module
+from executor import EnhancementExecutor, ExecutorError
+
+
+def crash():
+    # 等所有任务都提交到同一个执行池后再退出
+    time.sleep(0.2)
+    os._exit(1)
+
+
+def square(value):
+    return value * value
+
+
+def test_broken_pool_is_rebuilt_once():
+    """并发任务同时遇到工作进程退出时只重建一次执行池，并关闭损坏的执行池"""
+    pool = EnhancementExecutor("process", max_workers=2)
+    pool.start()
+    broken = pool._pool
+    starts = []
+    original_start = pool.start
+
+    def counting_start():
+        starts.append(1)
+        original_start()
+    pool.start = counting_start
+
+    async def scenario():
+        results = await asyncio.gather(*(pool.run(crash) for _ in range(4)), return_exceptions=True)
+        assert all(isinstance(result, ExecutorError) for result in results)
+        return await pool.run(square, 7)
+
+    try:
+        assert asyncio.run(scenario()) == 49
+        assert len(starts) == 1
+        assert pool._pool is not broken
+        assert broken._shutdown_thread
+    finally:
+        pool.shutdown()
+
+
+def test_daemon_process_falls_back_to_threads(monkeypatch):
+    """守护进程中配置的进程池改用线程池，并在状态中说明"""
+    class Daemon:
+        daemon = True
+    monkeypatch.setattr(executor_module.multiprocessing, "current_process", lambda: Daemon())
+    pool = EnhancementExecutor("process", max_workers=1)
+    pool.start()
+    try:
+        stats = pool.stats()
+        assert stats["kind"] == "thread" and stats["configured_kind"] == "process"
+        assert not stats["process_pool_active"] and stats["fallback_reason"]
+        assert asyncio.run(pool.run(square, 3)) == 9
+    finally:
+        pool.shutdown()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_process_workers_start_with_pool():
+    """工作进程在执行池启动时创建，而不是在第一个请求中"""
+    pool = EnhancementExecutor("process", max_workers=2)
+    pool.start()
+    try:
+        assert len(pool._pool._processes) == 2
+    finally:
+        pool.shutdown()
+
+
+def test_run_server_uses_process_pool(tmp_path):
+    """按 run_server 的默认方式启动服务时，POOL_KIND=process 实际使用进程池"""
+    port = free_port()
+    code = (f"import sys; sys.path.insert(0, {BACKEND_DIR!r}); import app; "
+            f"app.run_server(host='127.0.0.1', port={port})")
+    server = subprocess.Popen([sys.executable, "-c", code], cwd=tmp_path,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=2) as response:
+                    stats = json.load(response)["executor"]
+                break
+            except OSError:
+                assert server.poll() is None and time.monotonic() < deadline, "服务未能启动"
+                time.sleep(0.2)
+        assert stats["kind"] == "process" and stats["process_pool_active"]
+        assert stats["fallback_reason"] is None
+        # 工作进程不持有客户端连接：请求在进程池中处理后，服务端关闭连接时客户端收到EOF
+        buffer = io.BytesIO()
+        Image.new("RGB", (48, 32), (120, 160, 200)).save(buffer, "PNG")
+        image = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+        body = json.dumps({"image": image, "filter": "vintage"}).encode()
+        with socket.create_connection(("127.0.0.1", port), timeout=30) as sock:
+            sock.sendall(f"POST /api/apply-filter HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n"
+                         f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+            response = b""
+            while chunk := sock.recv(65536):
+                response += chunk
+        assert response.startswith(b"HTTP/1.1 200")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+方向修复测试：8种EXIF方向、输出文件不带服务端标记、客户端无法伪造已修复标记
+"""
+
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image, PngImagePlugin
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from encoding import EncodeOptions, encode
+from image_io import ORIENTATION_TAG, TRANSPOSED_ORIENTATIONS, fix_image_orientation, is_oriented, load_rgb
+
+
+def exif_bytes(orientation):
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = orientation
+    return exif.tobytes()
+
+
+def oriented_upload(orientation, fmt="JPEG", **params):
+    """40x20 的图片，带指定的EXIF方向"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 20), (200, 60, 30)).save(buffer, fmt, exif=exif_bytes(orientation), **params)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_all_orientations(orientation):
+    """8种方向都转为正向，方向 5-8 宽高互换"""
+    img = load_rgb(oriented_upload(orientation))
+    expected = (20, 40) if orientation in TRANSPOSED_ORIENTATIONS else (40, 20)
+    assert img.size == expected
+    assert is_oriented(img)
+
+
+@pytest.mark.parametrize("fmt", ["JPEG", "PNG", "WEBP"])
+def test_output_has_no_marker_or_orientation(fmt):
+    """输出文件不带已修复标记，也不带方向；回传时不会被再次旋转"""
+    img = load_rgb(oriented_upload(6))
+    data, _ = encode(img, EncodeOptions(fmt))
+    assert b"image-enhancer" not in data
+    reopened = Image.open(io.BytesIO(data))
+    assert not is_oriented(reopened)
+    assert fix_image_orientation(reopened).size == (20, 40)
+
+
+def test_forged_png_marker_is_ignored():
+    """客户端在PNG文本块中伪造标记时仍按EXIF修复方向"""
+    pnginfo = PngImagePlugin.PngInfo()
+    pnginfo.add_text("oriented", "1")
+    pnginfo.add_text("image-enhancer", "oriented")
+    img = load_rgb(oriented_upload(6, "PNG", pnginfo=pnginfo))
+    assert img.size == (20, 40)
+
+
+def test_forged_jpeg_comment_is_ignored():
+    """客户端在JPEG注释中伪造标记时仍按EXIF修复方向"""
+    img = load_rgb(oriented_upload(8, comment=b"image-enhancer:oriented"))
+    assert img.size == (20, 40)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分块批量推理测试：不同光环、块大小和批大小下与整幅推理一致，并发请求的块合并成批
+"""
+
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from inference import DEFAULT_HALO, TileInferenceEngine, max_difference_to_full
+from sr_model import SimpleSRNet
+
+# 块边界处的卷积按不同顺序累加，转换为 uint8 时可能相差1
+TOLERANCE = 1
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    return SimpleSRNet().eval()
+
+
+def random_image(width, height, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def make_engine(model, **options):
+    return TileInferenceEngine(model, torch.device("cpu"), scale_factor=model.scale_factor, **options)
+
+
+@pytest.mark.parametrize("size", [(37, 29), (53, 41)])
+@pytest.mark.parametrize("halo", [DEFAULT_HALO, DEFAULT_HALO + 4])
+@pytest.mark.parametrize("tile_size, max_batch", [(16, 1), (24, 4)])
+def test_tiled_matches_full(model, size, halo, tile_size, max_batch):
+    """光环不小于感受野时，奇数尺寸的图片分块、批量推理结果与整幅推理一致"""
+    engine = make_engine(model, tile_size=tile_size, halo=halo, max_batch=max_batch)
+    img = random_image(*size)
+    assert max_difference_to_full(engine, img) <= TOLERANCE
+    assert engine.infer(img).shape == (size[1] * 2, size[0] * 2, 3)
+
+
+def test_small_halo_shows_seams(model):
+    """光环小于感受野时块边界出现接缝，校验能够发现"""
+    engine = make_engine(model, tile_size=16, halo=2)
+    assert max_difference_to_full(engine, random_image(37, 29)) > TOLERANCE
+
+
+def test_concurrent_requests_share_batches(model):
+    """并发请求的同尺寸块合并成批，各请求的结果与单独推理相同"""
+    engine = make_engine(model, tile_size=16, max_batch=8, max_wait=0.05)
+    images = [random_image(32, 32, seed) for seed in range(4)]
+    expected = [make_engine(model, tile_size=16, max_batch=1).infer(img) for img in images]
+
+    results = [None] * len(images)
+
+    def run(index):
+        results[index] = engine.infer(images[index])
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(images))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for result, reference in zip(results, expected):
+        assert np.abs(result.astype(np.int16) - reference.astype(np.int16)).max() <= TOLERANCE
+    stats = engine.stats()
+    assert stats["tiles"] == 16 and stats["average_batch"] > 1
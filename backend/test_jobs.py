@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步任务队列测试：任务存储的所属进程清理、编码统计的保存，以及任务提交、轮询和结果接口
+"""
+
+import os
+import sqlite3
+import time
+
+import pytest
+
+from conftest import image_bytes
+from jobs import DONE, FAILED, QUEUED, RUNNING, MemoryJobStore, SQLiteJobStore, fail_unfinished_jobs
+
+ENCODING = {"format": "png", "bytes": 123, "encode_ms": 1.5}
+
+
+def make_job(job_id, owner, status=QUEUED):
+    return {"id": job_id, "method": "traditional", "lane": "fast", "status": status, "progress": 0.0,
+            "total": 1, "completed": 0, "error": None, "created_at": time.time(), "started_at": None,
+            "finished_at": None, "owner": owner}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryJobStore()
+    return SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_fail_unfinished_is_scoped_to_owners(store):
+    """只把指定进程的未结束任务标记为失败"""
+    store.create(make_job("mine", 1, RUNNING))
+    store.create(make_job("other", 2, RUNNING))
+    store.create(make_job("legacy", None))
+    assert store.unfinished_owners() == {1, 2, None}
+    store.fail_unfinished("中断", {1, None})
+    assert store.get("mine")["status"] == FAILED
+    assert store.get("legacy")["status"] == FAILED
+    assert store.get("other")["status"] == RUNNING
+
+
+def test_results_keep_encoding_stats(store):
+    """结果条目的编码统计与字节一起保存"""
+    store.create(make_job("job", 1))
+    store.save_results("job", [{"data": b"png", "error": None, "encoding": ENCODING},
+                               {"data": None, "error": "处理失败", "encoding": None}])
+    items = store.get_results("job")
+    assert items[0]["data"] == b"png" and items[0]["encoding"] == ENCODING
+    assert items[1]["error"] == "处理失败" and items[1]["encoding"] is None
+
+
+def test_startup_cleanup_fails_all_unfinished(tmp_path):
+    """服务启动时的清理把所有遗留任务标记为失败"""
+    path = str(tmp_path / "jobs.sqlite3")
+    store = SQLiteJobStore(path)
+    store.create(make_job("a", 1, RUNNING))
+    store.create(make_job("b", 2))
+    fail_unfinished_jobs("sqlite", path)
+    assert {store.get(job_id)["status"] for job_id in ("a", "b")} == {FAILED}
+
+
+def test_sqlite_store_upgrades_old_schema(tmp_path):
+    """旧版本的数据库文件补充所属进程和编码统计列"""
+    path = str(tmp_path / "jobs.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE jobs (id TEXT PRIMARY KEY, method TEXT, lane TEXT, status TEXT, progress REAL,
+                           total INTEGER, completed INTEGER, error TEXT, created_at REAL,
+                           started_at REAL, finished_at REAL);
+        CREATE TABLE job_results (job_id TEXT, idx INTEGER, data BLOB, error TEXT, PRIMARY KEY (job_id, idx));
+        INSERT INTO jobs (id, status) VALUES ('old', 'running');
+    """)
+    conn.close()
+    store = SQLiteJobStore(path)
+    assert store.unfinished_owners() == {None}
+    store.create(make_job("new", 1))
+    assert store.get("new")["owner"] == 1
+
+
+def test_worker_start_keeps_live_workers_jobs(app_module, tmp_path):
+    """工作进程启动时不影响其他存活进程的任务，只清理已退出进程的任务"""
+    path = str(tmp_path / "jobs.sqlite3")
+    app_module.app.config.update(JOB_STORE="sqlite", JOB_DB_PATH=path)
+    store = SQLiteJobStore(path)
+    # 测试运行器的父进程仍在运行；超出 pid_max 的进程ID不存在
+    store.create(make_job("live", os.getppid(), RUNNING))
+    store.create(make_job("dead", 2 ** 22 + 1, RUNNING))
+
+    from sanic_testing.reusable import ReusableClient
+    with ReusableClient(app_module.app) as client:
+        _, response = client.get("/api/jobs/live")
+        assert response.json["status"] == RUNNING
+        _, response = client.get("/api/jobs/dead")
+        assert response.json["status"] == FAILED
+
+
+def wait_for_job(client, job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        _, response = client.get(f"/api/jobs/{job_id}")
+        if response.json["status"] in (DONE, FAILED):
+            return response.json
+        time.sleep(0.05)
+    raise AssertionError(f"任务未在 {timeout} 秒内结束: {job_id}")
+
+
+@pytest.mark.parametrize("job_store", ["memory", "sqlite"])
+def test_job_lifecycle(app_module, tmp_path, job_store):
+    """提交任务返回202，轮询到完成后获取结果；两种存储都返回编码统计"""
+    app_module.app.config.update(JOB_STORE=job_store, JOB_DB_PATH=str(tmp_path / "jobs.sqlite3"))
+    from sanic_testing.reusable import ReusableClient
+    with ReusableClient(app_module.app) as client:
+        _, response = client.post("/api/jobs", files={"file": ("a.png", image_bytes(), "image/png")},
+                                  data={"method": "traditional"})
+        assert response.status == 202
+        assert response.json["status"] == "queued" and response.json["lane"] == "fast"
+        job = wait_for_job(client, response.json["job_id"])
+        assert job["status"] == DONE and job["completed"] == job["total"] == 1
+
+        _, response = client.get(f"/api/jobs/{job['job_id']}/result")
+        assert response.status == 200
+        result = response.json["results"][0]
+        assert result["success"] and result["enhanced_image"].startswith("data:image/")
+        assert result["encoding"]["bytes"] > 0
+
+        # 二进制结果带编码统计头
+        _, response = client.get(f"/api/jobs/{job['job_id']}/result", headers={"Accept": "image/png"})
+        assert response.status == 200
+        assert response.headers["content-type"] == "image/png"
+        assert int(response.headers["X-Encoded-Bytes"]) == len(response.body)
+
+
+def test_unknown_job_returns_404(client):
+    _, response = client.get("/api/jobs/missing")
+    assert response.status == 404
+    _, response = client.get("/api/jobs/missing/result")
+    assert response.status == 404
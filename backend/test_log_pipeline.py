@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步日志管线测试：按请求ID（crc32）采样、请求ID经队列和执行池传递，以及逐阶段日志级别
+"""
+
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import app as app_module
+from log_pipeline import (NO_REQUEST, STAGE_LOGGERS, LogPipeline, RequestContextFilter, request_context,
+                          run_with_request_id)
+
+
+class ListHandler(logging.Handler):
+    """把收到的记录保存在列表中"""
+
+    def __init__(self, records):
+        super().__init__()
+        self.records = records
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def pipeline():
+    """以 ListHandler 为输出的日志管线，结束后恢复根日志器和各模块的级别"""
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    saved_levels = {name: logging.getLogger(name).level for name in STAGE_LOGGERS}
+    records = []
+    log_pipeline = LogPipeline([ListHandler(records)])
+    log_pipeline.records = records
+    log_pipeline.start()
+    yield log_pipeline
+    log_pipeline.stop()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in saved_handlers:
+        root.addHandler(handler)
+    root.setLevel(saved_level)
+    for name, level in saved_levels.items():
+        logging.getLogger(name).setLevel(level)
+
+
+def make_record(level, request_id):
+    record = logging.LogRecord("test", level, __file__, 0, "message", None, None)
+    record.request_id = request_id
+    return record
+
+
+def test_sampling_by_request_id():
+    """同一请求ID的采样结果固定，保留比例接近 sample_rate，警告和无请求的记录始终保留"""
+    context_filter = RequestContextFilter(0.25)
+    ids = [f"req-{index}" for index in range(4000)]
+    kept = [request_id for request_id in ids if context_filter.sampled(request_id)]
+    assert 0.2 < len(kept) / len(ids) < 0.3
+    assert all(context_filter.sampled(request_id) for request_id in kept)
+
+    dropped = next(request_id for request_id in ids if request_id not in kept)
+    assert not context_filter.filter(make_record(logging.INFO, dropped))
+    assert context_filter.filter(make_record(logging.WARNING, dropped))
+    assert context_filter.filter(make_record(logging.INFO, NO_REQUEST))
+
+    assert not RequestContextFilter(0.0).sampled("req-1")
+    assert RequestContextFilter(1.0).sampled("req-1")
+
+
+def test_request_id_carried_through_queue(pipeline):
+    """记录在监听线程中写出时仍带有产生它的上下文的请求ID"""
+    logger = logging.getLogger("test_log_pipeline")
+    with request_context("req-a"):
+        logger.info("in request")
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            # 执行池线程不继承上下文，由 run_with_request_id 传递
+            pool.submit(run_with_request_id, "req-a", logger.info, "in pool").result()
+    logger.info("outside")
+    pipeline.stop()
+    messages = {record.getMessage(): record.request_id for record in pipeline.records}
+    assert messages == {"in request": "req-a", "in pool": "req-a", "outside": NO_REQUEST}
+
+
+def log_in_worker(message):
+    logging.getLogger("test_log_pipeline").info(message)
+    logging.getLogger("tiling").info(f"stage {message}")
+    return os.getpid()
+
+
+def test_process_pool_records_reach_main_process(pipeline):
+    """进程池工作进程的记录经 multiprocessing 队列交给主进程写出，带提交方的请求ID和逐阶段级别"""
+    pipeline.configure(stage_level="WARNING")
+    initializer, initargs = pipeline.worker_initializer()
+    with ProcessPoolExecutor(max_workers=1, initializer=initializer, initargs=initargs) as pool:
+        pid = pool.submit(run_with_request_id, "req-b", log_in_worker, "from worker").result()
+    pipeline.stop()
+    assert pid != os.getpid()
+    records = [record for record in pipeline.records if "from worker" in record.getMessage()]
+    assert [(record.getMessage(), record.request_id) for record in records] == [("from worker", "req-b")]
+
+
+def test_stage_level_covers_app_edits(pipeline):
+    """LOG_STAGE_LEVEL 同样控制服务中滤镜和调整的逐阶段日志"""
+    pipeline.configure(stage_level="WARNING")
+    for name in ("tiling", "app.edits"):
+        assert not logging.getLogger(name).isEnabledFor(logging.INFO)
+    image = Image.new("RGB", (8, 8), (120, 160, 200))
+    app_module.apply_adjustments(image, {"brightness": 1.2})
+    pipeline.configure(stage_level="INFO")
+    app_module.apply_adjustments(image, {"contrast": 1.1})
+    pipeline.stop()
+    messages = [record.getMessage() for record in pipeline.records]
+    assert not any("亮度调整" in message for message in messages)
+    assert any("对比度调整" in message for message in messages)
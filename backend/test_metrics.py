@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标测试：Prometheus 文本格式（直方图桶、_sum/_count、标签转义）、
+执行池中收集的样本写回主进程，以及 /metrics 接口
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import metrics
+from conftest import data_url, image_bytes
+
+
+@pytest.fixture
+def registered():
+    """测试中创建的指标在结束后从全局注册表移除"""
+    before = list(metrics._metrics)
+    yield
+    metrics._metrics[:] = before
+
+
+def sample_value(text, line_prefix):
+    """渲染结果中以 line_prefix 开头的样本值"""
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"没有样本: {line_prefix}")
+
+
+def test_histogram_rendering(registered):
+    """桶计数累计，最后一个桶为 +Inf，_sum/_count 按标签输出"""
+    histogram = metrics.Histogram("test_seconds", "测试耗时", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "decode")
+    assert histogram.render() == [
+        "# HELP test_seconds 测试耗时",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="decode",le="0.1"} 2',
+        'test_seconds_bucket{stage="decode",le="1"} 3',
+        'test_seconds_bucket{stage="decode",le="+Inf"} 4',
+        'test_seconds_sum{stage="decode"} 3.65',
+        'test_seconds_count{stage="decode"} 4',
+    ]
+
+
+def test_counter_gauge_and_label_escaping(registered):
+    """标签值中的反斜杠、引号和换行被转义，无标签的指标不输出花括号"""
+    counter = metrics.Counter("test_total", "测试计数", ("route",))
+    counter.inc('/a\\b"c\nd')
+    counter.inc('/a\\b"c\nd', amount=2)
+    assert counter.render()[-1] == 'test_total{route="/a\\\\b\\"c\\nd"} 3'
+
+    gauge = metrics.Gauge("test_gauge", "测试仪表")
+    gauge.inc(amount=5)
+    gauge.dec(amount=2)
+    assert gauge.render()[-1] == "test_gauge 3"
+    gauge.set(1.5)
+    assert gauge.render()[-1] == "test_gauge 1.5"
+
+    with pytest.raises(ValueError):
+        counter.inc()
+    assert "# TYPE test_gauge gauge" in metrics.render()
+
+
+def timed_stage(seconds):
+    """在执行池中运行：记录一个阶段耗时"""
+    with metrics.operation("pool-test"):
+        with metrics.span("sleep"):
+            time.sleep(seconds)
+    return os.getpid()
+
+
+def test_record_samples_from_pool_workers():
+    """进程池中 collect 收集的样本随结果返回，由 record_samples 写入主进程的直方图"""
+    prefix = 'image_stage_seconds_count{operation="pool-test",stage="sleep"}'
+    before = sample_value(metrics.render(), prefix) if prefix in metrics.render() else 0
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        results = list(pool.map(metrics.collect, [timed_stage] * 3, [0.01] * 3))
+    for pid, samples in results:
+        assert pid != os.getpid()
+        assert [(operation, stage) for operation, stage, _ in samples] == [("pool-test", "sleep")]
+        metrics.record_samples(samples)
+    text = metrics.render()
+    assert sample_value(text, prefix) == before + 3
+    assert sample_value(text, 'image_stage_seconds_sum{operation="pool-test",stage="sleep"}') >= 0.03
+
+
+def test_metrics_endpoint(client):
+    """/metrics 返回 Prometheus 文本格式，包含请求计数和滤镜阶段耗时"""
+    _, response = client.post("/api/apply-filter", json={"image": data_url(image_bytes()), "filter": "vintage"})
+    assert response.status == 200
+    _, response = client.get("/metrics")
+    assert response.status == 200
+    assert response.headers["content-type"] == metrics.CONTENT_TYPE
+    text = response.text
+    assert 'http_requests_total{route="/api/apply-filter",method="POST",status="200"}' in text
+    assert sample_value(text, 'image_stage_seconds_count{operation="filter",stage="filter:vintage"}') >= 1
+    assert "# TYPE executor_pending_tasks gauge" in text
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模型注册表测试：首次使用时加载并在进程内共享、预热，以及权重文件的保存和 mmap 共享
+"""
+
+import logging
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+# 添加当前目录到Python路径
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BACKEND_DIR)
+
+import model_registry
+
+
+@pytest.fixture(autouse=True)
+def empty_registry(monkeypatch):
+    """每个测试使用空的注册表和默认配置"""
+    monkeypatch.setattr(model_registry, "_models", {})
+    monkeypatch.setattr(model_registry, "_defaults", {"backend": "eager", "weights_path": None})
+
+
+def test_importing_app_does_not_load_torch(tmp_path):
+    """服务启动（导入应用）时不导入 torch，模型在首次AI请求时才加载"""
+    code = f"import sys; sys.path.insert(0, {BACKEND_DIR!r}); import app; print('torch' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, capture_output=True, text=True, check=True)
+    assert output.stdout.strip().splitlines()[-1] == "False"
+
+
+def test_get_model_loads_once(monkeypatch):
+    """并发的首次调用只加载一次，之后返回同一个模型"""
+    loads = []
+    create_model = model_registry._create_model
+
+    def counting_create():
+        loads.append(1)
+        return create_model()
+    monkeypatch.setattr(model_registry, "_create_model", counting_create)
+
+    entries = []
+    threads = [threading.Thread(target=lambda: entries.append(model_registry.get_model())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert all(entry is entries[0] for entry in entries)
+    assert model_registry.get_model("eager") is entries[0]
+    assert [model["backend"] for model in model_registry.stats()["models"]] == ["eager"]
+
+
+def test_seeded_init_is_identical_across_loads(monkeypatch):
+    """没有权重文件时各次加载的权重相同，且不改变全局随机数状态"""
+    torch.manual_seed(123)
+    expected = torch.rand(1)
+    torch.manual_seed(123)
+    model_registry._create_model()
+    assert torch.equal(torch.rand(1), expected)
+
+    first = model_registry.get_model().model.state_dict()
+
+    monkeypatch.setattr(model_registry, "_models", {})
+    second = model_registry.get_model().model.state_dict()
+    assert all(torch.equal(first[name], second[name]) for name in first)
+
+
+def test_warm_up_runs_inference():
+    entry = model_registry.warm_up()
+    assert entry is model_registry.get_model()
+    assert entry.inference.stats()["tiles"] >= 1
+
+
+def test_weights_file_is_shared_without_copies(tmp_path, monkeypatch):
+    """首次加载保存 channels_last 布局的权重，eager 后端直接使用 mmap 加载的张量而不复制"""
+    path = str(tmp_path / "models" / "weights.pt")
+    loaded = []
+    load = torch.load
+
+    def capturing_load(*args, **kwargs):
+        state = load(*args, **kwargs)
+        loaded.append(state)
+        return state
+    monkeypatch.setattr(torch, "load", capturing_load)
+
+    entry = model_registry.get_model(weights_path=path)
+    assert os.path.exists(path)
+    state = loaded[-1]
+    for name, param in entry.model.named_parameters():
+        if param.dim() == 4:
+            assert param.is_contiguous(memory_format=torch.channels_last)
+        assert param.data_ptr() == state[name].data_ptr(), name
+
+
+def test_contiguous_weights_file_warns(tmp_path, caplog):
+    """旧版本保存的连续布局权重文件加载时记录警告"""
+    path = str(tmp_path / "weights.pt")
+    torch.save(model_registry._create_model().state_dict(), path)
+    with caplog.at_level(logging.WARNING, logger="model_registry"):
+        model_registry.get_model(weights_path=path)
+    assert "channels_last" in caplog.text
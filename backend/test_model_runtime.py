@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SimpleSRNet 推理运行时测试：各后端能够构建并通过与 eager 的一致性校验
+"""
+
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from model_runtime import BACKENDS, DEFAULT_TOLERANCES, build_runtime, parity_check
+from sr_model import SimpleSRNet
+
+
+def make_model():
+    torch.manual_seed(0)
+    return SimpleSRNet().eval()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backend_builds_and_passes_parity(backend):
+    """每个后端都能构建，输出与 eager 的差异在容差内"""
+    if backend == "onnx":
+        pytest.importorskip("onnxruntime")
+    model = make_model()
+    reference = make_model()
+    runtime = build_runtime(model, backend)
+    assert runtime.backend == backend
+    assert parity_check(runtime, reference) <= DEFAULT_TOLERANCES[backend]
+
+    # 批次和空间尺寸可变
+    output = runtime(torch.rand(1, 3, 40, 56))
+    assert tuple(output.shape) == (1, 3, 80, 112)
+
+
+@pytest.mark.parametrize("backend", ["int8", "unknown"])
+def test_unknown_backend_falls_back_to_eager(backend):
+    """未知后端（包括不提供的 int8）回退到 eager"""
+    assert build_runtime(make_model(), backend).backend == "eager"
+
+
+def test_parity_failure_falls_back_to_eager():
+    """与 eager 的差异超出容差时回退到 eager"""
+    runtime = build_runtime(make_model(), "torchscript", tolerance=-1)
+    assert runtime.backend == "eager"
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增强管线测试：多种方法共享解码、放大和公共前缀阶段，且各方法结果与单独执行时相同
+"""
+
+import io
+import os
+import sys
+
+import pytest
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pipeline as pipeline_module
+from conftest import image_bytes
+from pipeline import PIPELINES, _common_prefix, get_pipeline, run_pipeline, run_pipelines
+from tiling import TiledEngine
+
+METHODS = ["traditional", "advanced", "super_quality", "super_clear"]
+
+
+class RecordingEngine(TiledEngine):
+    """记录每次 run 的放大倍数和阶段"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def run(self, source, scale, stages, *args, **kwargs):
+        self.calls.append((source.size, scale, [stage.key for stage in stages]))
+        return super().run(source, scale, stages, *args, **kwargs)
+
+
+def test_common_prefix():
+    stages = [PIPELINES[method].stages for method in ("advanced", "quality_basic")]
+    length = _common_prefix(stages)
+    assert length == 1
+    assert [stage.key for stage in stages[0][:length]] == [stage.key for stage in stages[1][:length]]
+    assert _common_prefix([PIPELINES["traditional"].stages, PIPELINES["advanced"].stages]) == 1
+    assert _common_prefix([PIPELINES["traditional"].stages]) == len(PIPELINES["traditional"].stages)
+
+
+def test_shared_prefix_runs_once(monkeypatch):
+    """同一放大倍数的方法只解码和放大一次，公共前缀只执行一次，之后各自以1倍执行剩余阶段"""
+    decodes = []
+    load_rgb = pipeline_module.load_rgb
+
+    def counting_load(*args, **kwargs):
+        decodes.append(1)
+        return load_rgb(*args, **kwargs)
+    monkeypatch.setattr(pipeline_module, "load_rgb", counting_load)
+
+    engine = RecordingEngine()
+    results = run_pipelines(io.BytesIO(image_bytes()), METHODS, engine)
+    assert len(decodes) == 1
+    assert sorted(results) == sorted(METHODS)
+
+    upscales = [call for call in engine.calls if call[1] != 1]
+    # 2倍的三种方法共享一次放大和公共前缀，5倍的方法单独执行
+    assert sorted(scale for _, scale, _ in upscales) == [2, 5]
+    shared = next(call for call in upscales if call[1] == 2)
+    assert shared[2] == [stage.key for stage in PIPELINES["traditional"].stages[:1]]
+    rest = [call for call in engine.calls if call[1] == 1]
+    assert len(rest) == 3 and all(size == (96, 64) for size, _, _ in rest)
+
+
+def test_identical_stages_run_once():
+    """阶段完全相同的方法（advanced 和 super_quality）只执行一次，共享同一结果"""
+    assert _common_prefix([PIPELINES["advanced"].stages, PIPELINES["super_quality"].stages]) == \
+        len(PIPELINES["advanced"].stages)
+    engine = RecordingEngine()
+    results = run_pipelines(io.BytesIO(image_bytes()), ["advanced", "super_quality"], engine)
+    assert len(engine.calls) == 1
+    assert results["advanced"][0] is results["super_quality"][0]
+
+
+@pytest.mark.parametrize("budget", [None, 16 * 1024])
+def test_shared_results_match_independent_runs(budget):
+    """共享前缀得到的每种方法的结果与单独执行该方法完全相同（整幅或分块）"""
+    source = image_bytes(64, 48)
+    options = {} if budget is None else {"memory_budget": budget}
+    results = run_pipelines(io.BytesIO(source), METHODS, TiledEngine(**options))
+    for method in METHODS:
+        expected, _ = run_pipeline(io.BytesIO(source), method, TiledEngine(**options))
+        image, timings = results[method]
+        scale = get_pipeline(method).scale_factor
+        assert image.size == (64 * scale, 48 * scale)
+        assert image.tobytes() == expected.tobytes(), method
+        assert timings
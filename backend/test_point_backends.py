@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+逐像素颜色阶段和重复锐化的后端一致性测试
+
+以原有PIL链的结果为基准，比较 fused 和 opencv 后端在确定性合成图片上的逐像素差异。
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fused import apply_point_stages, apply_repeated_filter, max_difference, repeated_kernel, filter_kernel
+from pipeline import PIPELINES
+from tiling import BrightnessStage, ColorStage, ContrastStage, GrayscaleStage, TiledEngine
+
+# 与滤镜预设相同形式的阶段链
+CHAINS = {
+    "blackwhite": [GrayscaleStage()],
+    "vintage": [ColorStage(0.7), ContrastStage(1.3), BrightnessStage(0.9)],
+    "film": [ColorStage(0.8), ContrastStage(1.2)],
+    "fresh": [ColorStage(1.3), BrightnessStage(1.1)],
+    "hdr": [ContrastStage(1.5), ColorStage(1.2)],
+    "warm": [ColorStage(1.4)],
+    "cool": [ColorStage(0.6)],
+    "adjust": [BrightnessStage(1.2), ContrastStage(0.8), ColorStage(1.5)],
+}
+
+# 融合计算与逐阶段取整的差异上限
+POINT_TOLERANCE = 2
+
+
+def golden_image(width=320, height=240, noise=3.0):
+    """确定性的合成图片：渐变 + 纹理 + 少量噪声，经过轻微模糊接近照片"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x / width * 255, y / height * 255, 128 + 60 * np.sin(x / 25) * np.cos(y / 30)], -1)
+    arr = np.clip(base + rng.normal(0, noise, base.shape), 0, 255).astype(np.uint8)
+    return Image.fromarray(arr).filter(ImageFilter.GaussianBlur(1.5))
+
+
+@pytest.mark.parametrize("name", sorted(CHAINS))
+@pytest.mark.parametrize("backend", ["fused", "opencv"])
+def test_point_backend_matches_pil(name, backend):
+    """各后端的颜色阶段链与PIL链的差异在容差内"""
+    image = golden_image()
+    reference = apply_point_stages(image, CHAINS[name], backend="pil")
+    result = apply_point_stages(image, CHAINS[name], backend=backend)
+    assert result.size == reference.size and result.mode == "RGB"
+    assert max_difference(result, reference) <= POINT_TOLERANCE
+
+
+def test_lut_chain_is_exact():
+    """只含亮度、对比度的阶段链合并为查找表，与PIL链逐位一致"""
+    image = golden_image()
+    stages = [ContrastStage(1.3), BrightnessStage(0.9), ContrastStage(1.1)]
+    reference = apply_point_stages(image, stages, backend="pil")
+    assert max_difference(apply_point_stages(image, stages), reference) == 0
+
+
+def test_verify_mode_falls_back_to_pil():
+    """校验模式下差异超出容差时返回PIL链的结果"""
+    image = golden_image()
+    stages = CHAINS["vintage"]
+    reference = apply_point_stages(image, stages, backend="pil")
+    result = apply_point_stages(image, stages, verify_tolerance=-1)
+    assert max_difference(result, reference) == 0
+
+def test_repeated_kernel_is_normalized():
+    """合并后的卷积核尺寸为 2*passes+1，权重和保持为1"""
+    kernel = filter_kernel(ImageFilter.SHARPEN)
+    assert np.allclose(repeated_kernel(kernel, 1), kernel)
+    for passes in (2, 3):
+        combined = repeated_kernel(kernel, passes)
+        assert combined.shape == (2 * passes + 1, 2 * passes + 1)
+        assert combined.sum() == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("passes, tolerance", [(1, 1), (2, 2)])
+def test_repeated_sharpen_matches_pil(passes, tolerance):
+    """合并为单个卷积核的锐化与逐次 SHARPEN 的差异在容差内，最外一圈像素不变"""
+    image = golden_image()
+    reference = apply_repeated_filter(image, ImageFilter.SHARPEN, passes, backend="pil")
+    result = apply_repeated_filter(image, ImageFilter.SHARPEN, passes, backend="opencv")
+    assert max_difference(result, reference) <= tolerance
+    assert np.array_equal(np.asarray(result)[0], np.asarray(image)[0])
+
+
+@pytest.mark.parametrize("method", sorted(PIPELINES))
+@pytest.mark.parametrize("backend", ["fused", "opencv"])
+def test_pipeline_output_matches_pil(method, backend):
+    """卷积之前的颜色阶段组不放大融合误差：各方法最终结果与PIL链的差异在容差内"""
+    pipeline = PIPELINES[method]
+    image = golden_image(96, 72)
+    reference = TiledEngine(point_backend="pil").run(image, pipeline.scale_factor, pipeline.stages)
+    result = TiledEngine(point_backend=backend).run(image, pipeline.scale_factor, pipeline.stages)
+    assert max_difference(result, reference) <= POINT_TOLERANCE
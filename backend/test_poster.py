@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+海报合成测试：布局、逐单元格合成，以及海报接口的两种合成方式和图片引用
+"""
+
+import io
+
+import pytest
+from PIL import Image
+
+from conftest import data_url, image_bytes
+from poster import BACKGROUND, PosterLayout, render_poster
+
+COLORS = [(220, 40, 40), (40, 200, 60), (30, 60, 210), (240, 200, 20), (150, 30, 160)]
+
+
+def solid(color, fmt="PNG", size=(60, 40)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def cell_center(poster, layout, index):
+    x, y = layout.position(index)
+    return poster.getpixel((x + layout.cell_size // 2, y + layout.cell_size // 2))
+
+
+def assert_close(actual, expected, tolerance=8):
+    assert all(abs(a - b) <= tolerance for a, b in zip(actual, expected)), (actual, expected)
+
+
+@pytest.mark.parametrize("layout, columns, size", [
+    ("grid", 3, (3 * 120, 2 * 120)),
+    ("grid", 10, (5 * 120, 120)),
+    ("horizontal", 3, (5 * 120, 120)),
+    ("unknown", 2, (2 * 120, 3 * 120)),
+])
+def test_layout_size(layout, columns, size):
+    """网格按列数换行，单行布局排成一行，未知布局按网格处理"""
+    assert PosterLayout(5, layout, columns, cell_size=100, padding=10).size == size
+
+
+def test_render_poster_places_cells():
+    """每张图片粘贴到对应单元格，失败的图片留空"""
+    layout = PosterLayout(len(COLORS), "grid", 2, cell_size=32, padding=4)
+    sources = [solid(color) for color in COLORS]
+    sources[3] = b"not an image"
+    poster, placed = render_poster(sources, layout)
+    assert poster.size == layout.size and placed == len(COLORS) - 1
+    for index, color in enumerate(COLORS):
+        expected = BACKGROUND if index == 3 else color
+        assert_close(cell_center(poster, layout, index), expected)
+
+
+@pytest.mark.parametrize("concurrency", [0, 2])
+def test_poster_endpoint(client, app_module, concurrency):
+    """逐行合成和分散到执行池的逐单元格合成结果相同"""
+    app_module.app.config.POSTER_CELL_CONCURRENCY = concurrency
+    images = [data_url(solid(color, "JPEG"), "image/jpeg") for color in COLORS]
+    _, response = client.post("/api/generate-poster", json={"images": images, "layout": "grid", "columns": 3,
+                                                            "cell_size": 40},
+                              headers={"Accept": "image/png"})
+    assert response.status == 200
+    poster = Image.open(io.BytesIO(response.body))
+    layout = PosterLayout(len(COLORS), "grid", 3, 40, app_module.app.config.POSTER_CELL_PADDING)
+    assert poster.size == layout.size
+    for index, color in enumerate(COLORS):
+        assert_close(cell_center(poster, layout, index), color)
+
+
+def test_poster_from_preview_session(client):
+    """image_ids 引用的预览会话排在上传的图片之后"""
+    _, response = client.post("/api/preview", json={"image": data_url(solid(COLORS[2]))})
+    session_id = response.json["session_id"]
+    _, response = client.post("/api/generate-poster", json={"images": [data_url(solid(COLORS[0]))],
+                                                            "image_ids": [session_id], "layout": "horizontal"})
+    assert response.status == 200
+    assert response.json["layout"]["columns"] == 2 and response.json["layout"]["rows"] == 1
+
+
+def test_poster_errors(client, app_module):
+    """没有图片返回400，引用不存在的ID返回404，画布超出输出像素上限返回413"""
+    _, response = client.post("/api/generate-poster", json={})
+    assert response.status == 400
+    _, response = client.post("/api/generate-poster", json={"image_ids": ["missing"]})
+    assert response.status == 404
+    app_module.app.config.MAX_OUTPUT_PIXELS = 1000
+    _, response = client.post("/api/generate-poster", json={"images": [data_url(image_bytes())]})
+    assert response.status == 413
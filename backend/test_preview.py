@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+预览会话接口测试：创建会话、在代理图上渲染、全分辨率导出和关闭会话
+"""
+
+import io
+
+from PIL import Image
+
+from conftest import data_url, decode_data_url, image_bytes
+
+
+def create_session(client, width=400, height=300, max_edge=100):
+    _, response = client.post("/api/preview", json={"image": data_url(image_bytes(width, height)),
+                                                    "max_edge": max_edge})
+    assert response.status == 200
+    return response.json
+
+
+def test_create_session_returns_proxy(client):
+    """创建会话返回原图尺寸和按视口缩小的代理图"""
+    session = create_session(client)
+    assert (session["width"], session["height"]) == (400, 300)
+    assert (session["preview_width"], session["preview_height"]) == (100, 75)
+    assert decode_data_url(session["preview_image"]).size == (100, 75)
+    assert session["encoding"]["format"] == "JPEG"
+
+
+def test_render_on_proxy(client):
+    """滤镜和调整作用于代理图，二进制响应带渲染耗时头"""
+    session = create_session(client)
+    url = f"/api/preview/{session['session_id']}/render"
+    _, response = client.post(url, json={"filter": "vintage", "adjustments": {"brightness": 1.2}})
+    assert response.status == 200
+    assert decode_data_url(response.json["preview_image"]).size == (100, 75)
+
+    _, response = client.post(url, json={"filter": "warm"}, headers={"Accept": "image/jpeg"})
+    assert response.status == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert "X-Render-Ms" in response.headers
+    assert Image.open(io.BytesIO(response.body)).size == (100, 75)
+
+
+def test_export_renders_full_resolution(client):
+    """导出按相同的编辑参数渲染全分辨率结果"""
+    session = create_session(client)
+    _, response = client.post(f"/api/preview/{session['session_id']}/export",
+                              json={"filter": "cool", "adjustments": {"contrast": 1.1}},
+                              headers={"Accept": "image/png"})
+    assert response.status == 200
+    assert response.headers["content-type"] == "image/png"
+    assert Image.open(io.BytesIO(response.body)).size == (400, 300)
+
+
+def test_invalid_requests(client):
+    """缺少图片、调整参数无效和不存在的会话"""
+    _, response = client.post("/api/preview", json={})
+    assert response.status == 400
+    session = create_session(client)
+    _, response = client.post(f"/api/preview/{session['session_id']}/render",
+                              json={"adjustments": {"brightness": "bright"}})
+    assert response.status == 400
+    _, response = client.post("/api/preview/missing/render", json={})
+    assert response.status == 404
+
+
+def test_delete_session(client):
+    """关闭会话后渲染和导出返回404"""
+    session = create_session(client)
+    _, response = client.delete(f"/api/preview/{session['session_id']}")
+    assert response.status == 200
+    _, response = client.post(f"/api/preview/{session['session_id']}/export", json={})
+    assert response.status == 404
+    _, response = client.delete(f"/api/preview/{session['session_id']}")
+    assert response.status == 404
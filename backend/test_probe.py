@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文件头探测和缩小解码测试：probe 不解码像素，load_reduced 对 JPEG 使用 draft 并返回修复方向后的尺寸
+"""
+
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image, ImageFile
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from image_io import ORIENTATION_TAG, load_reduced, probe
+
+
+def encoded(size=(800, 600), fmt="JPEG", orientation=None):
+    img = Image.new("RGB", size, (90, 140, 200))
+    for x in range(0, size[0], 7):
+        img.putpixel((x, x % size[1]), (255, 255, 0))
+    params = {}
+    if orientation:
+        exif = Image.Exif()
+        exif[ORIENTATION_TAG] = orientation
+        params["exif"] = exif.tobytes()
+    buffer = io.BytesIO()
+    img.save(buffer, fmt, **params)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("fmt", ["JPEG", "PNG"])
+def test_probe_reads_header_only(fmt, monkeypatch):
+    """probe 只读取文件头：像素解码被禁止、文件被截断时仍能得到尺寸和格式"""
+    def no_decode(self):
+        raise AssertionError("probe 不应解码像素")
+    monkeypatch.setattr(ImageFile.ImageFile, "load", no_decode)
+    data = encoded(fmt=fmt)
+    for source in (data, data[:1024]):
+        info = probe(source)
+        assert (info.size, info.format, info.pixels) == ((800, 600), fmt, 800 * 600)
+
+
+def test_probe_reports_oriented_size():
+    info = probe(encoded((800, 400), orientation=6))
+    assert info.orientation == 6
+    assert info.size == (800, 400) and info.oriented_size == (400, 800)
+
+
+@pytest.mark.parametrize("target, expected", [((100, 75), (100, 75)), ((200, 150), (200, 150)),
+                                              ((300, 225), (400, 300)), ((700, 500), (800, 600))])
+def test_load_reduced_uses_jpeg_draft(target, expected):
+    """JPEG 按 1/2、1/4、1/8 在解码时缩小，结果不小于目标尺寸"""
+    img = load_reduced(encoded(), target, reducing_gap=1.0)
+    assert img.size == expected
+
+
+def test_load_reduced_keeps_gap():
+    """reducing_gap 要求解码结果不小于目标尺寸的相应倍数"""
+    assert load_reduced(encoded(), (100, 75), reducing_gap=2.0).size == (200, 150)
+
+
+@pytest.mark.parametrize("orientation", [1, 3, 6, 8])
+def test_load_reduced_orients(orientation):
+    """需要的尺寸按修复方向后计算，转置的方向在 draft 前交换宽高"""
+    transposed = orientation in (6, 8)
+    target = (50, 100) if transposed else (100, 50)
+    img = load_reduced(encoded((800, 400), orientation=orientation), target, reducing_gap=1.0)
+    assert img.size == target
+
+
+def test_load_reduced_decodes_other_formats_fully():
+    assert load_reduced(encoded(fmt="PNG"), (100, 75)).size == (800, 600)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+组合处理接口测试：/api/process 一次完成增强、滤镜和调整，参数无效返回400，图片过大返回413
+"""
+
+import io
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from conftest import data_url, decode_data_url, image_bytes
+
+# 合并后的颜色阶段只在最后取整，与逐步处理相比每个阶段可能相差1
+TOLERANCE = 4
+ADJUSTMENTS = {"brightness": 1.2, "contrast": 0.9, "saturation": 1.1}
+
+
+def post_process(client, payload=None, **kwargs):
+    body = {"image": data_url(image_bytes()), "method": "traditional", "filter": "vintage",
+            "adjustments": ADJUSTMENTS, "format": "png"}
+    body.update(payload or {})
+    return client.post("/api/process", json=body, **kwargs)[1]
+
+
+def test_process_json(client, app_module):
+    """一次请求返回增强、滤镜和调整后的图片，与逐步处理（不经中间编码）的结果一致"""
+    response = post_process(client)
+    assert response.status == 200
+    body = response.json
+    assert body["success"] and body["scale_factor"] == 2
+    assert (body["method"], body["filter"], body["adjustments"]) == ("traditional", "vintage", ADJUSTMENTS)
+    img = decode_data_url(body["processed_image"]).convert("RGB")
+    assert img.size == (96, 64)
+
+    enhanced = app_module.enhance_with_pipeline(image_bytes(), "traditional")
+    expected = app_module.apply_adjustments(app_module.apply_filter(enhanced, "vintage"), ADJUSTMENTS)
+    difference = np.abs(np.asarray(img, np.int16) - np.asarray(expected.convert("RGB"), np.int16))
+    assert difference.max() <= TOLERANCE
+
+
+def test_process_binary_and_form(client):
+    """协商为图片时直接返回图片字节，表单中的调整参数可以是单独的字段"""
+    _, response = client.post("/api/process", headers={"Accept": "image/png"},
+                              files={"image": ("a.png", image_bytes(), "image/png")},
+                              data={"method": "traditional", "brightness": "1.2"})
+    assert response.status == 200
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["X-Scale-Factor"] == "2"
+    assert Image.open(io.BytesIO(response.body)).size == (96, 64)
+
+
+def test_process_invalid_payloads(client):
+    """缺少图片、图片无法识别、调整参数或编码参数无效时返回400"""
+    _, response = client.post("/api/process", json={"method": "traditional"})
+    assert response.status == 400
+    for payload in ({"image": "no-comma"}, {"image": "data:image/png;base64,bm90IGFuIGltYWdl"},
+                    {"adjustments": "{not json"}, {"adjustments": {"brightness": "bright"}},
+                    {"quality": 101}, {"format": "bmp"}):
+        response = post_process(client, payload)
+        assert response.status == 400, payload
+        assert "error" in response.json
+
+
+def test_process_too_large(client, app_module):
+    """输入像素超出上限、或输出超出上限且不允许降级时返回413"""
+    admission = app_module.app.ctx.admission
+    admission.max_input_pixels = 48 * 32 - 1
+    assert post_process(client).status == 413
+
+    admission.max_input_pixels = 0
+    admission.max_output_pixels = 48 * 32 * 3
+    admission.auto_downgrade = False
+    assert post_process(client).status == 413
+    assert admission.stats()["rejected"] == 2
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+结果金字塔测试：级别尺寸、按总大小淘汰，以及上传时保存结果、按句柄和级别编辑（大级别走准入控制）、释放句柄的接口
+"""
+
+import io
+
+import pytest
+from PIL import Image
+
+from conftest import data_url, image_bytes
+from preview import PreviewStore
+from pyramid import create_pyramid
+
+
+def test_levels_halve_down_to_min_edge():
+    """每级长宽减半，最小一级的长边不小于64像素"""
+    pyramid = create_pyramid(image_bytes(1000, 600), max_levels=6)
+    assert pyramid.levels == 4
+    assert [pyramid.level_size(level) for level in range(4)] == [(1000, 600), (500, 300), (250, 150), (125, 75)]
+    assert pyramid.level_for_edge(300) == 1
+    assert pyramid.level_for_edge(200) == 2
+    assert pyramid.level_for_edge(5000) == 0
+    assert pyramid.image(2).size == (250, 150)
+    with pytest.raises(ValueError):
+        pyramid.check_level(4)
+
+
+def test_upload_keeps_result_handle(client):
+    """上传增强时 keep=true 保存结果金字塔，响应带句柄"""
+    _, response = client.post("/api/upload", files={"file": ("a.png", image_bytes(), "image/png")},
+                              data={"method": "traditional", "keep": "true"})
+    assert response.status == 200
+    pyramid = response.json["pyramid"]
+    assert (pyramid["width"], pyramid["height"]) == (96, 64)
+
+    _, response = client.get(f"/api/pyramids/{pyramid['handle']}")
+    assert response.status == 200 and response.json["handle"] == pyramid["handle"]
+
+
+def test_edit_by_handle_and_level(client):
+    """调整和滤镜以句柄引用结果，缩小级别只处理缩小后的像素"""
+    _, response = client.post("/api/pyramids", json={"image": data_url(image_bytes(512, 256))})
+    assert response.status == 200
+    handle = response.json["handle"]
+    assert [level["width"] for level in response.json["levels"]] == [512, 256, 128, 64]
+
+    _, response = client.post("/api/adjust-image", json={"handle": handle, "level": 1,
+                                                         "adjustments": {"brightness": 1.2}},
+                              headers={"Accept": "image/png"})
+    assert response.status == 200
+    assert Image.open(io.BytesIO(response.body)).size == (256, 128)
+
+    _, response = client.post("/api/apply-filter", json={"handle": handle, "max_edge": 100, "filter": "warm"})
+    assert response.status == 200 and response.json["level"] == 2
+
+    _, response = client.post("/api/apply-filter", json={"handle": handle, "filter": "warm"},
+                              headers={"Accept": "image/png"})
+    assert Image.open(io.BytesIO(response.body)).size == (512, 256)
+
+    _, response = client.post("/api/apply-filter", json={"handle": handle, "level": 7, "filter": "warm"})
+    assert response.status == 400
+
+
+def test_release_handle(client):
+    """释放后的句柄返回404"""
+    _, response = client.post("/api/pyramids", json={"image": data_url(image_bytes())})
+    handle = response.json["handle"]
+    _, response = client.delete(f"/api/pyramids/{handle}")
+    assert response.status == 200
+    for method, url in (("get", f"/api/pyramids/{handle}"), ("delete", f"/api/pyramids/{handle}")):
+        _, response = getattr(client, method)(url)
+        assert response.status == 404
+    _, response = client.post("/api/adjust-image", json={"handle": handle, "adjustments": {"contrast": 1.1}})
+    assert response.status == 404
+
+
+def test_large_level_is_admitted(client, app_module):
+    """超过 PYRAMID_THREAD_PIXELS 的级别占用像素预算，预算不足时与其他请求一样返回429"""
+    _, response = client.post("/api/pyramids", json={"image": data_url(image_bytes(512, 256))})
+    handle = response.json["handle"]
+    app_module.app.config.PYRAMID_THREAD_PIXELS = 128 * 64
+    admission = app_module.app.ctx.admission
+    admitted = admission.admitted
+
+    _, response = client.post("/api/apply-filter", json={"handle": handle, "level": 1, "filter": "warm"},
+                              headers={"Accept": "image/png"})
+    assert response.status == 200
+    assert Image.open(io.BytesIO(response.body)).size == (256, 128)
+    assert admission.admitted == admitted + 1
+
+    # 不超过阈值的级别在线程中处理，不占用预算
+    _, response = client.post("/api/apply-filter", json={"handle": handle, "level": 2, "filter": "warm"})
+    assert response.status == 200 and admission.admitted == admitted + 1
+
+    admission.pixel_budget = 256 * 128
+    admission.max_wait = 0
+    admission.in_flight = 1
+    _, response = client.post("/api/adjust-image", json={"handle": handle, "level": 1,
+                                                         "adjustments": {"brightness": 1.2}})
+    assert response.status == 429 and response.headers["Retry-After"]
+    admission.in_flight = 0
+
+
+def test_store_bounded_by_bytes():
+    """金字塔总大小超出 max_bytes 时淘汰最久未使用的金字塔，生成新级别后同样检查"""
+    first, second = create_pyramid(image_bytes(512, 256)), create_pyramid(image_bytes(512, 256))
+    store = PreviewStore(16, 1800, name="结果金字塔", max_bytes=first.memory_bytes + second.memory_bytes + 1000)
+    store.add(first)
+    store.add(second)
+    assert store.stats()["sessions"] == 2
+    second.image(1)
+    store.trim()
+    assert store.get(first.id) is None and store.get(second.id) is second
+    assert store.stats()["evicted"] == 1
+    assert store.stats()["memory_bytes"] == second.memory_bytes
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+放大后端策略测试：按基准结果生成策略、按方法和像素数选择后端、读取策略文件
+（文件不存在或格式错误时回退到 pil），以及 Pillow-SIMD 检测
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import resize
+from resize import ResizePolicy, is_pillow_simd, load_policy
+
+
+def case(median_s, output_pixels, status="ok"):
+    return {"status": status, "median_s": median_s, "output_pixels": output_pixels}
+
+
+CASES = {
+    "0.3MP/resize/traditional/pil": case(0.010, 1_200_000),
+    "0.3MP/resize/traditional/opencv": case(0.020, 1_200_000),
+    "2MP/resize/traditional/pil": case(0.080, 8_000_000),
+    "2MP/resize/traditional/opencv": case(0.030, 8_000_000),
+    "12MP/resize/traditional/pil": case(0.500, 48_000_000),
+    "12MP/resize/traditional/opencv": case(0.200, 48_000_000),
+    "2MP/resize/super_clear/pil": case(0.100, 50_000_000),
+    "2MP/resize/super_clear/opencv": case(0.050, 50_000_000, status="error"),
+    "2MP/enhance/traditional": case(1.0, 8_000_000),
+}
+
+
+@pytest.fixture(autouse=True)
+def clear_policy_cache():
+    load_policy.cache_clear()
+    yield
+    load_policy.cache_clear()
+
+
+def test_from_cases():
+    """每个输出像素数选择最快的后端，相邻相同的规则合并，失败和非放大的用例被忽略"""
+    policy = ResizePolicy.from_cases(CASES, kernels={"traditional": "cubic"})
+    assert policy.rules == {"traditional": [(0, "pil"), (8_000_000, "opencv")],
+                            "super_clear": [(0, "pil")]}
+    assert policy.kernel("traditional") == "cubic" and policy.kernel("advanced") == "lanczos"
+
+
+def test_choose():
+    """取不超过输出像素数的最后一条规则，方法没有规则时使用 "*"，都没有时使用 default"""
+    policy = ResizePolicy({"traditional": [[8_000_000, "opencv"], [0, "pil"]], "*": [[100, "opencv"]]})
+    assert policy.choose("traditional", 7_999_999) == "pil"
+    assert policy.choose("traditional", 8_000_000) == "opencv"
+    assert policy.choose("advanced", 99) == "pil"
+    assert policy.choose("advanced", 100) == "opencv"
+    assert ResizePolicy(default="opencv").choose("traditional", 1) == "opencv"
+
+
+def test_invalid_policy():
+    for options in ({"default": "gpu"}, {"rules": {"*": [[0, "gpu"]]}}, {"kernels": {"traditional": "sinc"}}):
+        with pytest.raises(ValueError):
+            ResizePolicy(**options)
+
+
+def test_load_policy_file(tmp_path):
+    """策略文件保存后读取得到相同的规则，配置的插值核覆盖文件中的插值核"""
+    path = tmp_path / "policy.json"
+    path.write_text(json.dumps(ResizePolicy.from_cases(CASES, kernels={"traditional": "cubic"}).to_dict()))
+    policy = load_policy("auto", str(path), (("advanced", "area"),))
+    assert policy.choose("traditional", 8_000_000) == "opencv"
+    assert policy.kernels == {"traditional": "cubic", "advanced": "area"}
+    assert load_policy("pil", str(path)).choose("traditional", 8_000_000) == "pil"
+    assert load_policy("opencv").choose("traditional", 1) == "opencv"
+
+
+@pytest.mark.parametrize("content", [None, "{not json", "[1, 2]", '{"rules": {"*": [[0, "gpu"]]}}'])
+def test_load_policy_fallback(tmp_path, content):
+    """策略文件不存在或格式错误时回退到 pil，保留配置的插值核"""
+    path = tmp_path / "policy.json"
+    if content is not None:
+        path.write_text(content)
+    policy = load_policy("auto", str(path), (("traditional", "cubic"),))
+    assert policy.rules == {} and policy.default == "pil"
+    assert policy.kernel("traditional") == "cubic"
+
+
+def test_pillow_simd_detection(monkeypatch):
+    assert is_pillow_simd("9.5.0.post1")
+    assert not is_pillow_simd("11.0.0")
+    monkeypatch.setattr(resize, "PILLOW_SIMD", True)
+    assert ResizePolicy().describe()["pillow_simd"] is True
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+响应格式协商测试：按 Accept 返回JSON、二进制图片或 multipart/mixed
+"""
+
+import io
+import os
+import sys
+
+from PIL import Image
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from conftest import data_url, image_bytes, parse_multipart
+
+
+def test_upload_binary_response(client):
+    """上传增强时 Accept 为图片类型返回二进制图片，放大倍数放在响应头中"""
+    _, response = client.post("/api/upload", files={"file": ("a.png", image_bytes(), "image/png")},
+                              data={"method": "traditional"}, headers={"Accept": "image/png, application/json"})
+    assert response.status == 200
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["X-Scale-Factor"] == "2"
+    assert Image.open(io.BytesIO(response.body)).size == (96, 64)
+
+
+def test_upload_methods_multipart(client):
+    """同时请求多种方法时 multipart 每种方法一个分段，X-Method 标明方法"""
+    methods = ["advanced", "traditional"]
+    _, response = client.post("/api/upload", files={"file": ("a.png", image_bytes(), "image/png")},
+                              data={"methods": ",".join(methods)}, headers={"Accept": "multipart/mixed, image/webp"})
+    assert response.status == 200
+    parts = parse_multipart(response)
+    assert sorted(headers["X-Method"] for headers, _ in parts) == methods
+    for headers, body in parts:
+        assert headers["Content-Type"] == "image/webp"
+        assert Image.open(io.BytesIO(body)).format == "WEBP"
+
+
+def test_json_preferred_over_image(client):
+    """Accept 中 JSON 排在图片类型前面时返回JSON"""
+    _, response = client.post("/api/apply-filter", json={"image": data_url(image_bytes()), "filter": "warm"},
+                              headers={"Accept": "application/json, image/png"})
+    assert response.status == 200
+    assert response.json["filtered_image"].startswith("data:image/jpeg")
@@ -0,0 +1,351 @@
+"""
+分块处理引擎
+
+大倍率放大时，整幅输出图以及每个滤镜步骤产生的整幅副本会占用数倍于输出尺寸的内存。
+分块引擎把输出划分为若干块，每块连同一圈"光环"（halo，宽度等于后续各滤镜核半径之和）
+一起放大并执行滤镜，只保留块内部写回输出，因此拼接结果与整幅处理一致且没有接缝。
+除输出图本身外，峰值内存由 memory_budget 控制。
+
+依赖全图统计量的阶段（对比度需要全图平均灰度）把阶段链分段：逐段渲染整幅图，渲染上一段时
+顺带统计下一段需要的平均灰度，每个阶段只执行一次。输出只有一块时直接整幅渲染。
+"""
+
+import logging
+import math
+import time
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageStat
+
+from fused import LUMA_WEIGHTS, apply_point_stages, blend_lut, is_point_stage
+from resize import resize_image
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 默认每块的工作内存预算（字节）
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# 最小块边长，避免块太小时光环占比过高
+MIN_TILE_SIZE = 64
+
+# 每块同时存在的工作副本数估计（PIL滤镜链：放大结果、滤镜输出、混合用的退化图、混合结果）
+PIL_WORKING_COPIES = 4
+
+# 插值核在源图上需要的额外像素（LANCZOS4 为4，其余更小）
+RESIZE_PADDING = 4
+
+
+def luma_mean(image):
+    """整幅图的平均灰度，取整方式与 ImageEnhance.Contrast 相同"""
+    return int(ImageStat.Stat(image.convert("L")).mean[0] + 0.5)
+
+
+class KernelStage:
+    """PIL卷积滤镜阶段，如 SHARPEN、EDGE_ENHANCE"""
+
+    def __init__(self, image_filter):
+        self.image_filter = image_filter
+        self.name = image_filter.name
+        self.key = ("kernel", image_filter.name)
+        size = image_filter.filterargs[0]
+        self.radius = max(size) // 2
+
+    def apply(self, tile):
+        return tile.filter(self.image_filter)
+
+
+class ColorStage:
+    """饱和度调整（逐像素）"""
+
+    radius = 0
+    name = "Color"
+
+    def __init__(self, factor):
+        self.factor = factor
+        self.key = (self.name, factor)
+
+    def apply(self, tile):
+        return ImageEnhance.Color(tile).enhance(self.factor)
+
+    def affine(self, mean=None):
+        # 与灰度图混合：out = f * rgb + (1 - f) * L
+        gray = np.outer(np.ones(3), LUMA_WEIGHTS)
+        return self.factor * np.eye(3) + (1 - self.factor) * gray, np.zeros(3)
+
+
+class BrightnessStage:
+    """亮度调整（逐像素）"""
+
+    radius = 0
+    name = "Brightness"
+    diagonal = True
+
+    def __init__(self, factor):
+        self.factor = factor
+        self.key = (self.name, factor)
+
+    def apply(self, tile):
+        return ImageEnhance.Brightness(tile).enhance(self.factor)
+
+    def affine(self, mean=None):
+        return self.factor * np.eye(3), np.zeros(3)
+
+    def lut(self, mean=None):
+        return blend_lut(0, self.factor)
+
+
+class ContrastStage:
+    """对比度调整，需要整幅图的平均灰度，分块时由引擎预先统计后传入"""
+
+    radius = 0
+    name = "Contrast"
+    needs_mean = True
+    diagonal = True
+
+    def __init__(self, factor):
+        self.factor = factor
+        self.key = (self.name, factor)
+
+    def apply(self, tile, mean=None):
+        if mean is None:
+            mean = luma_mean(tile)
+        # 与 ImageEnhance.Contrast 相同：与平均灰度的纯色图混合
+        degenerate = Image.new("L", tile.size, mean).convert(tile.mode)
+        return Image.blend(degenerate, tile, self.factor)
+
+    def affine(self, mean):
+        return self.factor * np.eye(3), np.full(3, (1 - self.factor) * mean)
+
+    def lut(self, mean):
+        return blend_lut(mean, self.factor)
+
+
+class GrayscaleStage:
+    """转换为灰度后再转回RGB（逐像素）"""
+
+    radius = 0
+    name = "Grayscale"
+    key = ("Grayscale",)
+
+    def apply(self, tile):
+        return tile.convert("L").convert("RGB")
+
+    def affine(self, mean=None):
+        return np.outer(np.ones(3), LUMA_WEIGHTS), np.zeros(3)
+
+
+class ArrayStage:
+    """作用于 numpy 数组（OpenCV BGR图）的阶段
+
+    func 接收一个块并返回同尺寸的结果，radius 为该操作的邻域半径，逐像素操作为0。
+    """
+
+    def __init__(self, name, func, radius=0):
+        self.name = name
+        self.func = func
+        self.radius = radius
+        self.key = (name, func)
+
+    def apply(self, tile):
+        return self.func(tile)
+
+
+class TiledEngine:
+    """分块执行引擎"""
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, point_backend="fused", verify_tolerance=None,
+                 resize_backend="pil"):
+        self.memory_budget = memory_budget or DEFAULT_MEMORY_BUDGET
+        self.point_backend = point_backend
+        self.verify_tolerance = verify_tolerance
+        self.resize_backend = resize_backend
+
+    def tile_size(self, halo, working_copies, channels=3):
+        """按内存预算计算块边长（不含光环）"""
+        bytes_per_pixel = channels * working_copies
+        side = int(math.sqrt(self.memory_budget / bytes_per_pixel))
+        return max(side - 2 * halo, MIN_TILE_SIZE)
+
+    def strip_rows(self, width, working_copies, channels=3):
+        """按内存预算计算逐行条带处理时每条的行数"""
+        return max(1, self.memory_budget // (width * channels * working_copies))
+
+    @staticmethod
+    def _record(timings, label, started):
+        """累计阶段耗时（秒），timings 为None时不记录"""
+        if timings is not None:
+            timings[label] = timings.get(label, 0.0) + time.perf_counter() - started
+
+    @staticmethod
+    def _tiles(width, height, tile):
+        for y0 in range(0, height, tile):
+            for x0 in range(0, width, tile):
+                yield x0, y0, min(x0 + tile, width), min(y0 + tile, height)
+
+    @staticmethod
+    def _expand(rect, halo, width, height):
+        x0, y0, x1, y1 = rect
+        return max(0, x0 - halo), max(0, y0 - halo), min(width, x1 + halo), min(height, y1 + halo)
+
+    def run(self, img, scale_factor, stages, resample=Image.Resampling.LANCZOS, timings=None, first_index=0,
+            resize_backend=None):
+        """分块放大 PIL RGB 图像并依次执行 stages，返回整幅结果
+
+        timings 为字典时，按 "序号:阶段名" 累计各块的耗时，统计平均灰度的直方图计入 "stats"；
+        first_index 是 stages[0] 在完整管线中的序号，用于生成耗时标签；
+        resize_backend 为放大后端（pil 或 opencv），为空时使用引擎的默认后端。
+        """
+        resize_backend = resize_backend or self.resize_backend
+        width, height = img.size
+        out_width, out_height = width * scale_factor, height * scale_factor
+        halo = sum(stage.radius for stage in stages)
+        tile = self.tile_size(halo, PIL_WORKING_COPIES)
+        tiles = list(self._tiles(out_width, out_height, tile))
+        logger.info(f"分块处理: 输出 {out_width}x{out_height}, 块大小 {tile}, 光环 {halo}, 共 {len(tiles)} 块")
+
+        if len(tiles) == 1:
+            # 单块时整幅渲染一次，对比度的平均灰度直接取自已渲染的上游结果
+            return self._render(img, scale_factor, stages, tiles[0], {}, resample, timings, first_index,
+                                resize_backend)
+
+        # 在每个对比度阶段处分段：逐段渲染整幅图，上一段渲染时顺带统计下一段需要的平均灰度
+        bounds = [idx for idx, stage in enumerate(stages) if isinstance(stage, ContrastStage)]
+        means = {}
+        output = Image.new("RGB", (out_width, out_height))
+        source, source_scale = img, scale_factor
+        for start, end in zip([0] + bounds, bounds + [len(stages)]):
+            segment = stages[start:end]
+            histogram = np.zeros(256, dtype=np.int64) if end < len(stages) else None
+            segment_means = {idx - start: mean for idx, mean in means.items() if start <= idx < end}
+            self._render_segment(source, source_scale, segment, tiles, output, segment_means, resample, timings,
+                                 first_index + start, resize_backend, histogram)
+            if histogram is not None:
+                mean = float((histogram * np.arange(256)).sum()) / (out_width * out_height)
+                means[end] = int(mean + 0.5)
+                logger.info(f"阶段 {end} 全图平均灰度: {means[end]}")
+            source, source_scale = output, 1
+        return output
+
+    def _render_segment(self, source, scale_factor, stages, tiles, output, means, resample, timings, first_index,
+                        resize_backend, histogram=None):
+        """把一段阶段的结果逐块写入 output，histogram 不为None时累计结果的灰度直方图
+
+        source 可以就是 output：块的结果先暂存，等后续的块不再读取它（光环之外）时再写回，
+        因此只暂存约一行块，不需要第二幅整图。
+        """
+        halo = sum(stage.radius for stage in stages)
+        pending = []
+        row = None
+        for rect in tiles:
+            if rect[1] != row:
+                # 新的一行开始：之后的块最多读到 row - halo 行
+                row = rect[1]
+                while pending and pending[0][0][3] <= row - halo:
+                    rect_done, part_done = pending.pop(0)
+                    output.paste(part_done, rect_done[:2])
+            part = self._render(source, scale_factor, stages, rect, means, resample, timings, first_index,
+                                resize_backend)
+            if histogram is not None:
+                started = time.perf_counter()
+                histogram += np.asarray(part.convert("L").histogram(), dtype=np.int64)
+                self._record(timings, "stats", started)
+            if source is output:
+                pending.append((rect, part))
+            else:
+                output.paste(part, rect[:2])
+        for rect, part in pending:
+            output.paste(part, rect[:2])
+
+    def _render(self, img, scale_factor, stages, rect, means, resample, timings=None, first_index=0,
+                resize_backend="pil"):
+        """渲染一个输出块：带光环放大、执行各阶段、裁掉光环"""
+        out_width, out_height = img.size[0] * scale_factor, img.size[1] * scale_factor
+        halo = sum(stage.radius for stage in stages)
+        ex0, ey0, ex1, ey1 = self._expand(rect, halo, out_width, out_height)
+        # 对齐到源像素边界，使 box 坐标为整数，插值系数与整幅放大逐位一致
+        ex0, ey0 = ex0 - ex0 % scale_factor, ey0 - ey0 % scale_factor
+        ex1 = min(out_width, -(-ex1 // scale_factor) * scale_factor)
+        ey1 = min(out_height, -(-ey1 // scale_factor) * scale_factor)
+
+        # box 参数让 PIL 使用块外的源像素计算插值核，结果与整幅放大一致
+        box = (ex0 / scale_factor, ey0 / scale_factor, ex1 / scale_factor, ey1 / scale_factor)
+        started = time.perf_counter()
+        if scale_factor == 1:
+            part = img.crop(box)
+        else:
+            part = resize_image(img, (ex1 - ex0, ey1 - ey0), resample, resize_backend, box=box)
+        self._record(timings, "resize", started)
+        part = self.apply_stages(part, stages, means, timings, first_index)
+
+        x0, y0, x1, y1 = rect
+        return part.crop((x0 - ex0, y0 - ey0, x1 - ex0, y1 - ey0))
+
+    def apply_stages(self, part, stages, means, timings=None, first_index=0):
+        """依次执行阶段，连续的逐像素阶段合并为一次融合遍历
+
+        means 中缺少的对比度平均灰度按 part 的中间结果统计，part 应为整幅图。
+        """
+        idx = 0
+        while idx < len(stages):
+            started = time.perf_counter()
+            if not is_point_stage(stages[idx]):
+                part = stages[idx].apply(part)
+                self._record(timings, f"{first_index + idx}:{stages[idx].name}", started)
+                idx += 1
+                continue
+            if getattr(stages[idx], "needs_mean", False) and idx not in means:
+                # 缺少平均灰度时按当前的整幅中间结果精确统计
+                means = dict(means)
+                means[idx] = luma_mean(part)
+            end = idx + 1
+            # 缺少平均灰度的对比度阶段另起一组，在前面的阶段执行后再统计
+            while end < len(stages) and is_point_stage(stages[end]) and not (
+                    getattr(stages[end], "needs_mean", False) and end not in means):
+                end += 1
+            group_means = {i - idx: means[i] for i in range(idx, end) if i in means}
+            part = apply_point_stages(part, stages[idx:end], group_means,
+                                      backend=self.point_backend, verify_tolerance=self.verify_tolerance,
+                                      before_kernel=not all(is_point_stage(stage) for stage in stages[end:]))
+            label = "+".join(stage.name for stage in stages[idx:end])
+            self._record(timings, f"{first_index + idx}:{label}", started)
+            idx = end
+        return part
+
+    def run_array(self, arr, scale_factor, stages, resize, working_copies=PIL_WORKING_COPIES, timings=None):
+        """分块放大 numpy 图像并依次执行 ArrayStage，返回整幅结果
+
+        resize(crop, (width, height)) 负责放大源图的一个裁剪区域，例如 cv2.resize；
+        timings 为字典时按 "resize" 和 "序号:阶段名" 累计各块的耗时。
+        """
+        height, width = arr.shape[:2]
+        out_width, out_height = width * scale_factor, height * scale_factor
+        channels = arr.shape[2] if arr.ndim == 3 else 1
+        halo = sum(stage.radius for stage in stages)
+        tile = self.tile_size(halo, working_copies, channels)
+        output = np.empty((out_height, out_width) + arr.shape[2:], dtype=arr.dtype)
+        logger.info(f"分块处理: 输出 {out_width}x{out_height}, 块大小 {tile}, 光环 {halo}")
+
+        for rect in self._tiles(out_width, out_height, tile):
+            ex0, ey0, ex1, ey1 = self._expand(rect, halo, out_width, out_height)
+
+            # 源图裁剪区域需要额外包含插值核覆盖的像素
+            sx0 = max(0, ex0 // scale_factor - RESIZE_PADDING)
+            sy0 = max(0, ey0 // scale_factor - RESIZE_PADDING)
+            sx1 = min(width, -(-ex1 // scale_factor) + RESIZE_PADDING)
+            sy1 = min(height, -(-ey1 // scale_factor) + RESIZE_PADDING)
+            started = time.perf_counter()
+            part = resize(arr[sy0:sy1, sx0:sx1],
+                          ((sx1 - sx0) * scale_factor, (sy1 - sy0) * scale_factor))
+            ox, oy = sx0 * scale_factor, sy0 * scale_factor
+            part = np.ascontiguousarray(part[ey0 - oy:ey1 - oy, ex0 - ox:ex1 - ox])
+            self._record(timings, "resize", started)
+
+            for idx, stage in enumerate(stages):
+                started = time.perf_counter()
+                part = stage.apply(part)
+                self._record(timings, f"{idx}:{stage.name}", started)
+
+            x0, y0, x1, y1 = rect
+            output[y0:y1, x0:x1] = part[y0 - ey0:y1 - ey0, x0 - ex0:x1 - ex0]
+        return output